@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Measures the transfers of the remote cache of waflib/extras/wafcache.py (WAFCACHE=http://...)
+with and without the archives of WAFCACHE_COMPRESSION, against a local server storing the
+files in a temporary folder. The server may delay the requests to emulate the network latency.
+
+Usage:
+./cachebench.py [amount of tasks] [amount of files per task] [latency in ms]
+./cachebench.py --serve [port] [folder] [latency in ms]
+
+For example:
+./cachebench.py 200 3 5
+
+The server alone may be used as a stand-in for a cache server:
+./cachebench.py --serve 8080 /tmp/cache
+WAFCACHE=http://localhost:8080/files waf build
+"""
+
+import os, sys, json, time, tempfile, shutil, threading, importlib.util
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WAFLIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'waflib')
+sys.path.insert(0, os.path.join(WAFLIB, '..'))
+
+class handler(BaseHTTPRequestHandler):
+	# keep the connections open
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, *k):
+		pass
+
+	def get_path(self):
+		path = os.path.normpath(self.path.lstrip('/'))
+		if path.startswith('..'):
+			raise ValueError(self.path)
+		return os.path.join(self.server.folder, path)
+
+	def reply(self, status, data=b''):
+		self.send_response(status)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+		self.server.sent += len(data)
+
+	def do_GET(self):
+		time.sleep(self.server.latency)
+		try:
+			with open(self.get_path(), 'rb') as f:
+				data = f.read()
+		except (EnvironmentError, ValueError):
+			self.reply(404)
+		else:
+			self.reply(200, data)
+
+	def read_body(self):
+		if self.headers.get('Transfer-Encoding') != 'chunked':
+			return self.rfile.read(int(self.headers['Content-Length']))
+		lst = []
+		while 1:
+			size = int(self.rfile.readline().split(b';')[0], 16)
+			if not size:
+				# trailers
+				while self.rfile.readline() not in (b'\r\n', b''):
+					pass
+				return b''.join(lst)
+			lst.append(self.rfile.read(size))
+			self.rfile.readline()
+
+	def do_POST(self):
+		time.sleep(self.server.latency)
+		body = self.read_body()
+		self.server.received += len(body)
+		if self.path.endswith('/query'):
+			# lookups of cache entries (WAFCACHE_PREFETCH)
+			folder = os.path.dirname(self.get_path())
+			found = [x for x in body.decode().split() if not os.path.normpath(x).startswith('..') and os.path.isfile(os.path.join(folder, x))]
+			self.reply(200, json.dumps({'found': found}).encode())
+			return
+		msg = BytesParser().parsebytes(b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + body)
+		for part in msg.get_payload():
+			if part.get_param('name', header='content-disposition') == 'file':
+				path = self.get_path()
+				try:
+					os.makedirs(os.path.dirname(path))
+				except OSError:
+					pass
+				with open(path, 'wb') as f:
+					f.write(part.get_payload(decode=True))
+				self.reply(200)
+				return
+		self.reply(400)
+
+def serve(port, folder, latency=0):
+	server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+	server.folder = folder
+	server.latency = latency
+	server.sent = server.received = 0
+	return server
+
+def load_wafcache(url, compression):
+	os.environ['WAFCACHE'] = url
+	os.environ['WAFCACHE_COMPRESSION'] = compression
+	spec = importlib.util.spec_from_file_location('wafcache_' + (compression or 'files'), os.path.join(WAFLIB, 'extras', 'wafcache.py'))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def generate(folder, tasks, files):
+	# outputs with the redundancy of object files: source code and binary data
+	data = b''
+	for x in sorted(os.listdir(WAFLIB)):
+		if x.endswith('.py'):
+			with open(os.path.join(WAFLIB, x), 'rb') as f:
+				data += f.read()
+	ret = []
+	for i in range(tasks):
+		lst = []
+		for j in range(files):
+			path = os.path.join(folder, 'out_%d_%d' % (i, j))
+			k = (i * files + j) * 7919 % len(data)
+			with open(path, 'wb') as f:
+				f.write(data[k:k + 100000] + os.urandom(20000))
+			lst.append(path)
+		ret.append(('%064x' % i, lst))
+	return ret
+
+def main(argv):
+	if len(argv) > 1 and argv[1] == '--serve':
+		port = int(argv[2]) if len(argv) > 2 else 8080
+		folder = argv[3] if len(argv) > 3 else tempfile.mkdtemp()
+		latency = float(argv[4]) / 1000. if len(argv) > 4 else 0
+		print('Serving %r on port %d' % (folder, port))
+		serve(port, folder, latency).serve_forever()
+		return
+
+	tasks = int(argv[1]) if len(argv) > 1 else 200
+	files = int(argv[2]) if len(argv) > 2 else 3
+	latency = float(argv[3]) / 1000. if len(argv) > 3 else 0.005
+
+	folder = tempfile.mkdtemp()
+	server = serve(0, os.path.join(folder, 'server'), latency)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	try:
+		outputs = generate(folder, tasks, files)
+		size = sum(os.path.getsize(x) for (_, lst) in outputs for x in lst)
+		print('%d tasks, %d files, %.1fMB, latency %.1fms' % (tasks, tasks * files, size / 1e6, latency * 1000))
+
+		for compression in ('', 'none', 'zlib', 'zstd'):
+			url = 'http://127.0.0.1:%d/%s' % (server.server_address[1], compression or 'files')
+			wafcache = load_wafcache(url, compression)
+			if compression == 'zstd' and not wafcache.zstandard:
+				print('%s: unavailable' % compression)
+				continue
+			service = wafcache.netcache()
+
+			server.sent = server.received = 0
+			t = time.time()
+			for sig, lst in outputs:
+				ret = service.copy_to_cache(sig, lst, [])
+				assert ret == wafcache.OK, ret
+			t1 = time.time() - t
+
+			sigs = [sig for sig, _ in outputs]
+			found = service.query(sigs + ['f' * 64])
+			assert found == sigs, found
+
+			t = time.time()
+			for sig, lst in outputs:
+				ret = service.copy_from_cache(sig, [], [x + '.copy' for x in lst])
+				assert ret == wafcache.OK, ret
+			t2 = time.time() - t
+
+			for sig, lst in outputs:
+				for x in lst:
+					with open(x, 'rb') as f, open(x + '.copy', 'rb') as g:
+						assert f.read() == g.read()
+					os.remove(x + '.copy')
+
+			print('%-12s upload %.2fs (%.1fMB sent), download %.2fs (%.1fMB received)' % (
+				compression or 'file/request', t1, server.received / 1e6, t2, server.sent / 1e6))
+	finally:
+		server.shutdown()
+		shutil.rmtree(folder)
+
+if __name__ == '__main__':
+	main(sys.argv)
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Compares the c/c++ dependency scanner (waflib.Tools.c_preproc) with the dependency
+files written by the compiler (see waflib.Tools.c_config.check_compiler_deps) on
+the synthetic project of preprocbench.py. The compiler overhead of writing the
+dependency files is measured on the first sources.
+
+Usage:
+./depsbench.py [amount of headers] [amount of source files] [compiler]
+
+For example:
+./depsbench.py 10000 1000 gcc
+"""
+
+import os, sys, time, tempfile, shutil, subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from waflib import ConfigSet, Context
+from waflib.Tools import c_preproc, ccroot
+import preprocbench
+
+DEFINES = ['FEATURE_1', 'FEATURE_3=1', 'VERSION_MAJOR=2', 'VERSION_MINOR=15', 'LEVEL(x)=(x+1)']
+
+COMPILED = 100
+"""Amount of sources compiled to measure the overhead of the dependency files"""
+
+def get_context(folder):
+	ctx = Context.Context(run_dir=folder)
+	ctx.srcnode = ctx.path
+	ctx.bldnode = ctx.path.make_node('build')
+	return ctx
+
+def compile(folder, sources, cc, flags):
+	cmd = [cc, '-I%s' % os.path.join(folder, 'include')] + ['-D%s' % x for x in DEFINES] + flags
+	t = time.time()
+	for i in range(sources):
+		src = os.path.join(folder, 'src', 'f%d.c' % i)
+		subprocess.check_call(cmd + ['-c', src, '-o', os.path.join(folder, 'build', 'f%d.o' % i)])
+	return time.time() - t
+
+def scan(folder, sources):
+	ctx = get_context(folder)
+	incdir = ctx.root.find_dir(os.path.join(folder, 'include'))
+	env = ConfigSet.ConfigSet()
+	env.DEFINES = DEFINES
+	nodes = [ctx.root.find_node(os.path.join(folder, 'src', 'f%d.c' % i)) for i in range(sources)]
+
+	ret = {}
+	t = time.time()
+	for node in nodes:
+		tmp = c_preproc.c_parser([incdir])
+		tmp.start(node, env)
+		ret[node.name] = set(x.abspath() for x in tmp.nodes)
+	return time.time() - t, ret
+
+def read_deps(folder, sources):
+	ctx = get_context(folder)
+	cwd = ctx.bldnode
+	ret = {}
+	t = time.time()
+	for i in range(sources):
+		path = os.path.join(folder, 'build', 'f%d.d' % i)
+		with open(path) as f:
+			txt = f.read()
+		nodes = ccroot.resolve_compiler_deps(ctx, ccroot.parse_compiler_deps(txt), cwd)
+		ret['f%d.c' % i] = set(x.abspath() for x in nodes[1:])
+	return time.time() - t, ret
+
+def main(argv):
+	headers = int(argv[1]) if len(argv) > 1 else 10000
+	sources = int(argv[2]) if len(argv) > 2 else 1000
+	cc = argv[3] if len(argv) > 3 else 'gcc'
+	folder = tempfile.mkdtemp()
+	try:
+		preprocbench.generate(folder, headers, sources)
+		os.makedirs(os.path.join(folder, 'build'))
+
+		count = min(COMPILED, sources)
+		t1 = compile(folder, count, cc, [])
+		t2 = compile(folder, count, cc, ['-MMD'])
+		print('compilation of %d sources: %.2fs, with -MMD: %.2fs (%+.1f%%)' % (count, t1, t2, 100. * (t2 - t1) / t1))
+
+		# only the dependency files are needed for the remaining sources
+		cmd = [cc, '-I%s' % os.path.join(folder, 'include')] + ['-D%s' % x for x in DEFINES]
+		for i in range(count, sources):
+			src = os.path.join(folder, 'src', 'f%d.c' % i)
+			subprocess.check_call(cmd + ['-MM', src, '-MF', os.path.join(folder, 'build', 'f%d.d' % i)])
+
+		t1, deps1 = scan(folder, sources)
+		print('c_preproc: %d sources in %.2fs (%.1f sources/s)' % (sources, t1, sources / t1))
+		t2, deps2 = read_deps(folder, sources)
+		print('dependency files: %d sources in %.2fs (%.1f sources/s)' % (sources, t2, sources / t2))
+		diff = [x for x in deps1 if deps1[x] != deps2[x]]
+		print('%d dependencies, %d sources with different results' % (sum(len(x) for x in deps2.values()), len(diff)))
+	finally:
+		shutil.rmtree(folder)
+
+if __name__ == '__main__':
+	main(sys.argv)
@@ -19,6 +19,11 @@ For example:
 To try the waf part, do:
 waf configure build -p -j5
 
+To measure the task scheduling overhead (one copy task per header, tasks/second
+reported at the end of the build), with one thread per task or a pool of threads:
+waf configure build -j16 --copy-headers
+waf clean build -j16 --copy-headers --pool
+
 To test the autotools part, do:
 touch README AUTHORS NEWS ChangeLog &&
 autoreconf --install --symlink --verbose &&
@@ -257,25 +262,42 @@ APPNAME = 'build_bench'
 top  = '.'
 out  = 'out'
 
+import time
+from waflib import Runner
+
 def options(opt):
 	opt.load('compiler_cxx')
+	opt.add_option('--pool', action='store_true', default=False, help='execute the tasks in a fixed pool of threads')
+	opt.add_option('--copy-headers', action='store_true', default=False, dest='copy_headers', help='copy the headers only (benchmark the scheduler)')
 
 def configure(conf):
 	conf.load('compiler_cxx')
 
 def build(bld):
+	Runner.POOL = bld.options.pool
 	for i in range(%d):
+		if bld.options.copy_headers:
+			for j in range(%d):
+				bld(features='subst', source='lib_%%d/class_%%d.h' %% (i, j), target='lib_%%d/class_%%d.h' %% (i, j), is_copy=True)
+			continue
 		filez = ' '.join(['lib_%%d/class_%%d.cpp' %% (i, j) for j in range(%d)])
 		bld.stlib(
 			source = filez,
 			target = 'lib_%%d' %% i,
 			includes = '.', # include the top-level
 		)
+
+	start = time.time()
+	def report(bld):
+		count = bld.total()
+		duration = time.time() - start
+		print('%%d tasks in %%.3fs: %%.1f tasks/s' %% (count, duration, count / duration))
+	bld.add_post_fun(report)
 """
 
 def createWtop(libs, classes):
 	f = open('wscript', 'w')
-	f.write(WT % (libs, classes))
+	f.write(WT % (libs, classes, classes))
 	f.close()
 
 def createFullSolution(libs):
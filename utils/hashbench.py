@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Measures the throughput of the hash functions used for file and task signatures
+(see waflib.Utils.HASH and waflib.Utils.MMAP_SIZE)
+
+Usage:
+./hashbench.py [size in MB] [amount of small files]
+
+For example:
+./hashbench.py 512 20000
+"""
+
+import os, sys, time, tempfile, shutil, subprocess
+
+def child(folder):
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+	from waflib import Utils
+
+	big = os.path.join(folder, 'big')
+	size = os.path.getsize(big)
+	small = [os.path.join(folder, 'small', x) for x in os.listdir(os.path.join(folder, 'small'))]
+
+	def bench(name, fun, count, unit):
+		fun() # warm up the page cache
+		t = time.time()
+		fun()
+		t = time.time() - t
+		print('%-8s %-28s %10.1f %s/s' % (Utils.HASH, name, count / t, unit))
+
+	def h_big():
+		Utils.h_file(big)
+
+	mmap_size = Utils.MMAP_SIZE
+	Utils.MMAP_SIZE = 0
+	bench('h_file large (read)', h_big, size / 1048576., 'MB')
+	Utils.MMAP_SIZE = mmap_size
+	bench('h_file large (mmap)', h_big, size / 1048576., 'MB')
+
+	def h_small():
+		for x in small:
+			Utils.h_file(x)
+	bench('h_file small', h_small, len(small), 'files')
+
+	lst = [['-I/usr/include/foo%d' % i, '-DBAR=%d' % i, '/some/path/file_%d.cpp' % i] for i in range(100)]
+	def h_lists():
+		for i in range(20000):
+			Utils.h_list(lst)
+	bench('h_list', h_lists, 20000, 'lists')
+
+	sigs = [Utils.h_list(i) for i in range(50)]
+	def signatures():
+		for i in range(50000):
+			m = Utils.md5(Utils.SIG_NIL)
+			for x in sigs:
+				m.update(x)
+			m.digest()
+	bench('task signature (50 deps)', signatures, 50000, 'tasks')
+
+def main(argv):
+	size = int(argv[1]) if len(argv) > 1 else 256
+	count = int(argv[2]) if len(argv) > 2 else 10000
+
+	folder = tempfile.mkdtemp()
+	try:
+		with open(os.path.join(folder, 'big'), 'wb') as f:
+			chunk = os.urandom(1048576)
+			for i in range(size):
+				f.write(chunk)
+		os.mkdir(os.path.join(folder, 'small'))
+		for i in range(count):
+			with open(os.path.join(folder, 'small', 'f%d.h' % i), 'wb') as f:
+				f.write(os.urandom(i % 8192))
+
+		for name in ('md5', 'blake2b'):
+			env = dict(os.environ)
+			env['WAF_HASH'] = name
+			subprocess.check_call([sys.executable, os.path.abspath(__file__), '--child', folder], env=env)
+	finally:
+		shutil.rmtree(folder)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 2 and sys.argv[1] == '--child':
+		child(sys.argv[2])
+	else:
+		main(sys.argv)
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Measures the time spent posting task generators (creating the tasks) on a synthetic
+project of static libraries in the style of genbench.py; the build is not executed
+
+Usage:
+./postbench.py [amount of targets] [amount of source files per target] [--profile]
+
+For example:
+./postbench.py 10000 2 --profile
+"""
+
+import os, sys, time, tempfile, shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from waflib import Build, ConfigSet, Context, Options
+from waflib.Tools import cxx, gxx
+
+def generate(folder, targets, sources):
+	for i in range(targets):
+		os.makedirs(os.path.join(folder, 'lib_%d' % i))
+		for j in range(sources):
+			with open(os.path.join(folder, 'lib_%d' % i, 'class_%d.cpp' % j), 'w') as f:
+				f.write('int f_%d_%d() { return 0; }\n' % (i, j))
+
+def get_context(folder):
+	Options.OptionsContext().parse_args([])
+	Context.top_dir = Context.run_dir = folder
+	Context.out_dir = os.path.join(folder, 'build')
+	bld = Build.BuildContext(top_dir=folder, out_dir=Context.out_dir)
+	bld.init_dirs()
+
+	env = ConfigSet.ConfigSet()
+	env.CXX = ['g++']
+	env.AR = ['ar']
+	env.CXX_NAME = 'gcc'
+	env.DEST_OS = 'linux'
+	env.DEST_BINFMT = 'elf'
+	bld.all_envs[''] = env
+
+	# the compiler is not executed
+	class conf(object):
+		pass
+	conf.env = env
+	gxx.gxx_common_flags(conf)
+	gxx.gxx_modifier_platform(conf)
+	return bld
+
+def declare(bld, targets, sources):
+	for i in range(targets):
+		bld.stlib(
+			source = ['lib_%d/class_%d.cpp' % (i, j) for j in range(sources)],
+			target = 'lib_%d' % i,
+			includes = '.',
+			use = i % 10 and 'lib_%d' % (i - 1) or '')
+
+def post(bld):
+	t = time.time()
+	bld.post_mode = Build.POST_AT_ONCE
+	bld.targets = '*'
+	for i in range(len(bld.groups)):
+		bld.current_group = i
+		bld.post_group()
+	return time.time() - t
+
+def main(argv):
+	profile = '--profile' in argv
+	argv = [x for x in argv if x != '--profile']
+	targets = int(argv[1]) if len(argv) > 1 else 10000
+	sources = int(argv[2]) if len(argv) > 2 else 2
+	folder = tempfile.mkdtemp()
+	try:
+		generate(folder, targets, sources)
+		bld = get_context(folder)
+		t = time.time()
+		declare(bld, targets, sources)
+		print('%d task generators declared in %.2fs' % (targets, time.time() - t))
+
+		if profile:
+			import cProfile, pstats
+			prof = cProfile.Profile()
+			prof.enable()
+		t = post(bld)
+		if profile:
+			prof.disable()
+			pstats.Stats(prof).sort_stats('tottime').print_stats(20)
+
+		count = sum(len(tg.tasks) for tg in bld.groups[0])
+		print('%d task generators posted in %.2fs (%.1f/s, %d tasks)' % (targets, t, targets / t, count))
+	finally:
+		shutil.rmtree(folder)
+
+if __name__ == '__main__':
+	main(sys.argv)
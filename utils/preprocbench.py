@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Measures the speed of the c/c++ dependency scanner (waflib.Tools.c_preproc) on a synthetic
+tree of headers using include guards, macros and conditional includes
+
+Usage:
+./preprocbench.py [amount of headers] [amount of source files]
+
+For example:
+./preprocbench.py 10000 2000
+"""
+
+import os, sys, time, random, tempfile, shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from waflib import ConfigSet, Context
+from waflib.Tools import c_preproc
+
+LIBRARY_SIZE = 100
+"""The headers are split in libraries, and only include headers from the same library"""
+
+def header(i, count, rnd):
+	lst = ['/* header %d */' % i, '#ifndef HEADER_%d_H' % i, '#define HEADER_%d_H' % i, '']
+	end = min(count, (i // LIBRARY_SIZE + 1) * LIBRARY_SIZE)
+	for k in range(3):
+		if i + 1 >= end:
+			break
+		j = rnd.randrange(i + 1, end)
+		if k == 1:
+			lst.append('#if defined(FEATURE_%d) && (VERSION_MAJOR * 100 + VERSION_MINOR) >= %d' % (j % 10, j % 300))
+			lst.append('#include "d%d/h%d.h"' % (j // LIBRARY_SIZE, j))
+			lst.append('#elif !defined(NO_FALLBACK) || LEVEL(%d) > 2' % (j % 7))
+			lst.append('#include <d%d/h%d.h>' % (j // LIBRARY_SIZE, j))
+			lst.append('#endif')
+		else:
+			lst.append('#include "d%d/h%d.h"' % (j // LIBRARY_SIZE, j))
+	lst.append('#define MACRO_%d(x, y) ((x) * %d + (y) / 2)' % (i, i))
+	lst.append('#define VALUE_%d 0x%xUL' % (i, i))
+	lst.append('/* some declarations */')
+	for k in range(20):
+		lst.append('int function_%d_%d(const char *s, /* comment */ int n); // "string"' % (i, k))
+	lst.append('#endif /* HEADER_%d_H */' % i)
+	return '\n'.join(lst) + '\n'
+
+def generate(folder, headers, sources):
+	rnd = random.Random(0)
+	for d in range((headers + LIBRARY_SIZE - 1) // LIBRARY_SIZE):
+		os.makedirs(os.path.join(folder, 'include', 'd%d' % d))
+	for i in range(headers):
+		with open(os.path.join(folder, 'include', 'd%d' % (i // LIBRARY_SIZE), 'h%d.h' % i), 'w') as f:
+			f.write(header(i, headers, rnd))
+	os.makedirs(os.path.join(folder, 'src'))
+	for i in range(sources):
+		lst = ['#include "d%d/h%d.h"' % (j // LIBRARY_SIZE, j) for j in rnd.sample(range(headers), 8)]
+		lst.append('int main_%d(void) { return 0; }' % i)
+		with open(os.path.join(folder, 'src', 'f%d.c' % i), 'w') as f:
+			f.write('\n'.join(lst) + '\n')
+
+def scan(folder, sources):
+	ctx = Context.Context(run_dir=folder)
+	ctx.srcnode = ctx.path
+	ctx.bldnode = ctx.path.make_node('build')
+	incdir = ctx.root.find_dir(os.path.join(folder, 'include'))
+	env = ConfigSet.ConfigSet()
+	env.DEFINES = ['FEATURE_1', 'FEATURE_3=1', 'VERSION_MAJOR=2', 'VERSION_MINOR=15', 'LEVEL(x)=(x+1)']
+
+	nodes = [ctx.root.find_node(os.path.join(folder, 'src', 'f%d.c' % i)) for i in range(sources)]
+	count = 0
+	t = time.time()
+	for node in nodes:
+		tmp = c_preproc.c_parser([incdir])
+		tmp.start(node, env)
+		count += len(tmp.nodes)
+	t = time.time() - t
+	print('%d sources scanned in %.2fs (%.1f sources/s, %d dependencies)' % (sources, t, sources / t, count))
+
+def main(argv):
+	headers = int(argv[1]) if len(argv) > 1 else 10000
+	sources = int(argv[2]) if len(argv) > 2 else 1000
+	folder = tempfile.mkdtemp()
+	try:
+		generate(folder, headers, sources)
+		scan(folder, sources)
+	finally:
+		shutil.rmtree(folder)
+
+if __name__ == '__main__':
+	main(sys.argv)
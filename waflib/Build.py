@@ -10,6 +10,7 @@ The inheritance tree is the following:
 """
 
 import os, sys, errno, re, shutil, stat
+from io import BytesIO
 try:
 	import cPickle
 except ImportError:
@@ -28,7 +29,7 @@ INSTALL = 1337
 UNINSTALL = -1337
 """Negative value '<-' uninstall, see :py:attr:`waflib.Build.BuildContext.is_install`"""
 
-SAVED_ATTRS = 'root node_sigs task_sigs imp_sigs raw_deps node_deps'.split()
+SAVED_ATTRS = 'root node_sigs task_sigs imp_sigs raw_deps node_deps task_times task_rss file_sigs tg_stamps preproc_lines'.split()
 """Build class members to save between the runs; these should be all dicts
 except for `root` which represents a :py:class:`waflib.Node.Node` instance
 """
@@ -42,10 +43,51 @@ POST_AT_ONCE = 0
 POST_LAZY = 1
 """Post mode: post the task generators group after group, the tasks in the next group are created when the tasks in the previous groups are done"""
 
+STAMP_IGNORED_OPTIONS = 'colors jobs keep verbose zones profile pdb whelp progress_bar targets files max_memory max_load destdir force'.split()
+"""Command-line options without effect on the tasks created, see :py:meth:`waflib.Build.BuildContext.get_tg_stamp_sig`"""
+
+STAMP_IGNORED_MODULES = ['waflib.Tools.errcheck']
+"""Modules loaded depending on the command-line options (``-v``), see :py:meth:`waflib.Build.BuildContext.get_tg_stamp_sig`"""
+
 PROTOCOL = -1
 if sys.platform == 'cli':
 	PROTOCOL = 0
 
+def stamp_repr(val):
+	"""
+	Represents a task generator attribute for :py:meth:`waflib.Build.BuildContext.get_tg_stamp_sig`
+
+	:raises: ValueError if the value has no stable representation
+	:rtype: string
+	"""
+	if isinstance(val, (list, tuple)):
+		return '[%s]' % ','.join(stamp_repr(x) for x in val)
+	elif isinstance(val, (set, frozenset)):
+		return '{%s}' % ','.join(sorted(stamp_repr(x) for x in val))
+	elif isinstance(val, dict):
+		return '{%s}' % ','.join(sorted('%s:%s' % (stamp_repr(k), stamp_repr(v)) for (k, v) in val.items()))
+	elif isinstance(val, Node.Node):
+		return 'N:' + val.abspath()
+	elif isinstance(val, ConfigSet.ConfigSet):
+		return stamp_repr(val.get_merged_dict())
+	elif isinstance(val, TaskGen.task_gen):
+		return 'T:%s:%d' % (val.path.abspath(), val.idx)
+	elif isinstance(val, (str, bytes, int, float, type(None))):
+		return repr(val)
+	elif hasattr(val, '__code__'):
+		if getattr(val, '__self__', None) is not None:
+			raise ValueError('No stable representation for the method %r' % val)
+		# functions, including the values of their closures and default arguments
+		lst = [Utils.h_fun(val)]
+		for cell in getattr(val, '__closure__', None) or ():
+			lst.append(stamp_repr(cell.cell_contents))
+		lst.append(stamp_repr(getattr(val, '__defaults__', None)))
+		return repr(lst)
+	ret = repr(val)
+	if ' at 0x' in ret or ' object at ' in ret:
+		raise ValueError('No stable representation for %r' % ret)
+	return ret
+
 class BuildContext(Context.Context):
 	'''executes the build'''
 
@@ -73,6 +115,18 @@ class BuildContext(Context.Context):
 		self.post_mode = POST_LAZY
 		"""Whether to post the task generators at once or group-by-group (default is group-by-group)"""
 
+		self.incremental_post = False
+		"""
+		Whether to skip posting the task generators unchanged since the previous build, see :py:meth:`waflib.Build.BuildContext.get_unchanged_tgs`.
+		This is disabled by default because the methods of the task generators may read anything (files, global variables).
+		"""
+
+		self.unchanged_tgs = set()
+		"""Task generators that are not posted by :py:meth:`waflib.Build.BuildContext.post_group` in the current build"""
+
+		self.post_skipped = []
+		"""List of (group index, task generator) skipped by :py:meth:`waflib.Build.BuildContext.post_group`"""
+
 		self.cache_dir = kw.get('cache_dir')
 		if not self.cache_dir:
 			self.cache_dir = os.path.join(self.out_dir, CACHE_DIR)
@@ -98,6 +152,25 @@ class BuildContext(Context.Context):
 		self.raw_deps = {}
 		"""Dict mapping task identifiers (uid) to custom data returned by :py:meth:`waflib.Task.Task.scan` (persists across builds)"""
 
+		self.file_sigs = {}
+		"""Dict mapping absolute file paths to their status and hash, see :py:meth:`waflib.Node.Node.h_file` (persists across builds)"""
+
+		self.task_times = {}
+		"""Dict mapping task identifiers (uid) to the duration in seconds of their last execution, used
+		by :py:meth:`waflib.Runner.Parallel.prio_and_split` to run the longest task chains first (persists across builds)"""
+
+		self.task_rss = {}
+		"""Dict mapping task identifiers (uid) to the peak memory usage in kB of their sub-processes, used
+		by :py:class:`waflib.Runner.Admission` to avoid running out of memory (persists across builds)"""
+
+		self.tg_stamps = {}
+		"""Dict mapping task generators (folder, index) to the signature of their declaration and of their manual dependencies, the status
+		of the files used by their tasks and the outputs of their tasks, see :py:meth:`waflib.Build.BuildContext.store_tg_stamps` (persists across builds)"""
+
+		self.preproc_lines = {}
+		"""Dict mapping the nodes of the files to their signature and to their preprocessor lines, used by
+		:py:mod:`waflib.Tools.c_preproc` when :py:const:`waflib.Tools.c_preproc.PERSISTENT_LINES` is set (persists across builds)"""
+
 		self.task_gen_cache_names = {}
 
 		self.jobs = Options.options.jobs
@@ -109,6 +182,12 @@ class BuildContext(Context.Context):
 		self.keep = Options.options.keep
 		"""Whether the build should continue past errors"""
 
+		self.max_memory = Options.options.max_memory
+		"""Memory budget in MB for the tasks running in parallel, see :py:class:`waflib.Runner.Admission`"""
+
+		self.max_load = Options.options.max_load
+		"""Do not start new tasks while the system load average exceeds this value, see :py:class:`waflib.Runner.Admission`"""
+
 		self.progress_bar = Options.options.progress_bar
 		"""
 		Level of progress status:
@@ -284,18 +363,26 @@ class BuildContext(Context.Context):
 			# handle missing file/empty file
 			Logs.debug('build: Could not load the build cache %s (missing)', dbfn)
 		else:
-			try:
-				Node.pickle_lock.acquire()
-				Node.Nod3 = self.node_class
+			# the node tree is restored first, and lazily (see Node.set_tree_state)
+			# then the Node objects found in the data are obtained from their paths
+			cache = {}
+			def persistent_load(path):
 				try:
-					data = cPickle.loads(data)
-				except Exception as e:
-					Logs.debug('build: Could not pickle the build cache %s: %r', dbfn, e)
-				else:
-					for x in SAVED_ATTRS:
+					return cache[path]
+				except KeyError:
+					node = cache[path] = self.root.make_node(path)
+					return node
+			try:
+				unpickler = cPickle.Unpickler(BytesIO(data))
+				unpickler.persistent_load = persistent_load
+				self.root.set_tree_state(unpickler.load())
+				data = unpickler.load()
+			except Exception as e:
+				Logs.debug('build: Could not pickle the build cache %s: %r', dbfn, e)
+			else:
+				for x in SAVED_ATTRS:
+					if x != 'root':
 						setattr(self, x, data.get(x, {}))
-			finally:
-				Node.pickle_lock.release()
 
 		self.init_dirs()
 
@@ -306,15 +393,22 @@ class BuildContext(Context.Context):
 		"""
 		data = {}
 		for x in SAVED_ATTRS:
-			data[x] = getattr(self, x)
+			if x != 'root':
+				data[x] = getattr(self, x)
 		db = os.path.join(self.variant_dir, Context.DBFILE)
 
-		try:
-			Node.pickle_lock.acquire()
-			Node.Nod3 = self.node_class
-			x = cPickle.dumps(data, PROTOCOL)
-		finally:
-			Node.pickle_lock.release()
+		# the node tree is written separately, and the Node objects
+		# found in the data are replaced by their absolute paths
+		def persistent_id(obj):
+			if isinstance(obj, Node.Node):
+				return obj.abspath()
+			return None
+		buf = BytesIO()
+		pickler = cPickle.Pickler(buf, PROTOCOL)
+		pickler.persistent_id = persistent_id
+		pickler.dump(self.root.get_tree_state())
+		pickler.dump(data)
+		x = buf.getvalue()
 
 		Utils.writef(db + '.tmp', x, m='wb')
 
@@ -338,17 +432,22 @@ class BuildContext(Context.Context):
 		"""
 		Logs.debug('build: compile()')
 
+		if self.incremental_post and not self.is_install and self.targets in ('', '*'):
+			self.unchanged_tgs = self.get_unchanged_tgs()
+
 		# delegate the producer-consumer logic to another object to reduce the complexity
 		self.producer = Runner.Parallel(self, self.jobs)
 		self.producer.biter = self.get_build_iterator()
 		try:
 			self.producer.start()
 		except KeyboardInterrupt:
-			if self.is_dirty():
+			if self.store_tg_stamps() or self.is_dirty():
 				self.store()
 			raise
 		else:
-			if self.is_dirty():
+			if self.store_tg_stamps() or self.is_dirty():
+				self.prune_task_data()
+				self.prune_file_data()
 				self.store()
 
 		if self.producer.error:
@@ -357,6 +456,280 @@ class BuildContext(Context.Context):
 	def is_dirty(self):
 		return self.producer.dirty
 
+	def prune_task_data(self):
+		"""
+		Removes the durations and the memory usage (:py:attr:`waflib.Build.BuildContext.task_times`
+		and :py:attr:`waflib.Build.BuildContext.task_rss`) of the tasks that were not considered
+		in this build, so that these do not grow with every task ever built. Nothing is removed
+		when the build failed or when some task generators were not posted (partial builds,
+		unchanged task generators).
+		"""
+		if self.producer.error:
+			return
+		for g in self.groups:
+			for tg in g:
+				if isinstance(tg, TaskGen.task_gen) and not getattr(tg, 'posted', False):
+					return
+		uids = self.producer.task_uids
+		for dct in (self.task_times, self.task_rss):
+			for x in [x for x in dct if not x in uids]:
+				del dct[x]
+
+	def prune_file_data(self):
+		"""
+		Removes the file hashes (:py:attr:`waflib.Build.BuildContext.file_sigs`) and the preprocessor
+		lines (:py:attr:`waflib.Build.BuildContext.preproc_lines`) of the files that no longer exist
+		"""
+		for x in [x for x in self.file_sigs if not os.path.isfile(x)]:
+			del self.file_sigs[x]
+		for x in [x for x in self.preproc_lines if not os.path.isfile(x.abspath())]:
+			del self.preproc_lines[x]
+
+	def get_tg_stamp_key(self, tg):
+		"""
+		:return: the key of a task generator in :py:attr:`waflib.Build.BuildContext.tg_stamps`
+		:rtype: tuple
+		"""
+		return (tg.path.abspath(), tg.idx)
+
+	def get_tg_stamp_sig(self, tg):
+		"""
+		Computes a signature of the declaration of a task generator before it is posted: its attributes,
+		its configuration set, the scripts of its folder and of the parent folders, the command-line options
+		and the Waf modules. The scripts are executed in each build, so that the source files obtained
+		by ``ant_glob`` are part of the attributes.
+
+		:return: a signature, or None if an attribute cannot be represented (objects without a stable representation)
+		:rtype: string or bytes
+		"""
+		try:
+			cache = self.stamp_cache
+		except AttributeError:
+			cache = self.stamp_cache = {}
+			lst = [Context.HEXVERSION, self.variant]
+			opts = Options.options.__dict__
+			lst.extend((x, stamp_repr(opts[x])) for x in sorted(opts) if not x in STAMP_IGNORED_OPTIONS)
+			# the Waf tools and the tools of the project
+			prefixes = (Context.waf_dir, self.srcnode.abspath())
+			for x in sorted(sys.modules):
+				path = getattr(sys.modules[x], '__file__', None)
+				if path and path.startswith(prefixes) and not x in STAMP_IGNORED_MODULES:
+					try:
+						st = os.stat(path)
+					except OSError:
+						continue
+					lst.append((path, st.st_size, st.st_mtime))
+			cache[None] = Utils.h_list(lst)
+
+		lst = [cache[None], self.get_env_stamp_sig(tg.env, cache), self.get_scripts_stamp_sig(tg.path, cache)]
+		try:
+			for x in sorted(tg.__dict__):
+				if not x in ('bld', 'env', 'path', 'idx', 'tg_idx_count', 'tasks', 'meths', 'posted'):
+					lst.append((x, stamp_repr(tg.__dict__[x])))
+		except ValueError:
+			return None
+		return Utils.h_list(lst)
+
+	def get_env_stamp_sig(self, env, cache):
+		"""
+		:return: a signature of the values of a configuration set and of its parents
+		:rtype: string or bytes
+		"""
+		try:
+			return cache[id(env)]
+		except KeyError:
+			parent = getattr(env, 'parent', None)
+			lst = [parent is not None and self.get_env_stamp_sig(parent, cache), stamp_repr(env.table)]
+			ret = cache[id(env)] = Utils.h_list(lst)
+			return ret
+
+	def get_scripts_stamp_sig(self, node, cache):
+		"""
+		:return: a signature of the scripts of a folder and of its parent folders
+		:rtype: string or bytes
+		"""
+		try:
+			return cache[node]
+		except KeyError:
+			lst = []
+			if node.parent and node is not self.srcnode:
+				lst.append(self.get_scripts_stamp_sig(node.parent, cache))
+			for x in (Context.WSCRIPT_FILE, Context.WSCRIPT_FILE + '_build'):
+				try:
+					lst.append(Utils.h_file(os.path.join(node.abspath(), x)))
+				except EnvironmentError:
+					lst.append(None)
+			ret = cache[node] = Utils.h_list(lst)
+			return ret
+
+	def get_file_stamp(self, path):
+		"""
+		:return: the status of a file (inode, size, modification and change times) or None if it does not exist, cached during the build
+		:rtype: tuple
+		"""
+		try:
+			cache = self.file_stamps
+		except AttributeError:
+			cache = self.file_stamps = {}
+		try:
+			return cache[path]
+		except KeyError:
+			try:
+				st = os.stat(path)
+			except OSError:
+				ret = None
+			else:
+				# the change time is updated when the modification time is restored (copies, archives)
+				ret = (st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), getattr(st, 'st_ctime_ns', st.st_ctime))
+			cache[path] = ret
+			return ret
+
+	def get_manual_deps_sig(self, deps, paths):
+		"""
+		Computes a signature of the manual dependencies of files (:py:meth:`waflib.Build.BuildContext.add_manual_dependency`)
+
+		:param deps: manual dependencies by absolute path
+		:type deps: dict
+		:param paths: absolute paths of the files
+		:type paths: list of string
+		:return: a signature, or None if a dependency is a function (its value is only known when the task signature is computed)
+		:rtype: string or bytes
+		"""
+		lst = []
+		for x in paths:
+			for v in deps.get(x, ()):
+				if hasattr(v, '__call__'):
+					return None
+				try:
+					lst.append((x, stamp_repr(v)))
+				except ValueError:
+					return None
+		return Utils.h_list(lst)
+
+	def get_unchanged_tgs(self):
+		"""
+		Finds the task generators that need not be posted because the tasks they would create
+		are up-to-date: their declaration is unchanged (:py:meth:`waflib.Build.BuildContext.get_tg_stamp_sig`),
+		the files used by their tasks in the previous build and their manual dependencies are unchanged,
+		and no other task generator that must be posted produces these files. A no-op build then only
+		creates the tasks of the folders whose scripts have changed.
+
+		The task generators are still posted when required by others (``use`` attribute).
+		This is disabled by default, see :py:attr:`waflib.Build.BuildContext.incremental_post`.
+
+		:rtype: set of :py:class:`waflib.TaskGen.task_gen`
+		"""
+		keys = {}
+		producers = {}
+		dirty = []
+		bldpath = self.bldnode.abspath() + os.sep
+		deps = dict((x.abspath(), v) for (x, v) in self.deps_man.items())
+		for g in self.groups:
+			for tg in g:
+				if not isinstance(tg, TaskGen.task_gen) or getattr(tg, 'posted', None) or not tg.path:
+					continue
+				key = self.get_tg_stamp_key(tg)
+				tg.stamp_sig = self.get_tg_stamp_sig(tg)
+				rec = self.tg_stamps.get(key)
+				if rec is None:
+					dirty.append(key)
+					continue
+				for path in rec[2]:
+					producers[path] = key
+				if tg.stamp_sig is None:
+					dirty.append(key)
+					continue
+				mansig = self.get_manual_deps_sig(deps, [x[0] for x in rec[1]])
+				if mansig is None or rec[0] != Utils.h_list([tg.stamp_sig, mansig]):
+					dirty.append(key)
+					continue
+				for (path, stamp) in rec[1]:
+					if self.get_file_stamp(path) != stamp:
+						dirty.append(key)
+						break
+				else:
+					keys[key] = tg
+
+		# the task generators using files produced by other task generators to post must be posted too
+		consumers = Utils.defaultdict(list)
+		for key, tg in keys.items():
+			for (path, _) in self.tg_stamps[key][1]:
+				try:
+					consumers[producers[path]].append(key)
+				except KeyError:
+					if path.startswith(bldpath) and not path in self.tg_stamps[key][2]:
+						# no known task generator produces this file
+						dirty.append(key)
+		while dirty:
+			key = dirty.pop()
+			keys.pop(key, None)
+			dirty.extend(consumers.pop(key, ()))
+
+		ret = set(keys.values())
+		Logs.debug('build: %d task generators unchanged', len(ret))
+		return ret
+
+	def store_tg_stamps(self):
+		"""
+		Records the task generators posted whose tasks are all up-to-date, so that they need not be posted
+		in the next build, see :py:meth:`waflib.Build.BuildContext.get_unchanged_tgs`.
+		Task generators are never skipped when their tasks are executed every time (``always_run``), have no
+		outputs, have manual dependencies given as functions, or compute their signatures differently
+		(custom ``sig_vars`` or ``sig_explicit_deps`` methods, which may depend on anything).
+
+		:return: whether :py:attr:`waflib.Build.BuildContext.tg_stamps` was modified
+		:rtype: bool
+		"""
+		if not self.incremental_post or self.is_install or not self.targets in ('', '*'):
+			return False
+
+		self.file_stamps = {}
+		changed = False
+		deps = dict((x.abspath(), v) for (x, v) in self.deps_man.items())
+		for g in self.groups:
+			for tg in g:
+				if not getattr(tg, 'posted', False) or tg in self.unchanged_tgs:
+					continue
+				key = self.get_tg_stamp_key(tg)
+				sig = getattr(tg, 'stamp_sig', None)
+				files = set()
+				outputs = []
+				for tsk in tg.tasks:
+					cls = tsk.__class__
+					if tsk.hasrun not in (Task.SUCCESS, Task.SKIPPED) or tsk.always_run or not tsk.outputs:
+						sig = None
+						break
+					if cls.sig_vars != Task.Task.sig_vars or cls.sig_explicit_deps != Task.Task.sig_explicit_deps:
+						sig = None
+						break
+					files.update(tsk.inputs)
+					files.update(tsk.dep_nodes)
+					files.update(self.node_deps.get(tsk.uid(), ()))
+					outputs.extend(x.abspath() for x in tsk.outputs)
+
+				if sig is not None:
+					paths = set(n.abspath() for n in files)
+					paths.update(outputs)
+					# the files given as manual dependencies
+					for x in list(paths):
+						paths.update(v.abspath() for v in deps.get(x, ()) if isinstance(v, Node.Node))
+					paths = sorted(paths)
+					mansig = self.get_manual_deps_sig(deps, paths)
+					if mansig is None:
+						sig = None
+
+				if sig is None:
+					if self.tg_stamps.pop(key, None) is not None:
+						changed = True
+					continue
+
+				stamps = [(x, self.get_file_stamp(x)) for x in paths]
+				rec = (Utils.h_list([sig, mansig]), stamps, outputs)
+				if self.tg_stamps.get(key) != rec:
+					self.tg_stamps[key] = rec
+					changed = True
+		return changed
+
 	def setup(self, tool, tooldir=None, funs=None):
 		"""
 		Import waf tools defined during the configuration::
@@ -740,9 +1113,15 @@ class BuildContext(Context.Context):
 			else:
 				f()
 
+		def is_unchanged(tg):
+			if tg in self.unchanged_tgs:
+				self.post_skipped.append((self.current_group, tg))
+				return True
+
 		if self.targets == '*':
 			for tg in self.groups[self.current_group]:
-				tgpost(tg)
+				if not is_unchanged(tg):
+					tgpost(tg)
 		elif self.targets:
 			if self.current_group < self._min_grp:
 				for tg in self.groups[self.current_group]:
@@ -783,9 +1162,29 @@ class BuildContext(Context.Context):
 					ln = self.srcnode
 
 			for tg in self.groups[self.current_group]:
-				if is_post(tg, ln):
+				if is_post(tg, ln) and not is_unchanged(tg):
 					tgpost(tg)
 
+	def get_skipped_tasks(self):
+		"""
+		Returns the tasks of the task generators skipped in the previous build groups
+		(see :py:meth:`waflib.Build.BuildContext.get_unchanged_tgs`) that were posted
+		by the task generators of the current group (``use`` attribute)
+
+		:rtype: list of :py:class:`waflib.Task.Task`
+		"""
+		tasks = []
+		lst = []
+		for (idx, tg) in self.post_skipped:
+			if idx == self.current_group:
+				lst.append((idx, tg))
+			elif getattr(tg, 'posted', None):
+				tasks.extend(tg.tasks)
+			else:
+				lst.append((idx, tg))
+		self.post_skipped = lst
+		return tasks
+
 	def get_tasks_group(self, idx):
 		"""
 		Returns all task instances for the build group at position idx,
@@ -822,6 +1221,8 @@ class BuildContext(Context.Context):
 
 			# then extract the tasks
 			tasks = self.get_tasks_group(self.current_group)
+			if self.post_mode == POST_LAZY:
+				tasks.extend(self.get_skipped_tasks())
 
 			# if the constraints are set properly (ext_in/ext_out, before/after)
 			# the call to set_file_constraints may be removed (can be a 15% penalty on no-op rebuilds)
@@ -1336,7 +1737,7 @@ class CleanContext(BuildContext):
 			lst = []
 			for env in self.all_envs.values():
 				lst.extend(self.root.find_or_declare(f) for f in env[CFG_FILES])
-			excluded_dirs = '.lock* *conf_check_*/** config.log %s/*' % CACHE_DIR
+			excluded_dirs = '.lock* .wafdaemon* *conf_check_*/** config.log %s/*' % CACHE_DIR
 			for n in self.bldnode.ant_glob('**/*', excl=excluded_dirs, quiet=True):
 				if n in lst:
 					continue
@@ -1344,9 +1745,11 @@ class CleanContext(BuildContext):
 		self.root.children = {}
 
 		for v in SAVED_ATTRS:
-			if v == 'root':
+			if v in ('root', 'task_times', 'task_rss', 'file_sigs', 'preproc_lines'):
+				# the file hashes, preprocessor lines, durations and memory usage remain useful for the next build
 				continue
 			setattr(self, v, {})
+		self.prune_file_data()
 
 class ListContext(BuildContext):
 	'''lists the targets to execute'''
@@ -12,7 +12,11 @@ A :py:class:`waflib.Configure.ConfigurationContext` instance is created when ``w
 * hold configuration routines such as ``find_program``, etc
 """
 
-import os, re, shlex, shutil, sys, time, traceback
+import copy, logging, os, re, shlex, shutil, sys, time, traceback
+try:
+	from queue import Queue
+except ImportError:
+	from Queue import Queue
 from waflib import ConfigSet, Utils, Options, Logs, Context, Build, Errors
 
 WAF_CONFIG_LOG = 'config.log'
@@ -157,6 +161,7 @@ class ConfigurationContext(Context.Context):
 				Logs.warn('Are you certain that you do not want to set top="." ?')
 
 		super(ConfigurationContext, self).execute()
+		self.wait_futures()
 
 		self.store()
 
@@ -189,6 +194,79 @@ class ConfigurationContext(Context.Context):
 		if not (self.env.NO_LOCK_IN_OUT or env.environ.get('NO_LOCK_IN_OUT') or getattr(Options.options, 'no_lock_in_out')):
 			env.store(os.path.join(Context.out_dir, Options.lockfile))
 
+	def future(self, fun, *k, **kw):
+		"""
+		Executes a configuration function in a thread, and returns a
+		:py:class:`waflib.Configure.ConfigurationFuture` object providing its result::
+
+			def configure(conf):
+				conf.load('compiler_c')
+				stdio = conf.future(conf.check_cc, header_name='stdio.h')
+				conf.future('check_cc', lib='m', uselib_store='M', after=[stdio])
+				conf.future('find_program', 'doxygen', var='DOXYGEN', mandatory=False)
+				conf.check_cc(header_name='stdlib.h') # executed immediately
+				if stdio.result():
+					...
+
+		The functions are executed by ``--jobs`` threads, in the order of declaration.
+		The messages, the lines of the config.log file, the errors and the
+		modifications of ``conf.env`` are processed in the order of declaration as well,
+		when the result of a future or of a future declared later is requested, and at the latest
+		at the end of the configuration. The outputs are then the same as if the functions
+		were called one after the other, except for the tests executed in between.
+
+		A function sees ``conf.env`` as it was when the future was declared, plus the modifications
+		made by the futures listed in *after*, which are executed first. The functions must not load tools
+		or change the current configuration set.
+
+		:param fun: name of a configuration method, configuration method bound to this context, or function taking a configuration context as first argument
+		:type fun: string or function
+		:param after: futures to execute first
+		:type after: list of :py:class:`waflib.Configure.ConfigurationFuture`
+		:return: a future object
+		:rtype: :py:class:`waflib.Configure.ConfigurationFuture`
+		"""
+		after = kw.pop('after', [])
+		if isinstance(after, ConfigurationFuture):
+			after = [after]
+		fut = ConfigurationFuture(self, fun, k, kw, after)
+
+		try:
+			queue = self.future_queue
+		except AttributeError:
+			queue = self.future_queue = Queue(0)
+			self.futures = []
+			for i in range(max(1, Options.options.jobs)):
+				t = Utils.threading.Thread(target=future_worker, args=(queue,))
+				t.daemon = True
+				t.start()
+		self.futures.append(fut)
+		queue.put(fut)
+		return fut
+
+	def wait_futures(self, last=None):
+		"""
+		Processes the results of the futures in the order of declaration (messages, logs and
+		modifications of the configuration sets), see :py:meth:`waflib.Configure.ConfigurationContext.future`
+
+		:param last: last future to process (all by default)
+		:type last: :py:class:`waflib.Configure.ConfigurationFuture`
+		:raises: the first error raised by a future
+		"""
+		lst = getattr(self, 'futures', [])
+		while lst:
+			fut = lst.pop(0)
+			fut.done.wait()
+			fut.collected = True
+			for (fun, k, kw) in fut.events:
+				fun(*k, **kw)
+			Logs.free_logger(fut.logger)
+			if fut.error is not None:
+				raise fut.error
+			merge_env_changes(fut.target_env, fut.changes)
+			if fut is last:
+				break
+
 	def prepare_env(self, env):
 		"""
 		Insert *PREFIX*, *BINDIR* and *LIBDIR* values into ``env``
@@ -303,6 +381,145 @@ class ConfigurationContext(Context.Context):
 				self.fatal('No such configuration function %r' % x)
 			f()
 
+class ConfigurationFuture(object):
+	"""
+	Configuration function executed in a thread, see :py:meth:`waflib.Configure.ConfigurationContext.future`
+	"""
+	def __init__(self, conf, fun, k, kw, after):
+		self.conf = conf
+		self.fun = fun
+		self.k = k
+		self.kw = kw
+		self.after = after
+
+		self.target_env = conf.env
+		"""Configuration set receiving the modifications"""
+		self.env = conf.env.derive().detach()
+		"""Configuration set used by the function"""
+
+		self.ret = None
+		self.error = None
+		self.cancelled = False
+		self.changes = []
+		self.events = []
+		"""Messages and log records, processed in the main thread"""
+		self.collected = False
+		self.done = Utils.threading.Event()
+
+		self.logger = logging.getLogger('cfg_future_%d' % id(self))
+		self.logger.propagate = False
+		self.logger.setLevel(logging.DEBUG)
+		hdlr = future_handler(self)
+		try:
+			hdlr.baseFilename = conf.logger.handlers[0].baseFilename
+		except (AttributeError, IndexError):
+			pass
+		self.logger.addHandler(hdlr)
+
+	def start_msg(self, *k, **kw):
+		self.events.append((self.conf.start_msg, k, kw))
+
+	def end_msg(self, *k, **kw):
+		self.events.append((self.conf.end_msg, k, kw))
+
+	def result(self):
+		"""
+		Waits for the function and the futures declared before it
+
+		:return: the value returned by the function
+		:raises: the error raised by the function, or by a future declared before
+		"""
+		if not self.collected:
+			self.conf.wait_futures(self)
+		if self.error is not None:
+			raise self.error
+		return self.ret
+
+	def run(self):
+		"""
+		Executes the function on a copy of the configuration context
+		"""
+		try:
+			for x in self.after:
+				x.done.wait()
+				if x.error is not None or x.cancelled:
+					# the error is raised by the future declared first
+					self.cancelled = True
+					return
+				merge_env_changes(self.env, x.changes)
+			orig = copy.deepcopy(self.env.table)
+
+			ctx = copy.copy(self.conf)
+			ctx.all_envs = dict(self.conf.all_envs)
+			ctx.env = self.env
+			ctx.in_msg = 0
+			ctx.logger = self.logger
+			ctx.start_msg = self.start_msg
+			ctx.end_msg = self.end_msg
+
+			fun = self.fun
+			try:
+				if isinstance(fun, str):
+					self.ret = getattr(ctx, fun)(*self.k, **self.kw)
+				elif getattr(fun, '__self__', None) is self.conf:
+					self.ret = getattr(ctx, fun.__name__)(*self.k, **self.kw)
+				else:
+					self.ret = fun(ctx, *self.k, **self.kw)
+			except Exception as e:
+				self.error = e
+			self.changes = get_env_changes(orig, self.env.table)
+		finally:
+			self.done.set()
+
+class future_handler(logging.Handler):
+	"""
+	Keeps the log records of a future until they are processed in the main thread
+	"""
+	def __init__(self, fut):
+		logging.Handler.__init__(self)
+		self.fut = fut
+	def emit(self, record):
+		self.fut.events.append((self.fut.conf.logger.handle, (record,), {}))
+
+def future_worker(queue):
+	"""Executes the futures from a queue"""
+	while 1:
+		queue.get().run()
+
+def get_env_changes(orig, table):
+	"""
+	:return: the modifications made to a configuration set table, as a list of tuples (key, previous value, new value)
+	"""
+	ret = []
+	for key in sorted(table.keys()):
+		val = table[key]
+		try:
+			old = orig[key]
+		except KeyError:
+			old = val.__class__() if isinstance(val, (list, dict)) else None
+		if old != val:
+			ret.append((key, old, val))
+	return ret
+
+def merge_env_changes(env, changes):
+	"""
+	Applies modifications computed by :py:func:`waflib.Configure.get_env_changes` to a configuration set;
+	the values added to lists and dicts are merged with the current values
+	"""
+	for (key, old, new) in changes:
+		cur = env[key]
+		if isinstance(new, list) and isinstance(old, list) and isinstance(cur, list):
+			if new[:len(old)] == old:
+				val = cur + new[len(old):]
+			else:
+				val = [x for x in cur if x in new or not x in old] + [x for x in new if not x in old and not x in cur]
+		elif isinstance(new, dict) and isinstance(old, dict) and isinstance(cur, dict):
+			val = dict(cur)
+			val.update((x, y) for (x, y) in new.items() if old.get(x) != y)
+		else:
+			val = new
+		env[key] = copy.deepcopy(val)
+
 def conf(f):
 	"""
 	Decorator: attach new configuration functions to :py:class:`waflib.Build.BuildContext` and
@@ -30,11 +30,11 @@ WAFREVISION="0fb985ce1932c6f3e7533f435e4ee209d673776e"
 WAFNAME="waf"
 """Application name displayed on --help"""
 
-ABI = 20
+ABI = 22
 """Version of the build data cache file format (used in :py:const:`waflib.Context.DBFILE`)"""
 
-DBFILE = '.wafpickle-%s-%d-%d' % (sys.platform, sys.hexversion, ABI)
-"""Name of the pickle file for storing the build data"""
+DBFILE = '.wafpickle-%s-%d-%d-%s' % (sys.platform, sys.hexversion, ABI, Utils.HASH)
+"""Name of the pickle file for storing the build data, the file signatures depend on :py:const:`waflib.Utils.HASH`"""
 
 APPNAME = 'APPNAME'
 """Default application name (used by ``waf dist``)"""
@@ -21,8 +21,8 @@ Node: filesystem structure
    owning a node is held as *self.ctx*
 """
 
-import os, re, sys, shutil
-from waflib import Utils, Errors
+import os, re, sys, shutil, random, time
+from waflib import Utils, Errors, Logs
 
 exclude_regs = '''
 **/*~
@@ -61,6 +61,30 @@ Ant patterns for files and folders to exclude while doing the
 recursive traversal in :py:meth:`waflib.Node.Node.ant_glob`
 """
 
+STAT_CACHE = True
+"""
+Whether to reuse the file hashes from previous builds when the file status is unchanged,
+see :py:meth:`waflib.Node.Node.h_file`
+"""
+
+STAT_CACHE_DELAY = 2
+"""
+Files modified less than this amount of seconds ago are hashed again in the next build,
+as the timestamps may not reflect the changes made within their resolution
+"""
+
+scandir = getattr(os, 'scandir', None)
+"""Lists folders along with the file types (Python >= 3.5), see :py:meth:`waflib.Node.Node.listdir_types`"""
+
+PARANOID = 0
+"""
+Fraction (between 0 and 1) of the file hashes reused from previous builds to compute again,
+a warning is displayed when a file changed without a change of its status::
+
+	from waflib import Node
+	Node.PARANOID = 0.05
+"""
+
 def ant_matcher(s, ignorecase):
 	reflags = re.I if ignorecase else 0
 	ret = []
@@ -128,7 +152,7 @@ class Node(object):
 	Subclasses can provide a dict class to enable case insensitivity for example.
 	"""
 
-	__slots__ = ('name', 'parent', 'children', 'cache_abspath', 'cache_isdir')
+	__slots__ = ('name', 'parent', 'children', 'cache_abspath', 'cache_isdir', 'lazy_children')
 	def __init__(self, name, parent):
 		"""
 		.. note:: Use :py:func:`Node.make_node` or :py:func:`Node.find_node` instead of calling this constructor
@@ -150,8 +174,92 @@ class Node(object):
 
 	def __getstate__(self):
 		"Serializes node information, used for persistence"
+		if getattr(self, 'lazy_children', None) is not None:
+			self.load_children()
 		return (self.name, self.parent, getattr(self, 'children', None))
 
+	def load_children(self):
+		"""
+		Returns the children of this node, creating the nodes restored by
+		:py:meth:`waflib.Node.Node.set_tree_state` the first time that they are accessed,
+		or an empty dict if there are none. The methods accessing the children of
+		a node (:py:meth:`waflib.Node.Node.find_node`, :py:meth:`waflib.Node.Node.make_node`...)
+		call it when :py:attr:`waflib.Node.Node.children` is not set.
+
+		:rtype: dict
+		"""
+		try:
+			return self.children
+		except AttributeError:
+			pass
+		try:
+			self.lazy_children
+		except AttributeError:
+			self.children = ch = self.dict_class()
+			return ch
+		lazy_lock.acquire()
+		try:
+			try:
+				# created by another thread in the meantime
+				return self.children
+			except AttributeError:
+				pass
+			ch = self.dict_class()
+			cls = self.__class__
+			for (x, state) in self.lazy_children:
+				node = ch[x] = cls.__new__(cls)
+				node.name = x
+				node.parent = self
+				if state is not None:
+					node.lazy_children = state
+			self.children = ch
+			del self.lazy_children
+		finally:
+			lazy_lock.release()
+		return ch
+
+	def get_tree_state(self):
+		"""
+		Returns the names of the nodes below this one as nested tuples of the form
+		``(name, children)`` where ``children`` is None for nodes without children.
+		Subtrees that were never accessed since they were restored are returned
+		as they are, without creating the corresponding Node objects.
+
+		:rtype: tuple or None
+		"""
+		try:
+			ch = self.children
+		except AttributeError:
+			return getattr(self, 'lazy_children', None)
+		return tuple([(x, y.get_tree_state()) for (x, y) in ch.items()])
+
+	def set_tree_state(self, state):
+		"""
+		Restores the nodes returned by :py:meth:`waflib.Node.Node.get_tree_state`. The Node
+		objects are created lazily, when the children of their parent are accessed
+		for the first time (:py:meth:`waflib.Node.Node.find_node`, :py:meth:`waflib.Node.Node.make_node`,
+		:py:meth:`waflib.Node.Node.ant_glob`, etc). Existing nodes are kept.
+
+		:param state: nested tuples
+		:type state: tuple or None
+		"""
+		if state is None:
+			return
+		try:
+			ch = self.children
+		except AttributeError:
+			self.lazy_children = state
+			return
+		for (x, y) in state:
+			try:
+				node = ch[x]
+			except KeyError:
+				node = self.__class__(x, self)
+				if y is not None:
+					node.lazy_children = y
+			else:
+				node.set_tree_state(y)
+
 	def __str__(self):
 		"""
 		String representation (abspath), for debugging purposes
@@ -354,6 +462,50 @@ class Node(object):
 		lst.sort()
 		return lst
 
+	def listdir_types(self):
+		"""
+		Lists the folder contents along with the folder entries, using the file types returned
+		by the system (:py:func:`os.scandir`) instead of reading the status of each entry.
+		The listings are kept in the context and reused while the folder modification time
+		is unchanged, so that globbing the same folders again only reads their status.
+
+		:returns: a tuple (list of file/folder names ordered alphabetically, set of folder names)
+		:rtype: tuple
+		"""
+		path = self.abspath()
+		if not path or not scandir:
+			lst = self.listdir()
+			return (lst, set(x for x in lst if os.path.isdir(os.path.join(path, x))))
+
+		try:
+			cache = self.ctx.cache_listdir
+		except AttributeError:
+			cache = {}
+			if hasattr(self, 'ctx'):
+				self.ctx.cache_listdir = cache
+
+		st = os.stat(path)
+		key = getattr(st, 'st_mtime_ns', st.st_mtime)
+		prev = cache.get(path)
+		if prev and prev[0] == key:
+			return prev[1]
+
+		lst = []
+		dirs = set()
+		for x in scandir(path):
+			lst.append(x.name)
+			try:
+				if x.is_dir():
+					dirs.add(x.name)
+			except OSError:
+				pass
+		lst.sort()
+		ret = (lst, dirs)
+		if time.time() - st.st_mtime > STAT_CACHE_DELAY:
+			# entries added to folders modified recently may not change the modification time
+			cache[path] = (key, ret)
+		return ret
+
 	def mkdir(self):
 		"""
 		Creates a folder represented by this node. Intermediate folders are created as needed.
@@ -377,10 +529,7 @@ class Node(object):
 			if not self.isdir():
 				raise Errors.WafError('Could not create the directory %r' % self)
 
-			try:
-				self.children
-			except AttributeError:
-				self.children = self.dict_class()
+			self.load_children()
 
 	def find_node(self, lst):
 		"""
@@ -409,13 +558,12 @@ class Node(object):
 			try:
 				ch = cur.children
 			except AttributeError:
-				cur.children = self.dict_class()
-			else:
-				try:
-					cur = ch[x]
-					continue
-				except KeyError:
-					pass
+				ch = cur.load_children()
+			try:
+				cur = ch[x]
+				continue
+			except KeyError:
+				pass
 
 			# optimistic: create the node first then look if it was correct to do so
 			cur = self.__class__(x, cur)
@@ -447,13 +595,14 @@ class Node(object):
 				continue
 
 			try:
-				cur = cur.children[x]
+				ch = cur.children
 			except AttributeError:
-				cur.children = self.dict_class()
+				ch = cur.load_children()
+			try:
+				cur = ch[x]
+				continue
 			except KeyError:
 				pass
-			else:
-				continue
 			cur = self.__class__(x, cur)
 		return cur
 
@@ -474,8 +623,14 @@ class Node(object):
 				cur = cur.parent or cur
 			else:
 				try:
-					cur = cur.children[x]
-				except (AttributeError, KeyError):
+					ch = cur.children
+				except AttributeError:
+					if getattr(cur, 'lazy_children', None) is None:
+						return None
+					ch = cur.load_children()
+				try:
+					cur = ch[x]
+				except KeyError:
 					return None
 		return cur
 
@@ -602,16 +757,12 @@ class Node(object):
 		:returns: A generator object to iterate from
 		:rtype: iterator
 		"""
-		dircont = self.listdir()
+		dircont, dirs = self.listdir_types()
 
-		try:
-			lst = set(self.children.keys())
-		except AttributeError:
-			self.children = self.dict_class()
-		else:
-			if remove:
-				for x in lst - set(dircont):
-					self.children[x].evict()
+		ch = self.load_children()
+		if remove:
+			for x in set(ch.keys()) - set(dircont):
+				ch[x].evict()
 
 		for name in dircont:
 			npats = accept(name, pats)
@@ -620,7 +771,7 @@ class Node(object):
 
 				node = self.make_node([name])
 
-				isdir = node.isdir()
+				isdir = name in dirs
 				if accepted:
 					if isdir:
 						if dir:
@@ -939,12 +1090,38 @@ class Node(object):
 
 	def h_file(self):
 		"""
-		See :py:func:`waflib.Utils.h_file`
+		See :py:func:`waflib.Utils.h_file`. In build contexts, the hashes are kept across builds
+		in :py:attr:`waflib.Build.BuildContext.file_sigs` and reused as long as the file status
+		(inode, size, modification and change times) is unchanged, see :py:const:`waflib.Node.STAT_CACHE`.
 
 		:return: a hash representing the file contents
 		:rtype: string or bytes
 		"""
-		return Utils.h_file(self.abspath())
+		filename = self.abspath()
+		try:
+			cache = self.ctx.file_sigs
+		except AttributeError:
+			return Utils.h_file(filename)
+		if not STAT_CACHE:
+			return Utils.h_file(filename)
+
+		st = os.stat(filename)
+		key = (st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), getattr(st, 'st_ctime_ns', st.st_ctime))
+		prev = cache.get(filename)
+		if prev and prev[0] == key:
+			if not PARANOID or random.random() >= PARANOID:
+				return prev[1]
+			ret = Utils.h_file(filename)
+			if ret != prev[1]:
+				Logs.warn('The file %r changed without a change of its status (clock skew?)', filename)
+				cache[filename] = (key, ret)
+			return ret
+
+		ret = Utils.h_file(filename)
+		if time.time() - st.st_mtime > STAT_CACHE_DELAY:
+			# files modified recently may change again without a visible change of timestamp
+			cache[filename] = (key, ret)
+		return ret
 
 	def get_bld_sig(self):
 		"""
@@ -977,6 +1154,9 @@ class Node(object):
 pickle_lock = Utils.threading.Lock()
 """Lock mandatory for thread-safe node serialization"""
 
+lazy_lock = Utils.threading.Lock()
+"""Lock for creating the children of lazily restored nodes, see :py:meth:`waflib.Node.Node.set_tree_state`"""
+
 class Nod3(Node):
 	"""Mandatory subclass for thread-safe node serialization"""
 	pass # do not remove
@@ -182,6 +182,8 @@ class OptionsContext(Context.Context):
 		self.option_groups['build and install options'] = gr
 		gr.add_option('-p', '--progress', dest='progress_bar', default=0, action='count', help= '-p: progress bar; -pp: ide output')
 		gr.add_option('--targets',        dest='targets', default='', action='store', help='task generators, e.g. "target1,target2"')
+		gr.add_option('--max-memory',     dest='max_memory', default=0, type='int', help='defer tasks when the memory used by the running tasks would exceed this amount of MB')
+		gr.add_option('--max-load',       dest='max_load', default=0, type='float', help='defer tasks while the system load average exceeds this value')
 
 		gr = self.add_option_group('Step options')
 		self.option_groups['step options'] = gr
@@ -6,11 +6,12 @@
 Runner.py: Task scheduling and execution
 """
 
-import heapq, traceback
+import heapq, os, time, traceback
+from io import BytesIO
 try:
-	from queue import Queue, PriorityQueue
+	from queue import Queue, PriorityQueue, Empty
 except ImportError:
-	from Queue import Queue
+	from Queue import Queue, Empty
 	try:
 		from Queue import PriorityQueue
 	except ImportError:
@@ -24,12 +25,43 @@ except ImportError:
 				return heapq.heappop(self.queue)
 
 from waflib import Utils, Task, Errors, Logs
+cPickle = Utils.cPickle
 
 GAP = 5
 """
 Wait for at least ``GAP * njobs`` before trying to enqueue more tasks to run
 """
 
+POOL = False
+"""
+Execute the tasks in a fixed pool of ``njobs`` threads (:py:class:`waflib.Runner.Worker`)
+instead of creating one thread per task (:py:class:`waflib.Runner.Spawner`). This reduces
+the overhead for builds made of many small tasks (copies, installation, symlinks)::
+
+	from waflib import Runner
+	Runner.POOL = True
+"""
+
+BATCH = 8
+"""
+Maximum amount of tasks that a worker thread obtains at once, when more tasks are ready
+than there are worker threads
+"""
+
+PREFETCH = 64
+"""
+Minimum amount of source files for computing their signatures in parallel before
+the tasks of a build group are considered, see :py:meth:`waflib.Runner.Parallel.prefetch_signatures`.
+Set to 0 to disable.
+"""
+
+PRESCAN = 16
+"""
+Minimum amount of tasks to rescan for running their scanners in ``njobs`` processes before
+the tasks of a build group are considered, see :py:meth:`waflib.Runner.Parallel.prescan`.
+Set to 0 to disable.
+"""
+
 class PriorityTasks(object):
 	def __init__(self):
 		self.lst = []
@@ -123,6 +155,165 @@ class Spawner(Utils.threading.Thread):
 				task.log_display(task.generator.bld)
 			Consumer(self, task)
 
+class Worker(Utils.threading.Thread):
+	"""
+	Daemon thread that executes tasks from :py:attr:`waflib.Runner.Parallel.ready`
+	until the producer provides None. A fixed amount of workers is created
+	when :py:const:`waflib.Runner.POOL` is set.
+	"""
+	def __init__(self, master):
+		Utils.threading.Thread.__init__(self)
+		self.master = master
+		""":py:class:`waflib.Runner.Parallel` producer instance"""
+		self.daemon = True
+		self.start()
+	def run(self):
+		"""
+		Processes tasks by delegating to :py:meth:`waflib.Runner.Worker.loop`
+		"""
+		try:
+			self.loop()
+		except Exception:
+			# Python 2 prints unnecessary messages when shutting down
+			pass
+	def loop(self):
+		"""
+		Consumes task objects from the producer, taking several tasks at once when
+		there is enough work for all threads; ends when the producer has no more task
+		to provide.
+		"""
+		master = self.master
+		ready = master.ready
+		while 1:
+			tasks = [ready.get()]
+			while len(tasks) < BATCH and ready.qsize() > master.numjobs:
+				try:
+					tasks.append(ready.get_nowait())
+				except Empty:
+					break
+
+			for task in tasks:
+				if task is None:
+					# let the other workers terminate too
+					ready.put(None)
+					return
+				try:
+					if not master.stop:
+						task.log_display(task.generator.bld)
+						master.process_task(task)
+				finally:
+					master.out.put(task)
+
+class Admission(object):
+	"""
+	Defers the execution of tasks that would make the build run out of memory, or overload
+	the machine. This complements :py:class:`waflib.Task.TaskSemaphore`, which limits the
+	amount of tasks of a given kind. A task is started when:
+
+	* no other task is running (so that the build always progresses), or
+	* the peak memory usage recorded for the task in a previous build (or else the largest one
+	  known for the same task class) added to the peak memory usage of the running tasks fits
+	  in :py:attr:`waflib.Build.BuildContext.max_memory`, and in the memory available on the system, and
+	* the system load average does not exceed :py:attr:`waflib.Build.BuildContext.max_load`
+
+	Deferred tasks are reconsidered each time a running task completes.
+	The memory usage is recorded in :py:attr:`waflib.Build.BuildContext.task_rss`.
+	"""
+
+	interval = 0.5
+	"""Minimum amount of seconds between two readings of the system state"""
+
+	def __init__(self, bld):
+		self.bld = bld
+		self.max_memory = (getattr(bld, 'max_memory', 0) or 0) * 1024
+		self.max_load = getattr(bld, 'max_load', 0) or 0
+		self.running = {}
+		"""Running tasks mapped to their expected memory usage in kB"""
+		self.used = 0
+		self.waiting = PriorityTasks()
+		"""Heap of tasks waiting for memory or for the system load to decrease"""
+		self.class_rss = {}
+		self.system = None
+		self.system_time = 0
+
+	def get_rss(self, tsk):
+		"""
+		:return: the expected peak memory usage of a task in kB
+		:rtype: int
+		"""
+		name = tsk.__class__.__name__
+		val = self.bld.task_rss.get(tsk.uid())
+		if val is None:
+			return self.class_rss.get(name, 0)
+		if val > self.class_rss.get(name, 0):
+			self.class_rss[name] = val
+		return val
+
+	def get_system(self):
+		"""
+		Reads the memory available (kB) and the load average on the system at most
+		every :py:const:`waflib.Runner.Admission.interval` seconds
+
+		:return: a tuple containing the available memory and the load average, or None for unknown values
+		:rtype: tuple
+		"""
+		now = time.time()
+		if now - self.system_time > self.interval:
+			self.system_time = now
+			mem = load = None
+			if self.max_memory:
+				try:
+					for line in Utils.readf('/proc/meminfo').splitlines():
+						if line.startswith('MemAvailable:'):
+							mem = int(line.split()[1])
+							break
+				except (EnvironmentError, ValueError):
+					pass
+			if self.max_load:
+				try:
+					load = os.getloadavg()[0]
+				except (AttributeError, OSError):
+					pass
+			self.system = (mem, load)
+		return self.system
+
+	def acquire(self, tsk):
+		"""
+		Records a task as running if it may be executed
+
+		:return: True if the task may be executed now
+		:rtype: bool
+		"""
+		if tsk in self.running:
+			return True
+		rss = self.get_rss(tsk)
+		if self.running:
+			(mem, load) = self.get_system()
+			if self.max_memory:
+				if self.used + rss > self.max_memory:
+					return False
+				if mem is not None and rss > mem:
+					return False
+			if load is not None and load > self.max_load:
+				return False
+		self.running[tsk] = rss
+		self.used += rss
+		return True
+
+	def release(self, tsk):
+		"""
+		Removes a task from the running tasks
+
+		:return: True if the task was running
+		:rtype: bool
+		"""
+		try:
+			rss = self.running.pop(tsk)
+		except KeyError:
+			return False
+		self.used -= rss
+		return True
+
 class Parallel(object):
 	"""
 	Schedule the tasks obtained from the build context for execution.
@@ -183,11 +374,39 @@ class Parallel(object):
 		The reverse dependency graph of dependencies obtained from Task.run_after
 		"""
 
+		self.task_uids = set()
+		"""
+		Identifiers (uid) of the tasks considered in this build, see :py:meth:`waflib.Build.BuildContext.prune_task_data`
+		"""
+
 		self.spawner = None
 		"""
-		Coordinating daemon thread that spawns thread consumers
+		Coordinating daemon thread that spawns thread consumers, started with the first task to execute
+		"""
+
+		self.workers = []
+		"""
+		Daemon threads executing the tasks when :py:const:`waflib.Runner.POOL` is set, started with the first task to execute
+		"""
+
+		self.admission = None
+		"""
+		Instance of :py:class:`waflib.Runner.Admission` if a memory budget or a maximum load is set
+		"""
+		if getattr(bld, 'max_memory', 0) or getattr(bld, 'max_load', 0):
+			self.admission = Admission(bld)
+
+	def start_consumers(self):
+		"""
+		Creates the threads executing the tasks. This is delayed until a task must be executed,
+		so that :py:meth:`waflib.Runner.Parallel.prescan` can fork processes while the scheduler
+		thread is the only one running.
 		"""
-		if self.numjobs > 1:
+		if self.spawner or self.workers:
+			return
+		if POOL:
+			self.workers = [Worker(self) for i in range(self.numjobs)]
+		else:
 			self.spawner = Spawner(self)
 
 	def get_next_task(self):
@@ -263,12 +482,199 @@ class Parallel(object):
 						raise Errors.WafError('Broken revdeps detected on %r' % self.incomplete)
 				else:
 					tasks = next(self.biter)
+					self.prefetch_signatures(tasks)
+					self.prescan(tasks)
 					ready, waiting = self.prio_and_split(tasks)
 					self.outstanding.extend(ready)
 					self.incomplete.update(waiting)
 					self.total = self.bld.total()
 					break
 
+	def prefetch_signatures(self, tasks):
+		"""
+		Computes the signatures of the source files used by a group of tasks
+		(:py:meth:`waflib.Node.Node.get_bld_sig`) in ``njobs`` threads, so that the
+		scheduler thread finds them in the cache when calling :py:meth:`waflib.Task.Task.runnable_status`.
+		Most of the time is spent reading and hashing files, which does not hold the GIL.
+
+		Files from the build directory and files created by the tasks are left alone,
+		because they may change during the build.
+
+		:param tasks: tasks from the same build group
+		:type tasks: list of :py:class:`waflib.Task.Task`
+		"""
+		if self.numjobs < 2 or not PREFETCH:
+			return
+
+		bld = self.bld
+		try:
+			cache = bld.cache_sig
+		except AttributeError:
+			cache = bld.cache_sig = {}
+		node_deps = getattr(bld, 'node_deps', {})
+
+		outputs = set()
+		for tsk in tasks:
+			outputs.update(tsk.outputs)
+
+		seen = set()
+		nodes = []
+		for tsk in tasks:
+			for lst in (tsk.inputs, tsk.dep_nodes, node_deps.get(tsk.uid(), [])):
+				for x in lst:
+					if x in seen or x in outputs or x in cache:
+						continue
+					seen.add(x)
+					if not x.is_bld():
+						nodes.append(x)
+		if len(nodes) < PREFETCH:
+			return
+
+		def compute(lst):
+			for x in lst:
+				try:
+					x.get_bld_sig()
+				except Exception:
+					# the error is reported when the task signature is computed
+					pass
+
+		n = min(self.numjobs, len(nodes) // PREFETCH + 1)
+		threads = [Utils.threading.Thread(target=compute, args=(nodes[i::n],)) for i in range(n)]
+		for t in threads:
+			t.daemon = True
+			t.start()
+		for t in threads:
+			t.join()
+
+	def prescan(self, tasks):
+		"""
+		Runs the dependency scanners (:py:meth:`waflib.Task.Task.scan`) of the tasks that must
+		be scanned again in ``njobs`` forked processes, instead of one after the other in the
+		scheduler thread. The results are stored in ``bld.prescanned`` and are used by
+		:py:meth:`waflib.Task.Task.sig_implicit_deps`, which fills :py:attr:`waflib.Build.BuildContext.node_deps`
+		and :py:attr:`waflib.Build.BuildContext.raw_deps` as usual.
+
+		Only the tasks that do not wait for other tasks are considered, because their input files
+		are complete. The new entries of the build data computed in the processes (file hashes,
+		preprocessor lines) are kept too.
+
+		The processes are only forked while no other thread is running, because a lock held by
+		another thread at that time would remain locked forever in the child processes. This is
+		usually the case for the first build group, as the consumer threads start with the first
+		task to execute (:py:meth:`waflib.Runner.Parallel.start_consumers`). The other groups are
+		scanned in the scheduler thread as usual.
+
+		:param tasks: tasks from the same build group
+		:type tasks: list of :py:class:`waflib.Task.Task`
+		"""
+		if self.numjobs < 2 or not PRESCAN or not hasattr(os, 'fork'):
+			return
+		if Utils.threading.active_count() > 1:
+			return
+
+		# find the tasks which need a scan, see Task.sig_implicit_deps
+		bld = self.bld
+		pending = bld.prescan_pending = []
+		try:
+			for tsk in tasks:
+				if tsk.scan and not tsk.run_after and not tsk.hasrun:
+					try:
+						tsk.signature()
+					except Exception:
+						# the errors are reported when the task is considered
+						pass
+		finally:
+			del bld.prescan_pending
+		if len(pending) < PRESCAN:
+			return
+
+		n = min(self.numjobs, len(pending) // PRESCAN + 1)
+		procs = []
+		for i in range(n):
+			r, w = os.pipe()
+			pid = os.fork()
+			if not pid:
+				try:
+					os.close(r)
+					self.prescan_child(pending[i::n], w)
+				finally:
+					os._exit(0)
+			os.close(w)
+			procs.append((pid, r))
+
+		cache = {}
+		def persistent_load(path):
+			try:
+				return cache[path]
+			except KeyError:
+				node = cache[path] = bld.root.make_node(path)
+				return node
+		def loads(data):
+			unpickler = cPickle.Unpickler(BytesIO(data))
+			unpickler.persistent_load = persistent_load
+			return unpickler.load()
+
+		results = bld.prescanned
+		for (pid, r) in procs:
+			with os.fdopen(r, 'rb') as f:
+				data = f.read()
+			os.waitpid(pid, 0)
+			try:
+				(scanned, changes) = cPickle.loads(data)
+			except Exception as e:
+				Logs.debug('runner: could not obtain the scanner results: %r', e)
+				continue
+			for (key, x) in scanned:
+				results[key] = loads(x)
+			for (attr, x) in changes:
+				getattr(bld, attr).update(loads(x))
+		Logs.debug('runner: %d tasks scanned in %d processes', len(results), n)
+
+	def prescan_child(self, tasks, fd):
+		"""
+		Scans the tasks in a forked process, and writes the results to the file descriptor *fd*.
+		The Node objects are written as absolute paths.
+		"""
+		from waflib import Build, Node
+		bld = self.bld
+
+		def persistent_id(obj):
+			if isinstance(obj, Node.Node):
+				return obj.abspath()
+			return None
+		def dumps(obj):
+			buf = BytesIO()
+			pickler = cPickle.Pickler(buf, -1)
+			pickler.persistent_id = persistent_id
+			pickler.dump(obj)
+			return buf.getvalue()
+
+		snapshots = {}
+		for x in Build.SAVED_ATTRS:
+			# lazy dicts (sqlite_db) are copied without loading the entries not accessed yet
+			if not x in ('root', 'node_deps', 'raw_deps') and isinstance(getattr(bld, x, None), dict):
+				snapshots[x] = dict.copy(getattr(bld, x))
+
+		scanned = []
+		for tsk in tasks:
+			try:
+				scanned.append((tsk.uid(), dumps(tsk.scan())))
+			except Exception:
+				# the task is scanned again when it is considered
+				pass
+
+		changes = []
+		for (x, old) in snapshots.items():
+			dct = dict((k, v) for (k, v) in dict.items(getattr(bld, x)) if old.get(k) is not v)
+			if dct:
+				try:
+					changes.append((x, dumps(dct)))
+				except Exception:
+					pass
+
+		with os.fdopen(fd, 'wb') as f:
+			f.write(cPickle.dumps((scanned, changes), -1))
+
 	def add_more_tasks(self, tsk):
 		"""
 		If a task provides :py:attr:`waflib.Task.Task.more_tasks`, then the tasks contained
@@ -348,6 +754,15 @@ class Parallel(object):
 					x = sem.waiting.pop()
 					self._add_task(x)
 
+		adm = self.admission
+		if adm and adm.release(tsk):
+			while adm.waiting:
+				x = adm.waiting.pop()
+				if not adm.acquire(x):
+					adm.waiting.append(x)
+					break
+				self._add_task(x)
+
 	def get_out(self):
 		"""
 		Waits for a Task that task consumers add to :py:attr:`waflib.Runner.Parallel.out` after execution.
@@ -375,6 +790,10 @@ class Parallel(object):
 		self.ready.put(tsk)
 
 	def _add_task(self, tsk):
+		if self.admission and not self.admission.acquire(tsk):
+			self.admission.waiting.append(tsk)
+			return
+
 		if hasattr(tsk, 'semaphore'):
 			sem = tsk.semaphore
 			try:
@@ -392,6 +811,7 @@ class Parallel(object):
 			finally:
 				self.out.put(tsk)
 		else:
+			self.start_consumers()
 			self.add_task(tsk)
 
 	def process_task(self, tsk):
@@ -469,6 +889,9 @@ class Parallel(object):
 		"""
 		self.total = self.bld.total()
 
+		# scanner results of a previous build may be outdated (watch mode, build daemon)
+		self.bld.prescanned = {}
+
 		while not self.stop:
 
 			self.refill_task_list()
@@ -483,6 +906,7 @@ class Parallel(object):
 					# no tasks to run, no tasks running, time to exit
 					break
 
+			self.task_uids.add(tsk.uid())
 			if tsk.hasrun:
 				# if the task is marked as "run", just skip it
 				self.processed += 1
@@ -514,6 +938,8 @@ class Parallel(object):
 			self.get_out()
 
 		self.ready.put(None)
+		# the results of the tasks that were not considered (build errors) are not kept
+		self.bld.prescanned = {}
 		if not self.stop:
 			assert not self.count
 			assert not self.postponed
@@ -527,7 +953,10 @@ class Parallel(object):
 
 		The priority system is really meant as an optional layer for optimization:
 		dependency cycles are found quickly, and builds should be more efficient.
-		A high priority number means that a task is processed first.
+		A high priority number means that a task is processed first. When task durations
+		were recorded in previous builds (see :py:meth:`waflib.Runner.Parallel.get_durations`),
+		the tasks on the longest chains of dependent tasks are processed first, and
+		:py:attr:`waflib.Task.Task.tree_weight` counts as that amount of tasks of average duration.
 
 		This method can be overridden to disable the priority system::
 
@@ -555,24 +984,47 @@ class Parallel(object):
 				else:
 					reverse[k].add(x)
 
-		# the priority number is not the tree depth
-		def visit(n):
-			if isinstance(n, Task.TaskGroup):
-				return sum(visit(k) for k in n.next)
+		durations = self.get_durations(tasks)
+		if durations:
+			# the priority number is the duration of the longest chain of tasks
+			# that cannot start before this one is complete (critical path),
+			# the tree weights count as tasks of average duration
+			mean = sum(durations.values()) / len(durations)
+			def visit(n):
+				if isinstance(n, Task.TaskGroup):
+					return max([visit(k) for k in n.next] or [0])
+
+				if n.visited == 0:
+					n.visited = 1
+
+					if n in reverse:
+						n.prio_order = n.tree_weight * mean + durations.get(n, 0) + max([visit(k) for k in reverse[n]] or [0])
+					else:
+						n.prio_order = n.tree_weight * mean + durations.get(n, 0)
+
+					n.visited = 2
+				elif n.visited == 1:
+					raise Errors.WafError('Dependency cycle found!')
+				return n.prio_order
+		else:
+			# the priority number is not the tree depth
+			def visit(n):
+				if isinstance(n, Task.TaskGroup):
+					return sum(visit(k) for k in n.next)
 
-			if n.visited == 0:
-				n.visited = 1
+				if n.visited == 0:
+					n.visited = 1
 
-				if n in reverse:
-					rev = reverse[n]
-					n.prio_order = n.tree_weight + len(rev) + sum(visit(k) for k in rev)
-				else:
-					n.prio_order = n.tree_weight
+					if n in reverse:
+						rev = reverse[n]
+						n.prio_order = n.tree_weight + len(rev) + sum(visit(k) for k in rev)
+					else:
+						n.prio_order = n.tree_weight
 
-				n.visited = 2
-			elif n.visited == 1:
-				raise Errors.WafError('Dependency cycle found!')
-			return n.prio_order
+					n.visited = 2
+				elif n.visited == 1:
+					raise Errors.WafError('Dependency cycle found!')
+				return n.prio_order
 
 		for x in tasks:
 			if x.visited != 0:
@@ -594,6 +1046,44 @@ class Parallel(object):
 				ready.append(x)
 		return (ready, waiting)
 
+	def get_durations(self, tasks):
+		"""
+		Obtains the expected execution time of the tasks from the durations recorded in
+		previous builds (:py:attr:`waflib.Build.BuildContext.task_times`). Tasks that never
+		ran are given the average duration of the tasks of the same class, or the average
+		duration of all tasks.
+
+		:param tasks: task instances
+		:type tasks: list of :py:class:`waflib.Task.Task`
+		:return: a dict mapping tasks to durations in seconds, or None if no duration is known
+		:rtype: dict or None
+		"""
+		times = self.bld.task_times
+		durations = {}
+		classes = {}
+		unknown = []
+		for x in tasks:
+			val = times.get(x.uid())
+			if val is None:
+				unknown.append(x)
+			else:
+				durations[x] = val
+				acc = classes.setdefault(x.__class__, [0, 0.])
+				acc[0] += 1
+				acc[1] += val
+		if not durations:
+			return None
+		if unknown:
+			default = sum(durations.values()) / len(durations)
+			for x in unknown:
+				try:
+					(cnt, total) = classes[x.__class__]
+				except KeyError:
+					durations[x] = default
+				else:
+					durations[x] = total / cnt
+		return durations
+
 	def debug_cycles(self, tasks, reverse):
 		tmp = {}
 		for x in tasks:
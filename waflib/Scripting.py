@@ -6,7 +6,7 @@
 
 from __future__ import with_statement
 
-import os, shlex, shutil, traceback, errno, sys, stat
+import os, shlex, shutil, traceback, errno, sys, stat, struct, signal, tempfile
 from waflib import Utils, Configure, Logs, Options, ConfigSet, Context, Errors, Build, Node
 
 build_dir_override = None
@@ -15,6 +15,9 @@ no_climb_commands = ['configure']
 
 default_cmd = "build"
 
+daemon_commands = ['build', 'install', 'uninstall', 'list']
+"""Commands that may be executed by a build daemon, see :py:func:`waflib.Scripting.run_daemon_client`"""
+
 def waf_entry_point(current_directory, version, wafdir):
 	"""
 	This is the main entry point, all Waf execution starts here.
@@ -32,6 +35,10 @@ def waf_entry_point(current_directory, version, wafdir):
 		Logs.error('Waf script %r and library %r do not match (directory %r)', version, Context.WAFVERSION, wafdir)
 		sys.exit(1)
 
+	if not Utils.HASH in ('md5', 'blake2b'):
+		Logs.error('Waf: Unsupported hash function WAF_HASH=%r (md5 or blake2b)', Utils.HASH)
+		sys.exit(1)
+
 	# Store current directory before any chdir
 	Context.waf_dir = wafdir
 	Context.run_dir = Context.launch_dir = current_directory
@@ -68,6 +75,7 @@ def waf_entry_point(current_directory, version, wafdir):
 	# try to find a lock file (if the project was configured)
 	# at the same time, store the first wscript file seen
 	cur = start_dir
+	use_daemon = False
 	while cur:
 		try:
 			lst = os.listdir(cur)
@@ -108,6 +116,8 @@ def waf_entry_point(current_directory, version, wafdir):
 					Context.run_dir = env.run_dir
 					Context.top_dir = env.top_dir
 					Context.out_dir = env.out_dir
+					# set when the build_daemon tool is loaded during the configuration
+					use_daemon = (env.options or {}).get('build_daemon')
 					break
 
 		if not Context.run_dir:
@@ -122,6 +132,11 @@ def waf_entry_point(current_directory, version, wafdir):
 		if no_climb:
 			break
 
+	if use_daemon and Context.out_dir and not (options.whelp or options.profile or options.pdb or os.environ.get('NODAEMON')):
+		ret = run_daemon_client(commands or [default_cmd])
+		if ret is not None:
+			sys.exit(ret)
+
 	wscript = os.path.normpath(os.path.join(Context.run_dir, Context.WSCRIPT_FILE))
 	if not os.path.exists(wscript):
 		if options.whelp:
@@ -179,6 +194,112 @@ def waf_entry_point(current_directory, version, wafdir):
 			Logs.pprint('RED', 'Interrupted')
 			sys.exit(68)
 
+def get_daemon_socket(out_dir, create=False):
+	"""
+	The length of socket paths is limited, so the socket of a long build directory path is placed
+	in a folder of the temporary directory that only the current user may access.
+
+	:param out_dir: absolute path of the build directory
+	:type out_dir: string
+	:param create: create the folder of the socket if necessary
+	:type create: bool
+	:return: path of the socket of the build daemon serving *out_dir* (see :py:mod:`waflib.extras.build_daemon`)
+	:rtype: string
+	:raises: OSError if the folder does not exist, or if it does not belong to the current user
+	"""
+	path = os.path.join(out_dir, '.wafdaemon-%d' % Context.ABI)
+	if len(path) <= 100:
+		return path
+
+	folder = os.path.join(tempfile.gettempdir(), 'wafdaemon-%d' % os.getuid())
+	if create:
+		try:
+			os.mkdir(folder, 0o700)
+		except OSError as e:
+			if e.errno != errno.EEXIST:
+				raise
+	st = os.lstat(folder)
+	if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+		raise OSError('The folder %r must belong to the current user and be private' % folder)
+	return os.path.join(folder, Utils.to_hex(Utils.h_list(out_dir))[:16])
+
+def run_daemon_client(commands):
+	"""
+	Executes the current command-line in the build daemon of the build directory, if one is running.
+	The standard file descriptors are passed to the daemon, and interruptions are forwarded to it.
+	This is only attempted in projects configured with the tool :py:mod:`waflib.extras.build_daemon`;
+	set the environment variable *NODAEMON* to disable.
+
+	:param commands: the commands given on the command-line
+	:type commands: list of string
+	:return: the exit status, or None if the commands must be executed by the current process
+	"""
+	import socket, array
+	if not hasattr(socket, 'AF_UNIX') or not hasattr(socket.socket, 'sendmsg'):
+		return None
+	for x in commands:
+		if not x in daemon_commands:
+			return None
+	try:
+		path = get_daemon_socket(Context.out_dir)
+		st = os.lstat(path)
+	except OSError as e:
+		if e.errno != errno.ENOENT:
+			Logs.warn('Waf: Cannot use the build daemon: %s', e)
+		return None
+	if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+		Logs.warn('Waf: Cannot use the build daemon: %r does not belong to the current user', path)
+		return None
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		data = Utils.cPickle.dumps({
+			'version': Context.HEXVERSION,
+			'argv': sys.argv,
+			'cwd': Context.launch_dir,
+			'env': dict(os.environ)}, -1)
+		buf = b''
+		try:
+			sock.connect(path)
+			if hasattr(socket, 'SO_PEERCRED'):
+				# the environment and the file descriptors are only sent to processes of the current user
+				uid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))[1]
+				if uid != os.getuid():
+					Logs.warn('Waf: Cannot use the build daemon: %r is served by another user (%d)', path, uid)
+					return None
+			sock.sendmsg([struct.pack('!I', len(data)) + data],
+				[(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [0, 1, 2]))])
+			while not b'\n' in buf:
+				k = sock.recv(64)
+				if not k:
+					break
+				buf += k
+		except (OSError, socket.error) as e:
+			Logs.debug('daemon: cannot use %r: %r', path, e)
+			return None
+		if not buf.split(b'\n')[0].isdigit():
+			Logs.debug('daemon: request rejected by %r', path)
+			return None
+		pid = int(buf.split(b'\n')[0])
+		buf = buf.split(b'\n', 1)[1]
+
+		while not b'\n' in buf:
+			try:
+				k = sock.recv(64)
+			except KeyboardInterrupt:
+				os.kill(pid, signal.SIGINT)
+				continue
+			if not k:
+				break
+			buf += k
+		try:
+			return int(buf.split(b'\n')[0])
+		except ValueError:
+			Logs.error('Waf: The build daemon %r exited unexpectedly', path)
+			return 2
+	finally:
+		sock.close()
+
 def set_main_module(file_path):
 	"""
 	Read the main wscript file into :py:const:`waflib.Context.Context.g_module` and
@@ -6,7 +6,7 @@
 Tasks represent atomic operations such as processes.
 """
 
-import os, re, sys, tempfile, traceback
+import os, re, sys, tempfile, time, traceback
 from waflib import Utils, Logs, Errors
 
 # task states
@@ -346,6 +346,8 @@ class Task(evil):
 		except KeyError:
 			pass
 
+		start = time.time()
+		Utils.process_rusage.maxrss = 0
 		try:
 			ret = self.run()
 		except Exception:
@@ -365,6 +367,12 @@ class Task(evil):
 					self.hasrun = EXCEPTION
 				else:
 					self.hasrun = SUCCESS
+					# durations are used to compute the critical path in the next builds
+					bld = self.generator.bld
+					bld.task_times[self.uid()] = time.time() - start
+					if Utils.process_rusage.maxrss:
+						# see Runner.Admission
+						bld.task_rss[self.uid()] = Utils.process_rusage.maxrss
 
 		if self.hasrun != SUCCESS and self.scan:
 			# rescan dependencies on next run
@@ -846,7 +854,15 @@ class Task(evil):
 			raise Errors.TaskRescan('rescan')
 
 		# no previous run or the signature of the dependencies has changed, rescan the dependencies
-		(bld.node_deps[key], bld.raw_deps[key]) = self.scan()
+		try:
+			deps = bld.prescanned.pop(key)
+		except (AttributeError, KeyError):
+			if getattr(bld, 'prescan_pending', None) is not None:
+				# scanned in parallel later, see Runner.Parallel.prescan
+				bld.prescan_pending.append(self)
+				raise Errors.TaskNotReady('scan pending')
+			deps = self.scan()
+		(bld.node_deps[key], bld.raw_deps[key]) = deps
 		if Logs.verbose:
 			Logs.debug('deps: scanner for %s: %r; unresolved: %r', self, bld.node_deps[key], bld.raw_deps[key])
 
@@ -16,6 +16,13 @@ from waflib import Task, Utils, Logs, Errors, ConfigSet, Node
 feats = Utils.defaultdict(set)
 """remember the methods declaring features"""
 
+meths_cache = {}
+"""
+Order of the task generator methods by methods and features, see :py:meth:`waflib.TaskGen.task_gen.post`;
+it is reset by the decorators :py:func:`waflib.TaskGen.feature`, :py:func:`waflib.TaskGen.before_method`
+and :py:func:`waflib.TaskGen.after_method`
+"""
+
 HEADER_EXTS = ['.h', '.hpp', '.hxx', '.hh']
 
 class task_gen(object):
@@ -171,62 +178,19 @@ class task_gen(object):
 			return False
 		self.posted = True
 
-		keys = set(self.meths)
-		keys.update(feats['*'])
-
 		# add the methods listed in the features
 		self.features = Utils.to_list(self.features)
-		for x in self.features:
-			st = feats[x]
-			if st:
-				keys.update(st)
-			elif not x in Task.classes:
-				Logs.warn('feature %r does not exist - bind at least one method to it?', x)
-
-		# copy the precedence table
-		prec = {}
 		prec_tbl = self.prec
-		for x in prec_tbl:
-			if x in keys:
-				prec[x] = prec_tbl[x]
-
-		# elements disconnected
-		tmp = []
-		for a in keys:
-			for x in prec.values():
-				if a in x:
-					break
-			else:
-				tmp.append(a)
-
-		tmp.sort(reverse=True)
-
-		# topological sort
-		out = []
-		while tmp:
-			e = tmp.pop()
-			if e in keys:
-				out.append(e)
+		if prec_tbl is task_gen.prec:
+			# the order only depends on the methods and on the features
+			key = (tuple(self.meths), tuple(self.features))
 			try:
-				nlst = prec[e]
+				out = meths_cache[key]
 			except KeyError:
-				pass
-			else:
-				del prec[e]
-				for x in nlst:
-					for y in prec:
-						if x in prec[y]:
-							break
-					else:
-						tmp.append(x)
-						tmp.sort(reverse=True)
-
-		if prec:
-			buf = ['Cycle detected in the method execution:']
-			for k, v in prec.items():
-				buf.append('- %s after %s' % (k, [x for x in v if x in prec]))
-			raise Errors.WafError('\n'.join(buf))
-		self.meths = out
+				out = meths_cache[key] = sort_methods(self.meths, self.features, prec_tbl)
+		else:
+			out = sort_methods(self.meths, self.features, prec_tbl)
+		self.meths = out = list(out)
 
 		# then we run the methods in order
 		Logs.debug('task_gen: posting %s %d', self, id(self))
@@ -312,6 +276,75 @@ class task_gen(object):
 
 		return newobj
 
+def sort_methods(meths, features, prec_tbl):
+	"""
+	Sorts the task generator methods to execute for the given features, see :py:meth:`waflib.TaskGen.task_gen.post`
+
+	:param meths: method names
+	:type meths: list of string
+	:param features: feature names
+	:type features: list of string
+	:param prec_tbl: precedence table
+	:type prec_tbl: dict
+	:return: the methods in execution order
+	:rtype: list of string
+	:raises: :py:class:`waflib.Errors.WafError` if the constraints contain a cycle
+	"""
+	keys = set(meths)
+	keys.update(feats['*'])
+
+	# add the methods listed in the features
+	for x in features:
+		st = feats[x]
+		if st:
+			keys.update(st)
+		elif not x in Task.classes:
+			Logs.warn('feature %r does not exist - bind at least one method to it?', x)
+
+	# copy the precedence table
+	prec = {}
+	for x in prec_tbl:
+		if x in keys:
+			prec[x] = prec_tbl[x]
+
+	# elements disconnected
+	tmp = []
+	for a in keys:
+		for x in prec.values():
+			if a in x:
+				break
+		else:
+			tmp.append(a)
+
+	tmp.sort(reverse=True)
+
+	# topological sort
+	out = []
+	while tmp:
+		e = tmp.pop()
+		if e in keys:
+			out.append(e)
+		try:
+			nlst = prec[e]
+		except KeyError:
+			pass
+		else:
+			del prec[e]
+			for x in nlst:
+				for y in prec:
+					if x in prec[y]:
+						break
+				else:
+					tmp.append(x)
+					tmp.sort(reverse=True)
+
+	if prec:
+		buf = ['Cycle detected in the method execution:']
+		for k, v in prec.items():
+			buf.append('- %s after %s' % (k, [x for x in v if x in prec]))
+		raise Errors.WafError('\n'.join(buf))
+	return out
+
 def declare_chain(name='', rule=None, reentrant=None, color='BLUE',
 	ext_in=[], ext_out=[], before=[], after=[], decider=None, scan=None, install_path=None, shell=False):
 	"""
@@ -414,6 +447,7 @@ def feature(*k):
 		setattr(task_gen, func.__name__, func)
 		for name in k:
 			feats[name].update([func.__name__])
+		meths_cache.clear()
 		return func
 	return deco
 
@@ -440,6 +474,7 @@ def before_method(*k):
 		setattr(task_gen, func.__name__, func)
 		for fun_name in k:
 			task_gen.prec[func.__name__].add(fun_name)
+		meths_cache.clear()
 		return func
 	return deco
 before = before_method
@@ -467,6 +502,7 @@ def after_method(*k):
 		setattr(task_gen, func.__name__, func)
 		for fun_name in k:
 			task_gen.prec[fun_name].add(func.__name__)
+		meths_cache.clear()
 		return func
 	return deco
 after = after_method
@@ -35,8 +35,8 @@ Support for pure asm programs and libraries should also work::
 """
 
 import re
-from waflib import Errors, Logs, Task
-from waflib.Tools.ccroot import link_task, stlink_task
+from waflib import Errors, Logs
+from waflib.Tools.ccroot import compile_task, link_task, stlink_task
 from waflib.TaskGen import extension
 from waflib.Tools import c_preproc
 
@@ -51,7 +51,7 @@ class asm_parser(c_preproc.c_parser):
 		code = c_preproc.re_cpp.sub(c_preproc.repl, code)
 		return re_lines.findall(code)
 
-class asm(Task.Task):
+class asm(compile_task):
 	"""
 	Compiles asm files by gas/nasm/yasm/...
 	"""
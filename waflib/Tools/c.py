@@ -4,9 +4,9 @@
 
 "Base for c programs/libraries"
 
-from waflib import TaskGen, Task
+from waflib import TaskGen
 from waflib.Tools import c_preproc
-from waflib.Tools.ccroot import link_task, stlink_task
+from waflib.Tools.ccroot import compile_task, link_task, stlink_task
 
 @TaskGen.extension('.c')
 def c_hook(self, node):
@@ -15,7 +15,7 @@ def c_hook(self, node):
 		return self.create_compiled_task('cxx', node)
 	return self.create_compiled_task('c', node)
 
-class c(Task.Task):
+class c(compile_task):
 	"Compiles C files into object files"
 	run_str = '${CC} ${ARCH_ST:ARCH} ${CFLAGS} ${FRAMEWORKPATH_ST:FRAMEWORKPATH} ${CPPPATH_ST:INCPATHS} ${DEFINES_ST:DEFINES} ${CC_SRC_F}${SRC} ${CC_TGT_F}${TGT[0].abspath()} ${CPPFLAGS}'
 	vars    = ['CCDEPS'] # unused variable to depend on, just in case
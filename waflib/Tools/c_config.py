@@ -726,6 +726,39 @@ def check_cc(self, *k, **kw):
 	kw['compiler'] = 'c'
 	return self.check(*k, **kw)
 
+@conf
+def check_compiler_deps(self, flags=None):
+	"""
+	Enables the dependency files written by the compilers (gcc, clang and the cross compilers
+	accepting the same flags) in place of the Python dependency scanner for the c, c++
+	and assembly tasks. The compilers that are not configured or that do not write the
+	files are skipped::
+
+		def configure(conf):
+			conf.load('compiler_c compiler_cxx gas')
+			conf.check_compiler_deps()
+
+	:param flags: compiler flags writing the dependency file next to the object file (default: ``env.COMPILER_DEPS_FLAGS`` or ``-MMD``)
+	:type flags: list of string
+	"""
+	from waflib.Tools import ccroot
+	flags = Utils.to_list(flags or ccroot.get_compiler_deps_flags(self.env))
+
+	for (name, compiler, var, kw) in (
+			('c', 'CC', 'CFLAGS', {}),
+			('cxx', 'CXX', 'CXXFLAGS', {}),
+			('asm', 'AS', 'ASFLAGS', {'compile_filename': 'test.S', 'code': ''})):
+		if not self.env[compiler] or not Task.classes.get(name) or name in self.env.COMPILER_DEPS:
+			continue
+		if self.env[compiler + '_NAME'] == 'msvc':
+			# /showIncludes is processed by waflib.extras.msvcdeps
+			continue
+		# the feature adds the flags, see waflib.Tools.ccroot.force_compiler_deps
+		if self.check(features='%s compiler_deps' % name, msg='Checking for %s dependency files' % name,
+				errmsg='no', mandatory=False, compiler_deps_flags=flags, **kw):
+			self.env.append_value(var, flags)
+			self.env.append_unique('COMPILER_DEPS', name)
+
 @conf
 def set_define_comment(self, key, comment):
 	"""
@@ -1017,12 +1050,14 @@ def cxx_load_tools(conf):
 	conf.load('cxx')
 
 @conf
-def get_cc_version(conf, cc, gcc=False, icc=False, clang=False):
+def get_cc_predefined(conf, cc):
 	"""
-	Runs the preprocessor to determine the gcc/icc/clang version
-
-	The variables CC_VERSION, DEST_OS, DEST_BINFMT and DEST_CPU will be set in *conf.env*
+	Runs the preprocessor to obtain the macros predefined by a gcc/icc/clang compiler
 
+	:param cc: compiler command
+	:type cc: list of string
+	:return: the preprocessor output
+	:rtype: string
 	:raise: :py:class:`waflib.Errors.ConfigurationError`
 	"""
 	cmd = cc + ['-dM', '-E', '-']
@@ -1031,6 +1066,18 @@ def get_cc_version(conf, cc, gcc=False, icc=False, clang=False):
 		out, err = conf.cmd_and_log(cmd, output=0, input='\n'.encode(), env=env)
 	except Errors.WafError:
 		conf.fatal('Could not determine the compiler version %r' % cmd)
+	return out
+
+@conf
+def get_cc_version(conf, cc, gcc=False, icc=False, clang=False):
+	"""
+	Runs the preprocessor to determine the gcc/icc/clang version
+
+	The variables CC_VERSION, DEST_OS, DEST_BINFMT and DEST_CPU will be set in *conf.env*
+
+	:raise: :py:class:`waflib.Errors.ConfigurationError`
+	"""
+	out = conf.get_cc_predefined(cc)
 
 	if gcc:
 		if out.find('__INTEL_COMPILER') >= 0:
@@ -1278,6 +1325,8 @@ def multicheck(self, *k, **kw):
 		def __init__(self):
 			self.keep = False
 			self.task_sigs = {}
+			self.task_times = {}
+			self.task_rss = {}
 			self.progress_bar = 0
 		def total(self):
 			return len(tasks)
@@ -35,6 +35,14 @@ class PreprocError(Errors.WafError):
 FILE_CACHE_SIZE = 100000
 LINE_CACHE_SIZE = 100000
 
+TOKEN_CACHE_SIZE = 100000
+"""Amount of tokenized lines, parsed macros and evaluated expressions to keep, as the same lines are
+found in many files (set to 0 to disable)"""
+
+PERSISTENT_LINES = True
+"""Keep the preprocessor lines of the files in the build data (``bld.preproc_lines``, by file signature)
+so that the next builds only read the files whose contents changed"""
+
 POPFILE = '-'
 "Constant representing a special token used in :py:meth:`waflib.Tools.c_preproc.c_parser.start` iteration to switch to a header read previously"
 
@@ -433,7 +441,7 @@ def reduce_tokens(lst, defs, ban=[]):
 		elif p == IDENT and v in defs:
 
 			if isinstance(defs[v], str):
-				a, b = extract_macro(defs[v])
+				a, b = cached(macro_cache, extract_macro, defs[v])
 				defs[v] = b
 			macro_def = defs[v]
 			to_add = macro_def[1]
@@ -443,9 +451,8 @@ def reduce_tokens(lst, defs, ban=[]):
 				del lst[i]
 				accu = to_add[:]
 				reduce_tokens(accu, defs, ban+[v])
-				for tmp in accu:
-					lst.insert(i, tmp)
-					i += 1
+				lst[i:i] = accu
+				i += len(accu)
 			else:
 				# collect the arguments for the funcall
 
@@ -562,9 +569,7 @@ def reduce_tokens(lst, defs, ban=[]):
 
 
 				reduce_tokens(accu, defs, ban+[v])
-
-				for x in range(len(accu)-1, -1, -1):
-					lst.insert(i, accu[x])
+				lst[i:i] = accu
 
 		i += 1
 
@@ -588,7 +593,16 @@ def eval_macro(lst, defs):
 		if p == IDENT and v not in defs:
 			raise PreprocError('missing macro %r' % lst)
 
-	p, v = reduce_eval(lst)
+	# the expressions are usually the same once the macros are replaced
+	return cached(eval_cache, eval_tokens, tuple(lst))
+
+def eval_tokens(lst):
+	"""
+	:param lst: tokens in which the macros were replaced
+	:type lst: tuple of tuple(token, value)
+	:rtype: bool
+	"""
+	p, v = reduce_eval(list(lst))
 	return int(v) != 0
 
 def extract_macro(txt):
@@ -736,49 +750,70 @@ def tokenize(s):
 	:return: a list of tokens
 	:rtype: list of tuple(token, value)
 	"""
-	return tokenize_private(s)[:] # force a copy of the results
+	return cached(tokenize_cache, tokenize_private, s)[:] # force a copy of the results
 
 def tokenize_private(s):
 	ret = []
 	for match in re_clexer.finditer(s):
-		m = match.group
-		for name in tok_types:
-			v = m(name)
-			if v:
-				if name == IDENT:
-					if v in g_optrans:
-						name = OP
-					elif v.lower() == "true":
-						v = 1
-						name = NUM
-					elif v.lower() == "false":
-						v = 0
-						name = NUM
-				elif name == NUM:
-					if m('oct'):
-						v = int(v, 8)
-					elif m('hex'):
-						v = int(m('hex'), 16)
-					elif m('n0'):
-						v = m('n0')
-					else:
-						v = m('char')
-						if v:
-							v = parse_char(v)
-						else:
-							v = m('n2') or m('n4')
-				elif name == OP:
-					if v == '%:':
-						v = '#'
-					elif v == '%:%:':
-						v = '##'
-				elif name == STR:
-					# remove the quotes around the string
-					v = v[1:-1]
-				ret.append((name, v))
-				break
+		# the token type is the outermost group, which is always the last one to close
+		name = match.lastgroup
+		v = match.group(name)
+		if not v:
+			continue
+		if name == IDENT:
+			if v in g_optrans:
+				name = OP
+			elif v.lower() == "true":
+				v = 1
+				name = NUM
+			elif v.lower() == "false":
+				v = 0
+				name = NUM
+		elif name == NUM:
+			m = match.group
+			if m('oct'):
+				v = int(v, 8)
+			elif m('hex'):
+				v = int(m('hex'), 16)
+			elif m('n0'):
+				v = m('n0')
+			else:
+				v = m('char')
+				if v:
+					v = parse_char(v)
+				else:
+					v = m('n2') or m('n4')
+		elif name == OP:
+			if v == '%:':
+				v = '#'
+			elif v == '%:%:':
+				v = '##'
+		elif name == STR:
+			# remove the quotes around the string
+			v = v[1:-1]
+		ret.append((name, v))
 	return ret
 
+tokenize_cache = {}
+macro_cache = {}
+eval_cache = {}
+
+def cached(cache, fun, key):
+	"""
+	Returns the value of fun(key), computed once for the same key while the cache is smaller than
+	:py:const:`waflib.Tools.c_preproc.TOKEN_CACHE_SIZE`. The results must not be modified.
+	The caches are plain dicts and may be shared by threads scanning files concurrently.
+	"""
+	try:
+		return cache[key]
+	except KeyError:
+		ret = fun(key)
+		if len(cache) >= TOKEN_CACHE_SIZE:
+			cache.clear()
+		if TOKEN_CACHE_SIZE:
+			cache[key] = ret
+		return ret
+
 def format_defines(lst):
 	ret = []
 	for y in lst:
@@ -852,11 +887,11 @@ class c_parser(object):
 		except KeyError:
 			ret = node.find_resource(filename)
 			if ret:
-				if getattr(ret, 'children', None):
+				if getattr(ret, 'children', None) or getattr(ret, 'lazy_children', None):
 					ret = None
 				elif ret.is_child_of(node.ctx.bldnode):
 					tmp = node.ctx.srcnode.search_node(ret.path_from(node.ctx.bldnode))
-					if tmp and getattr(tmp, 'children', None):
+					if tmp and (getattr(tmp, 'children', None) or getattr(tmp, 'lazy_children', None)):
 						ret = None
 			cache[key] = ret
 			return ret
@@ -927,6 +962,15 @@ class c_parser(object):
 		return re_lines.findall(code)
 
 	def parse_lines(self, node):
+		"""
+		Returns the preprocessor lines of a file in reverse order, see :py:meth:`waflib.Tools.c_preproc.c_parser.filter_comments`.
+		The lines are cached for the duration of the build, and across builds by file signature
+		(see :py:const:`waflib.Tools.c_preproc.PERSISTENT_LINES`).
+
+		:param node: c/h file
+		:type node: :py:class:`waflib.Node.Node`
+		:rtype: a list of string pairs
+		"""
 		try:
 			cache = node.ctx.preproc_cache_lines
 		except AttributeError:
@@ -934,10 +978,28 @@ class c_parser(object):
 		try:
 			return cache[node]
 		except KeyError:
-			cache[node] = lines = self.filter_comments(node)
-			lines.append((POPFILE, ''))
-			lines.reverse()
-			return lines
+			pass
+
+		sig = None
+		saved = getattr(node.ctx, 'preproc_lines', None)
+		if PERSISTENT_LINES and saved is not None:
+			# the file hashes are usually cached, see Node.h_file
+			sig = node.h_file()
+			try:
+				(k, lines) = saved[node]
+			except KeyError:
+				pass
+			else:
+				if k == sig:
+					cache[node] = lines
+					return lines
+
+		cache[node] = lines = self.filter_comments(node)
+		lines.append((POPFILE, ''))
+		lines.reverse()
+		if sig is not None:
+			saved[node] = (sig, lines)
+		return lines
 
 	def addlines(self, node):
 		"""
@@ -964,8 +1026,59 @@ class c_parser(object):
 			if Logs.verbose > 0:
 				Logs.error('parsing %r failed %s', node, traceback.format_exc())
 		else:
+			guard = self.get_guard(node, lines)
+			if guard and guard in self.defs:
+				# the whole file is in a dead #ifndef block
+				self.count_files -= 1
+				self.currentnode_stack.pop()
+				return
 			self.lines.extend(lines)
 
+	def get_guard(self, node, lines):
+		"""
+		Finds the macro protecting a file against multiple inclusions, as in::
+
+			#ifndef FOO_H
+			#define FOO_H
+			...
+			#endif
+
+		:param node: c/h file
+		:type node: :py:class:`waflib.Node.Node`
+		:param lines: preprocessor lines of the file, see :py:meth:`waflib.Tools.c_preproc.c_parser.parse_lines`
+		:type lines: list of string pairs
+		:return: the macro name, or None if the file is not protected by a macro
+		:rtype: string
+		"""
+		try:
+			cache = node.ctx.preproc_cache_guards
+		except AttributeError:
+			cache = node.ctx.preproc_cache_guards = {}
+		try:
+			return cache[node]
+		except KeyError:
+			pass
+
+		ret = None
+		# the lines are in reverse order, the first one is POPFILE
+		if len(lines) > 2 and lines[-1][0] == 'ifndef' and lines[1][0] == 'endif':
+			m = re_mac.match(lines[-1][1])
+			depth = 0
+			for i in range(len(lines) - 1, 0, -1):
+				token = lines[i][0]
+				if token[:2] == 'if':
+					depth += 1
+				elif token == 'endif':
+					depth -= 1
+					if depth == 0:
+						if i == 1 and m:
+							ret = m.group()
+						break
+				elif depth == 1 and token in ('else', 'elif'):
+					break
+		cache[node] = ret
+		return ret
+
 	def start(self, node, env):
 		"""
 		Preprocess a source file to obtain the dependencies, which are accumulated to :py:attr:`waflib.Tools.c_preproc.c_parser.nodes`
@@ -123,6 +123,157 @@ def apply_incpaths(self):
 	cwd = self.get_cwd()
 	self.env.INCPATHS = [x.path_from(cwd) for x in lst]
 
+re_deps_splitter = re.compile(r'(?<!\\)\s+')
+"""Splits the dependency files on spaces, except when spaces are escaped"""
+
+deps_lock = Utils.threading.Lock()
+
+def parse_compiler_deps(txt):
+	"""
+	Parses the contents of a dependency file in the Makefile format (``-MD``, ``-MMD``),
+	whether the compiler writes a single rule or one rule per dependency
+
+	:param txt: file contents
+	:type txt: string
+	:return: the paths of the dependencies, in the order given
+	:rtype: list of string
+	"""
+	ret = []
+	for line in txt.replace('\\\n', ' ').splitlines():
+		# a colon followed by a space, because of the colons in the windows paths
+		pos = line.find(': ')
+		if pos >= 0:
+			line = line[pos + 2:]
+		elif line.rstrip().endswith(':'):
+			# rule without dependencies (-MP)
+			continue
+		ret.extend(x.replace('\\ ', ' ') for x in re_deps_splitter.split(line) if x)
+	return ret
+
+def resolve_compiler_deps(bld, paths, cwd):
+	"""
+	Converts the paths read from a dependency file into Node objects. The results are cached
+	for the whole build, and the paths not found in the cache are resolved at once.
+
+	:param bld: build context
+	:type bld: :py:class:`waflib.Build.BuildContext`
+	:param paths: absolute paths or paths relative to *cwd*
+	:type paths: list of string
+	:param cwd: directory in which the compiler was executed
+	:type cwd: :py:class:`waflib.Node.Node`
+	:rtype: list of :py:class:`waflib.Node.Node`
+	:raises: :py:class:`waflib.Errors.WafError` if a file cannot be found
+	"""
+	try:
+		cache = bld.compiler_deps_nodes
+	except AttributeError:
+		cache = bld.compiler_deps_nodes = {}
+
+	keys = [x if os.path.isabs(x) else (cwd, x) for x in paths]
+	missing = [x for x in keys if not x in cache]
+	if missing:
+		with deps_lock:
+			for x in missing:
+				if x in cache:
+					continue
+				if isinstance(x, tuple):
+					path = os.path.normpath(os.path.join(x[0].abspath(), x[1]))
+				else:
+					path = x
+				node = bld.root.find_node(path)
+				if not node:
+					raise Errors.WafError('Could not find the dependency %r' % path)
+				cache[x] = node
+	return [cache[x] for x in keys]
+
+class compile_task(Task.Task):
+	"""
+	Base class for the compilation tasks (:py:class:`waflib.Tools.c.c`, :py:class:`waflib.Tools.cxx.cxx`
+	and :py:class:`waflib.Tools.asm.asm`).
+
+	When the task class name is listed in ``env.COMPILER_DEPS`` (see :py:func:`waflib.Tools.c_config.check_compiler_deps`),
+	the dependencies are read from the file written by the compiler next to the object file
+	once the compilation is complete, and the scanner method is not used at all.
+	"""
+	def sig_implicit_deps(self):
+		"""
+		Hashes the dependencies reported by the compiler during the previous build,
+		see :py:meth:`waflib.Task.Task.sig_implicit_deps`
+		"""
+		if not self.__class__.__name__ in self.env.COMPILER_DEPS:
+			return super(compile_task, self).sig_implicit_deps()
+
+		bld = self.generator.bld
+		try:
+			return self.compute_sig_implicit_deps()
+		except EnvironmentError:
+			# a header was removed, the dependencies are obtained by compiling again
+			for x in bld.node_deps.get(self.uid(), []):
+				if not x.is_bld() and not x.exists():
+					try:
+						del x.parent.children[x.name]
+					except KeyError:
+						pass
+
+		key = self.uid()
+		bld.node_deps[key] = []
+		bld.raw_deps[key] = []
+		return Utils.SIG_NIL
+
+	def post_run(self):
+		"""
+		Reads the dependencies reported by the compiler, see :py:meth:`waflib.Task.Task.post_run`
+		"""
+		if self.__class__.__name__ in self.env.COMPILER_DEPS:
+			path = os.path.splitext(self.outputs[0].abspath())[0] + '.d'
+			try:
+				txt = Utils.readf(path)
+			except EnvironmentError:
+				raise Errors.WafError('Could not read the dependency file %r, are the compiler flags overridden?' % path)
+
+			bld = self.generator.bld
+			nodes = resolve_compiler_deps(bld, parse_compiler_deps(txt), self.get_cwd())
+			# the source file is hashed already
+			bld.node_deps[self.uid()] = [x for x in nodes if x is not self.inputs[0]]
+			bld.raw_deps[self.uid()] = []
+			Logs.debug('deps: compiler dependencies for %s: %r', self, bld.node_deps[self.uid()])
+			try:
+				del self.cache_sig
+			except AttributeError:
+				pass
+		super(compile_task, self).post_run()
+
+def get_compiler_deps_flags(env):
+	"""
+	:return: the compiler flags writing the dependency file next to the object file (``env.COMPILER_DEPS_FLAGS`` or ``-MMD``)
+	:rtype: list of string
+	"""
+	flags = env.COMPILER_DEPS_FLAGS
+	if not flags:
+		# -MMD skips the system headers, which the scanner ignores as well
+		flags = c_preproc.go_absolute and ['-MD'] or ['-MMD']
+	return Utils.to_list(flags)
+
+@feature('compiler_deps')
+@before_method('process_source')
+def force_compiler_deps(self):
+	"""
+	Uses the dependencies reported by the compiler for the task generator, see :py:class:`waflib.Tools.ccroot.compile_task`.
+	The flags writing the dependency files are given by the attribute *compiler_deps_flags*
+	(default: :py:func:`waflib.Tools.ccroot.get_compiler_deps_flags`), and are added
+	to the languages that are not enabled in the configuration already. The compilers
+	reporting the dependencies in another way (msvc) keep the Python dependency scanner::
+
+		def build(bld):
+			bld.program(source='main.c', target='app', features='compiler_deps')
+	"""
+	flags = Utils.to_list(getattr(self, 'compiler_deps_flags', None) or get_compiler_deps_flags(self.env))
+	for (name, var, compiler) in (('asm', 'ASFLAGS', 'AS_NAME'), ('c', 'CFLAGS', 'CC_NAME'), ('cxx', 'CXXFLAGS', 'CXX_NAME')):
+		if name in self.env.COMPILER_DEPS or self.env[compiler] == 'msvc':
+			continue
+		self.env.append_value(var, flags)
+		self.env.append_value('COMPILER_DEPS', name)
+
 class link_task(Task.Task):
 	"""
 	Base class for all link tasks. A task generator is supposed to have at most one link task bound in the attribute *link_task*. See :py:func:`waflib.Tools.ccroot.apply_link`.
@@ -60,6 +60,39 @@ else:
 		# Fips? #2213
 		from hashlib import sha1 as md5
 
+HASH = os.environ.get('WAF_HASH', 'md5')
+"""
+Hash function used for the file and task signatures, set through the *WAF_HASH*
+environment variable: *md5* (default) or *blake2b* (faster on 64-bit machines, Python >= 3.6).
+The function is exposed as :py:func:`waflib.Utils.md5` whatever its actual name.
+The build data is kept separately for each function (see :py:const:`waflib.Context.DBFILE`),
+so changing it causes a full rebuild the first time only.
+"""
+
+if HASH == 'blake2b':
+	try:
+		from hashlib import blake2b
+	except ImportError:
+		HASH = 'md5'
+	else:
+		def md5(s=b''):
+			# same digest size as md5, see SIG_NIL
+			return blake2b(s, digest_size=16)
+elif HASH != 'md5':
+	# reported by waflib.Scripting.waf_entry_point, md5 is used meanwhile
+	pass
+
+try:
+	import mmap
+except ImportError:
+	mmap = None
+
+MMAP_SIZE = 8 * 1024 * 1024
+"""
+Files larger than this amount of bytes are hashed through a memory map by :py:func:`waflib.Utils.h_file`
+instead of being read by chunks. Set to 0 to disable.
+"""
+
 try:
 	import threading
 except ImportError:
@@ -79,7 +112,7 @@ except ImportError:
 			pass
 		def release(self):
 			pass
-	threading.Lock = threading.Thread = Lock
+	threading.Lock = threading.Thread = threading.local = Lock
 
 SIG_NIL = 'SIG_NIL_SIG_NIL_'.encode()
 """Arbitrary null value for hashes. Modify this value according to the hash function in use"""
@@ -272,8 +305,8 @@ def writef(fname, data, m='w', encoding='latin-1'):
 
 def h_file(fname):
 	"""
-	Computes a hash value for a file by using md5. Use the md5_tstamp
-	extension to get faster build hashes if necessary.
+	Computes a hash value for a file by using md5 (see :py:const:`waflib.Utils.HASH`). Large files
+	are mapped in memory (see :py:const:`waflib.Utils.MMAP_SIZE`) to avoid copying their contents.
 
 	:type fname: string
 	:param fname: path to the file to hash
@@ -282,6 +315,13 @@ def h_file(fname):
 	"""
 	m = md5()
 	with open(fname, 'rb') as f:
+		if mmap and MMAP_SIZE and os.fstat(f.fileno()).st_size > MMAP_SIZE:
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			try:
+				m.update(mm)
+			finally:
+				mm.close()
+			return m.digest()
 		while fname:
 			fname = f.read(200000)
 			m.update(fname)
@@ -930,8 +970,10 @@ def run_prefork_process(cmd, kwargs, cargs):
 	process_pool.append(proc)
 	lst = cPickle.loads(base64.b64decode(obj))
 	# Jython wrapper failures (bash/execvp)
-	assert len(lst) == 5
-	ret, out, err, ex, trace = lst
+	assert len(lst) == 6
+	ret, out, err, ex, trace, maxrss = lst
+	if maxrss:
+		process_rusage.maxrss = max(getattr(process_rusage, 'maxrss', 0), maxrss)
 	if ex:
 		if ex == 'OSError':
 			raise OSError(trace)
@@ -969,11 +1011,80 @@ def lchown(path, user=-1, group=-1):
 		group = entry[2]
 	return os.lchown(path, user, group)
 
+process_rusage = threading.local()
+"""
+Peak resident set size in kB (*maxrss* attribute) of the sub-processes executed by
+:py:func:`waflib.Utils.run_process` in the current thread, see :py:meth:`waflib.Task.Task.process`.
+It is only measured on platforms providing ``os.wait4``.
+"""
+
+def get_maxrss(usage):
+	"Returns the peak resident set size from a resource usage object, in kB"
+	if sys.platform == 'darwin':
+		return usage.ru_maxrss // 1024
+	return usage.ru_maxrss
+
+def wait4(pid, timeout=None):
+	"""
+	Waits for a sub-process to terminate by calling ``os.wait4`` on its pid
+
+	:param pid: process identifier
+	:type pid: int
+	:param timeout: amount of seconds to wait for, or None
+	:type timeout: float
+	:return: a tuple containing the exit status and the resource usage, or None on timeout
+	:rtype: tuple
+	:raises: OSError if the process was waited for already (ECHILD)
+	"""
+	if timeout is not None:
+		end = time.time() + timeout
+	delay = 0.0005
+	while 1:
+		try:
+			(ret, sts, usage) = os.wait4(pid, 0 if timeout is None else os.WNOHANG)
+		except OSError as e:
+			if e.errno != errno.EINTR:
+				raise
+			continue
+		if ret == pid:
+			break
+		remaining = end - time.time()
+		if remaining <= 0:
+			return None
+		delay = min(delay * 2, remaining, .05)
+		time.sleep(delay)
+	if os.WIFSIGNALED(sts):
+		return (-os.WTERMSIG(sts), usage)
+	return (os.WEXITSTATUS(sts), usage)
+
+class Popen(subprocess.Popen):
+	"""
+	Waits for the process with :py:func:`waflib.Utils.wait4` to record its peak resident set size in
+	:py:data:`waflib.Utils.process_rusage`. The method :py:meth:`subprocess.Popen.communicate` calls
+	:py:meth:`waflib.Utils.Popen.wait` once the outputs are read.
+	"""
+	def wait(self, timeout=None):
+		if self.returncode is None:
+			try:
+				ret = wait4(self.pid, timeout)
+			except OSError as e:
+				if e.errno != errno.ECHILD:
+					raise
+				# obtained by subprocess.Popen.poll already
+				return subprocess.Popen.wait(self)
+			if ret is None:
+				raise TimeoutExpired(self.args, timeout)
+			(self.returncode, usage) = ret
+			process_rusage.maxrss = max(getattr(process_rusage, 'maxrss', 0), get_maxrss(usage))
+		return self.returncode
+if not hasattr(os, 'wait4'):
+	Popen = subprocess.Popen
+
 def run_regular_process(cmd, kwargs, cargs={}):
 	"""
 	Executes a subprocess command by using subprocess.Popen
 	"""
-	proc = subprocess.Popen(cmd, **kwargs)
+	proc = Popen(cmd, **kwargs)
 	if kwargs.get('stdout') or kwargs.get('stderr'):
 		try:
 			out, err = proc.communicate(**cargs)
@@ -0,0 +1,307 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Keep a resident waf process per build directory to execute the build commands::
+
+	def options(opt):
+		opt.load('build_daemon')
+
+	$ waf configure
+	$ waf daemon &
+	$ waf build            # executed by the daemon
+	$ NODAEMON=1 waf build # executed by the current process
+
+Starting a build usually means reading the scripts and the Waf tools, and then
+loading the build data (node tree, signatures, dependencies) from the build directory.
+The daemon keeps these in memory between commands, so that the commands listed in
+:py:const:`waflib.Scripting.daemon_commands` (build, install, uninstall, list) start
+immediately.
+
+The waf processes started by the user connect to the daemon through a Unix socket
+(see :py:func:`waflib.Scripting.run_daemon_client`) and pass their command-line,
+environment and standard file descriptors, so that the output goes to the right
+terminal. Interrupting the client interrupts the build. The commands are executed
+in the current process when no daemon is running, or when the daemon cannot be used.
+The daemon is only looked for in projects configured with this tool, unless the
+option ``--no-build-daemon`` was given to the configuration. Both ends of the socket
+check that the other one belongs to the same user.
+
+* the scripts are read again when a wscript file changes
+* the build data is read again when another process modified it (``NODAEMON=1 waf build``, ``waf clean``)
+* the daemon exits after :py:const:`TIMEOUT` seconds without requests, or on Ctrl+C
+
+Requires Python 3.3 and a platform supporting Unix sockets.
+"""
+
+import array, os, socket, struct, sys, traceback
+from waflib import Build, ConfigSet, Context, Errors, Logs, Options, Scripting, Utils
+
+TIMEOUT = 4 * 3600
+"""Exit after this amount of seconds without requests (0 to wait forever)"""
+
+cache = {}
+"""Build data kept in memory, by variant directory: (status of the files, root node, attributes)"""
+
+def get_status(bld):
+	"""
+	:return: the status of the files holding the build data, to detect modifications by other processes
+	:rtype: list of tuples
+	"""
+	ret = []
+	try:
+		lst = sorted(os.listdir(bld.variant_dir))
+	except OSError:
+		return ret
+	for x in lst:
+		if x.startswith(Context.DBFILE):
+			try:
+				st = os.stat(os.path.join(bld.variant_dir, x))
+			except OSError:
+				continue
+			ret.append((x, st.st_ino, st.st_size, st.st_mtime))
+	return ret
+
+def remember(bld):
+	"""Keeps the build data of *bld* for the next build in the same variant directory"""
+	attrs = dict((x, getattr(bld, x)) for x in Build.SAVED_ATTRS if x != 'root')
+	if getattr(bld, 'sqlite_db', None):
+		attrs['sqlite_db'] = bld.sqlite_db
+	cache[bld.variant_dir] = (get_status(bld), bld.root, attrs)
+
+def restore(self):
+	"""
+	Binds the build data from a previous command executed by the daemon,
+	or reads it from the build directory, see :py:meth:`waflib.Build.BuildContext.restore`
+	"""
+	try:
+		(status, root, attrs) = cache[self.variant_dir]
+	except KeyError:
+		status = None
+	if status is None or status != get_status(self):
+		old_restore(self)
+		remember(self)
+		return
+
+	try:
+		env = ConfigSet.ConfigSet(os.path.join(self.cache_dir, 'build.config.py'))
+	except EnvironmentError:
+		pass
+	else:
+		if env.version < Context.HEXVERSION:
+			raise Errors.WafError('Project was configured with a different version of Waf, please reconfigure it')
+		for t in env.tools:
+			self.setup(**t)
+
+	# the nodes are bound to the build context through their class
+	self.root = root
+	self.node_class = root.__class__
+	self.node_class.ctx = self
+	for k, v in attrs.items():
+		setattr(self, k, v)
+	if getattr(self, 'sqlite_db', None):
+		self.sqlite_db.bld = self
+	self.init_dirs()
+
+def store(self):
+	"""Writes the build data, see :py:meth:`waflib.Build.BuildContext.store`"""
+	old_store(self)
+	remember(self)
+
+old_restore = old_store = None
+
+def options(opt):
+	opt.add_option('--no-build-daemon', dest='build_daemon', default=True, action='store_false',
+		help='do not execute the build commands in the build daemon (configuration option)')
+
+class DaemonContext(Context.Context):
+	'''keeps waf in memory to execute the build commands faster'''
+	cmd = 'daemon'
+
+	def execute(self):
+		"""
+		Serves the requests of the clients until interrupted
+		"""
+		if not hasattr(socket, 'AF_UNIX') or not hasattr(socket.socket, 'recvmsg'):
+			raise Errors.WafError('The build daemon requires Python >= 3.3 and Unix sockets')
+		if not Context.out_dir:
+			raise Errors.WafError('The project was not configured: run "waf configure" first!')
+
+		global old_restore, old_store
+		if old_restore is None:
+			# after the tools replacing these methods (sqlite_db) are loaded
+			old_restore = Build.BuildContext.restore
+			old_store = Build.BuildContext.store
+			Build.BuildContext.restore = restore
+			Build.BuildContext.store = store
+
+		try:
+			path = Scripting.get_daemon_socket(Context.out_dir, create=True)
+		except OSError as e:
+			raise Errors.WafError('Cannot create the socket of the build daemon: %s' % e)
+		sock = self.listen(path)
+		self.mtimes = self.get_mtimes()
+		Logs.info('Waf: Build daemon for %r listening on %s (pid %d)', Context.out_dir, path, os.getpid())
+		try:
+			while 1:
+				sock.settimeout(TIMEOUT or None)
+				try:
+					conn = sock.accept()[0]
+				except socket.timeout:
+					Logs.info('Waf: No request during %ds, exiting', TIMEOUT)
+					break
+				except KeyboardInterrupt:
+					break
+				try:
+					conn.settimeout(None)
+					self.serve(conn)
+				except (OSError, socket.error, Errors.WafError) as e:
+					Logs.error('Waf: Invalid request: %s', e)
+				finally:
+					conn.close()
+		finally:
+			sock.close()
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			# commands left by an interrupted request
+			del Options.commands[:]
+
+	def listen(self, path):
+		"""
+		:return: a socket listening on *path*
+		:raises: :py:class:`waflib.Errors.WafError` if another daemon is running
+		"""
+		if os.path.exists(path):
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			try:
+				sock.connect(path)
+			except (OSError, socket.error):
+				# left by a daemon that was killed
+				os.remove(path)
+			else:
+				raise Errors.WafError('A build daemon is already listening on %r' % path)
+			finally:
+				sock.close()
+
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.bind(path)
+		os.chmod(path, 0o600)
+		sock.listen(8)
+		return sock
+
+	def receive(self, conn):
+		"""
+		Reads a request and the file descriptors sent along
+
+		:return: a tuple (request dict, list of file descriptors)
+		"""
+		if hasattr(socket, 'SO_PEERCRED'):
+			pid, uid, gid = struct.unpack('3i', conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+			if uid != os.getuid():
+				raise Errors.WafError('Request from another user (%d)' % uid)
+
+		fds = array.array('i')
+		data, ancdata, flags, addr = conn.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+		for level, typ, k in ancdata:
+			if level == socket.SOL_SOCKET and typ == socket.SCM_RIGHTS:
+				fds.frombytes(k[:len(k) - len(k) % fds.itemsize])
+		while len(data) < 4 or len(data) < 4 + struct.unpack('!I', data[:4])[0]:
+			k = conn.recv(65536)
+			if not k:
+				for x in fds:
+					os.close(x)
+				raise Errors.WafError('Incomplete request')
+			data += k
+		return Utils.cPickle.loads(data[4:]), list(fds)
+
+	def serve(self, conn):
+		"""
+		Executes a request with the file descriptors of the client, then sends the exit status
+		"""
+		req, fds = self.receive(conn)
+		if req.get('version') != Context.HEXVERSION or len(fds) != 3:
+			for x in fds:
+				os.close(x)
+			conn.sendall(b'-\n')
+			return
+		conn.sendall(('%d\n' % os.getpid()).encode())
+
+		sys.stdout.flush()
+		sys.stderr.flush()
+		saved = [os.dup(x) for x in (0, 1, 2)]
+		for i, x in enumerate(fds):
+			os.dup2(x, i)
+			os.close(x)
+		environ = dict(os.environ)
+		argv = sys.argv
+		try:
+			ret = self.run(req)
+		finally:
+			sys.stdout.flush()
+			sys.stderr.flush()
+			for i, x in enumerate(saved):
+				os.dup2(x, i)
+				os.close(x)
+			os.environ.clear()
+			os.environ.update(environ)
+			sys.argv = argv
+			os.chdir(Context.run_dir)
+		conn.sendall(('%d\n' % ret).encode())
+
+	def get_mtimes(self):
+		"""
+		:return: the modification times of the scripts that were read
+		:rtype: dict
+		"""
+		ret = {}
+		for x in Context.cache_modules:
+			try:
+				ret[x] = os.stat(x).st_mtime
+			except OSError:
+				ret[x] = None
+		return ret
+
+	def run(self, req):
+		"""
+		Executes the commands of a request, as :py:func:`waflib.Scripting.waf_entry_point` would
+
+		:return: the exit status
+		:rtype: int
+		"""
+		os.environ.clear()
+		os.environ.update(req['env'])
+		sys.argv = req['argv']
+		Context.launch_dir = req['cwd']
+		os.chdir(Context.run_dir)
+
+		try:
+			if self.get_mtimes() != self.mtimes:
+				Logs.info('Waf: Reading the scripts again')
+				Context.cache_modules.clear()
+				Scripting.set_main_module(os.path.normpath(os.path.join(Context.run_dir, Context.WSCRIPT_FILE)))
+				self.mtimes = self.get_mtimes()
+			Scripting.run_commands()
+		except Errors.WafError as e:
+			if Logs.verbose > 1:
+				Logs.pprint('RED', e.verbose_msg)
+			Logs.error(e.msg)
+			return 1
+		except SystemExit as e:
+			if e.code is None:
+				return 0
+			elif isinstance(e.code, int):
+				return e.code
+			Logs.error(str(e.code))
+			return 1
+		except Exception:
+			traceback.print_exc(file=sys.stdout)
+			return 2
+		except KeyboardInterrupt:
+			Logs.pprint('RED', 'Interrupted')
+			return 68
+		finally:
+			# the scripts read by the commands
+			self.mtimes.update((x, y) for (x, y) in self.get_mtimes().items() if not x in self.mtimes)
+		return 0
@@ -0,0 +1,415 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Share the results of the configuration tests (:py:func:`waflib.Configure.run_build`,
+used by ``conf.check``, ``conf.check_cxx``, etc) between build directories and source trees::
+
+	def options(opt):
+		opt.load('confcache')
+
+	$ waf configure --confcache
+
+The results are kept in a user-level folder, under a hash of the test parameters,
+of the configuration set used by the test (with the source and build directories
+replaced by placeholders), of the compiler binaries (``CC``, ``CXX``, ``AS``...) and of
+the environment variables affecting the compilers (:py:const:`ENVIRON_VARS`).
+The version of the compilers (``CC_VERSION``) is part of the configuration set.
+A fresh checkout configured with the same compilers and options then obtains the
+results of the previous configurations without compiling anything.
+
+The files of the source tree given to the tests (``cflags=['-include', path]``) are
+hashed into the keys; the tests referring to folders of the source tree (``includes``)
+may read any file in them, so these are not cached.
+
+The searches for programs (:py:func:`waflib.Configure.find_binary`) and the macros
+predefined by the compilers (:py:func:`waflib.Tools.c_config.get_cc_predefined`, used to
+obtain ``CC_VERSION``) are kept as well. They are looked up by the search paths and
+the modification times of the folders, and by the status of the compiler files
+(inode, size, modification time; the relative names are looked up in ``PATH``), so that configuring several variants or cross
+platforms does not execute the same compilers again.
+
+The cache is used when the ``confcache`` option is set (``--confcache``, or by default
+with the ``visionflags`` tool); as with the cache in the build directory, passing
+``--confcache`` twice replaces the results instead of reading them. The command
+``waf clear_confcache`` removes all the results.
+
+The following environment variables may be set:
+
+* WAFCONFCACHE: folder of the cache (default: ~/.cache/wafconfcache_user), or an empty value to disable it;
+  the folder must belong to the current user, and the other users must not be able to write to it
+* WAFCONFCACHE_EVICT_MAX_BYTES: maximum size of the cache in bytes (100MB)
+* WAFCONFCACHE_EVICT_INTERVAL_MINUTES: minimum time interval between two attempts to trim the cache (10 minutes)
+
+The results are written to temporary files that are renamed, so that concurrent
+configurations only ever read complete results. The least recently used results
+are removed by a single process at a time (file lock).
+"""
+
+import errno, getpass, os, re, shutil, stat, sys, tempfile, time
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+from waflib import ConfigSet, Configure, Context, Errors, Logs, Options, Utils
+from waflib.Configure import conf
+from waflib.Tools import c_config
+
+default_cache_dir = os.path.join(os.path.expanduser('~/.cache'), 'wafconfcache_' + getpass.getuser())
+
+CACHE_DIR = os.environ.get('WAFCONFCACHE', default_cache_dir)
+EVICT_MAX_BYTES = int(os.environ.get('WAFCONFCACHE_EVICT_MAX_BYTES', 10**8))
+EVICT_INTERVAL_MINUTES = int(os.environ.get('WAFCONFCACHE_EVICT_INTERVAL_MINUTES', 10))
+
+BINARY_VARS = ['CC', 'CXX', 'AS', 'FC', 'LINK_CC', 'LINK_CXX', 'LINK_FC', 'AR']
+"""Configuration variables holding the programs used by the tests"""
+
+ENVIRON_VARS = ['PATH', 'CPATH', 'C_INCLUDE_PATH', 'CPLUS_INCLUDE_PATH', 'OBJC_INCLUDE_PATH',
+	'LIBRARY_PATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH', 'COMPILER_PATH', 'GCC_EXEC_PREFIX', 'SDKROOT']
+"""Environment variables affecting the compilers and linkers"""
+
+binary_hashes = {}
+"""Hashes of the programs by path and file status, computed once per process"""
+
+cache_dir_ok = None
+"""Whether the cache folder may be used, see :py:func:`check_cache_dir`"""
+
+old_run_build = Configure.run_build
+old_find_binary = Configure.find_binary
+old_get_cc_predefined = c_config.get_cc_predefined
+
+def binary_hash(path):
+	"""
+	:return: a hash of the program *path*, or None if the file cannot be read
+	"""
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	key = (path, st.st_ino, st.st_size, st.st_mtime)
+	try:
+		return binary_hashes[key]
+	except KeyError:
+		try:
+			ret = binary_hashes[key] = Utils.h_file(path)
+		except EnvironmentError:
+			ret = None
+		return ret
+
+def check_cache_dir():
+	"""
+	Creates the cache folder if necessary, and checks that it belongs to the current user
+	and that the other users cannot write to it: the results read are trusted
+
+	:return: True if the cache may be used
+	:rtype: bool
+	"""
+	global cache_dir_ok
+	if cache_dir_ok is None:
+		cache_dir_ok = False
+		if not CACHE_DIR:
+			return False
+		try:
+			os.makedirs(CACHE_DIR, 0o700)
+		except OSError:
+			pass
+		try:
+			st = os.lstat(CACHE_DIR)
+		except OSError as e:
+			Logs.warn('confcache: cannot use %r: %s', CACHE_DIR, e)
+			return False
+		if not stat.S_ISDIR(st.st_mode):
+			Logs.warn('confcache: %r is not a folder, the cache is disabled', CACHE_DIR)
+		elif hasattr(os, 'getuid') and st.st_uid != os.getuid():
+			Logs.warn('confcache: %r belongs to another user, the cache is disabled', CACHE_DIR)
+		elif st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+			Logs.warn('confcache: other users may write to %r, the cache is disabled', CACHE_DIR)
+		else:
+			cache_dir_ok = True
+	return cache_dir_ok
+
+@conf
+def confcache_signature(self, kw):
+	"""
+	Computes the key of a configuration test in the cache, see :py:func:`waflib.Configure.run_build`
+	for the parameters
+
+	:return: the key, or None if the test must not be cached
+	:rtype: string
+	"""
+	env = kw['env']
+	buf = []
+	for key in sorted(kw.keys()):
+		v = kw[key]
+		if isinstance(v, ConfigSet.ConfigSet):
+			continue
+		elif hasattr(v, '__call__'):
+			buf.append(Utils.h_fun(v))
+		else:
+			buf.append(str(v))
+	params = '\0'.join(str(x) for x in buf)
+
+	tbl = env.get_merged_dict()
+	buf.extend('%s=%r' % (x, tbl[x]) for x in sorted(tbl.keys()))
+
+	for x in BINARY_VARS:
+		lst = Utils.to_list(env[x])
+		if lst and os.path.isabs(lst[0]):
+			buf.append(binary_hash(lst[0]))
+
+	environ = env.env or os.environ
+	buf.extend(environ.get(x) for x in ENVIRON_VARS)
+
+	txt = '\0'.join(str(x) for x in buf)
+	# the bldnode is usually located under the srcnode
+	out = self.bldnode.abspath()
+	txt = txt.replace(out, '${OUT}')
+
+	# the results depend on the contents of the source files used; the folders
+	# of the configuration set (PREFIX...) do not matter unless given to the test
+	top = self.srcnode.abspath()
+	re_path = re.compile(re.escape(top) + r'[^\0\s\'",;:=]*')
+	folders = re_path.findall(params.replace(out, '${OUT}'))
+	for path in sorted(set(re_path.findall(txt))):
+		if not os.path.isdir(path):
+			txt += '\0%s' % binary_hash(path)
+		elif path in folders:
+			# any file of the folder may be read
+			return None
+
+	txt = txt.replace(top, '${TOP}')
+	return Utils.to_hex(Utils.h_list([txt]))
+
+@conf
+def run_build(self, *k, **kw):
+	"""
+	Reads the result of a configuration test from the shared cache, or runs the test
+	and stores its result, see :py:func:`waflib.Configure.run_build`
+	"""
+	cachemode = kw.get('confcache', getattr(Options.options, 'confcache', None))
+	if not cachemode or not check_cache_dir():
+		return old_run_build(self, *k, **kw)
+
+	sig = self.confcache_signature(kw)
+	if not sig:
+		return old_run_build(self, *k, **kw)
+	# the results kept in the build directory do not depend on the source files
+	kw['confcache'] = 2
+	path = os.path.join(CACHE_DIR, sig[:2], sig)
+	if cachemode == 1:
+		try:
+			ret = read(path)
+		except KeyError:
+			pass
+		else:
+			self.to_log('confcache: result %s read from %s' % (sig, path))
+			if isinstance(ret, str) and ret.startswith('Test does not build'):
+				self.fatal(ret)
+			return ret
+
+	self.test_bld = None
+	try:
+		ret = old_run_build(self, *k, **kw)
+	except Errors.ConfigurationError:
+		bld = self.test_bld
+		if bld is not None:
+			# the raw result is in the cache of the build directory
+			try:
+				ret = ConfigSet.ConfigSet(os.path.join(bld.top_dir, 'cache_run_build'))['cache_run_build']
+			except EnvironmentError:
+				pass
+			else:
+				store(path, ret)
+		raise
+	store(path, ret)
+	return ret
+
+def get_probe_path(*k):
+	"""
+	:return: the path of a probe result in the cache, or None if the cache is disabled
+	"""
+	cachemode = getattr(Options.options, 'confcache', None)
+	if not cachemode or not check_cache_dir():
+		return None
+	sig = Utils.to_hex(Utils.h_list([str(x) for x in k]))
+	return os.path.join(CACHE_DIR, sig[:2], sig)
+
+@conf
+def find_binary(self, filenames, exts, paths):
+	"""
+	Reads the location of a program from the cache while the folders searched
+	are unchanged, see :py:func:`waflib.Configure.find_binary`
+	"""
+	lst = []
+	for x in paths:
+		try:
+			st = os.stat(os.path.expanduser(x))
+		except OSError:
+			lst.append(None)
+		else:
+			lst.append((st.st_ino, st.st_mtime))
+	path = get_probe_path('find_binary', filenames, exts, paths, lst)
+	if not path:
+		return old_find_binary(self, filenames, exts, paths)
+
+	if Options.options.confcache == 1:
+		try:
+			ret = read(path)
+		except KeyError:
+			pass
+		else:
+			if ret is None or (os.path.isfile(ret) and os.access(ret, os.X_OK)):
+				self.to_log('confcache: program %r found in %s' % (ret, path))
+				return ret
+	ret = old_find_binary(self, filenames, exts, paths)
+	store(path, ret)
+	return ret
+
+@conf
+def get_cc_predefined(self, cc):
+	"""
+	Reads the macros predefined by a compiler from the cache while the compiler
+	files are unchanged, see :py:func:`waflib.Tools.c_config.get_cc_predefined`
+	"""
+	environ = self.env.env or os.environ
+	paths = environ.get('PATH', '').split(os.pathsep)
+	lst = []
+	for x in cc:
+		if x.startswith('-'):
+			continue
+		# wrappers such as ccache run the compiler found in PATH: CC=['/usr/bin/ccache', 'gcc']
+		if not os.path.isabs(x):
+			x = old_find_binary(self, [x], [''], paths) or x
+		try:
+			st = os.stat(x)
+		except OSError:
+			lst.append(None)
+		else:
+			lst.append((st.st_ino, st.st_size, st.st_mtime))
+	path = get_probe_path('get_cc_predefined', cc, lst, [environ.get(x) for x in ENVIRON_VARS])
+	if not path:
+		return old_get_cc_predefined(self, cc)
+
+	if Options.options.confcache == 1:
+		try:
+			ret = read(path)
+		except KeyError:
+			pass
+		else:
+			self.to_log('confcache: predefined macros of %r read from %s' % (cc, path))
+			return ret
+	ret = old_get_cc_predefined(self, cc)
+	store(path, ret)
+	return ret
+
+def read(path):
+	"""
+	Reads a result from the cache
+
+	:raises: KeyError if the result is missing
+	"""
+	try:
+		proj = ConfigSet.ConfigSet(path)
+	except (EnvironmentError, SyntaxError):
+		raise KeyError(path)
+	try:
+		# the least recently used results are removed first
+		os.utime(path, None)
+	except OSError:
+		pass
+	return proj['cache_run_build']
+
+def store(path, ret):
+	"""
+	Writes a result to the cache, ignoring the errors
+	"""
+	proj = ConfigSet.ConfigSet()
+	proj['cache_run_build'] = ret
+	up = os.path.dirname(path)
+	try:
+		try:
+			os.makedirs(up)
+		except OSError:
+			pass
+		fd, tmp = tempfile.mkstemp(prefix='.', dir=up)
+		os.close(fd)
+		proj.store(tmp)
+		os.rename(tmp, path)
+	except EnvironmentError as e:
+		sys.stderr.write('confcache: could not store %r: %s\n' % (path, e))
+	else:
+		lru_evict()
+
+def lru_trim():
+	"""
+	Removes the least recently used results until the cache size is below EVICT_MAX_BYTES;
+	the results take the form `CACHE_DIR/0b/0b180f82246d726ece37c8ccd0fb1cde`
+	"""
+	lst = []
+	tot = 0
+	for up in os.listdir(CACHE_DIR):
+		if len(up) != 2:
+			continue
+		sub = os.path.join(CACHE_DIR, up)
+		try:
+			names = os.listdir(sub)
+		except OSError:
+			continue
+		for x in names:
+			path = os.path.join(sub, x)
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			if x.startswith('.') and st.st_mtime > time.time() - 3600:
+				# file being written by another process
+				continue
+			lst.append((st.st_mtime, st.st_size, path))
+			tot += st.st_size
+
+	lst.sort(reverse=True)
+	while tot > EVICT_MAX_BYTES and lst:
+		_, size, path = lst.pop()
+		tot -= size
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+def lru_evict():
+	"""
+	Reduces the cache size, at most every EVICT_INTERVAL_MINUTES minutes and by a single process at a time
+	"""
+	lockfile = os.path.join(CACHE_DIR, 'all.lock')
+	try:
+		st = os.stat(lockfile)
+	except EnvironmentError as e:
+		if e.errno == errno.ENOENT:
+			Utils.writef(lockfile, '')
+		return
+
+	if st.st_mtime < time.time() - EVICT_INTERVAL_MINUTES * 60:
+		fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			if fcntl:
+				try:
+					fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				except EnvironmentError:
+					# another process is trimming the cache
+					return
+			lru_trim()
+			os.utime(lockfile, None)
+		finally:
+			os.close(fd)
+
+class ClearConfcacheContext(Context.Context):
+	'''removes the configuration results shared between build directories'''
+	cmd = 'clear_confcache'
+
+	def execute(self):
+		if not CACHE_DIR or not os.path.isdir(CACHE_DIR):
+			return
+		for x in os.listdir(CACHE_DIR):
+			if len(x) == 2:
+				shutil.rmtree(os.path.join(CACHE_DIR, x), ignore_errors=True)
+		Logs.info('Removed the configuration results from %r', CACHE_DIR)
@@ -160,6 +160,8 @@ class bld(Build.BuildContext):
 	def __init__(self, **kw):
 		super(bld, self).__init__(**kw)
 		self.hashes_md5_tstamp = {}
+		# the task generators to post are computed in compute_needed_tgs
+		self.incremental_post = False
 
 	def __call__(self, *k, **kw):
 		# this is one way of doing it, one could use a task generator method too
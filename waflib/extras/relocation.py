@@ -45,7 +45,7 @@ def init_dirs(self):
 
 	if srcdir:
 		d = self.root.find_node(srcdir)
-		if d and srcdir != self.top_dir and getattr(d, 'children', ''):
+		if d and srcdir != self.top_dir and d.load_children():
 			srcnode = self.root.make_node(self.top_dir)
 			print("relocating the source directory %r -> %r" % (srcdir, self.top_dir))
 			srcnode.children = {}
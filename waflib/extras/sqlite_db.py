@@ -0,0 +1,361 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Incremental build data storage in a sqlite database
+
+By default, the build data (:py:const:`waflib.Build.SAVED_ATTRS`) is written as a single
+pickle file once a build is complete, and read entirely when the next build starts.
+On large projects, this can take seconds even when a single file has changed.
+
+This module replaces the pickle file by a sqlite database in which each dict entry
+(task signatures, implicit dependencies, node signatures, etc) is kept in its own row:
+
+* entries are loaded lazily, usually by task uid, the first time they are accessed
+* only the entries modified or removed during the build are written back
+* Node objects found in the entries are stored as absolute paths, so that the
+  entries do not drag the Node tree along; the tree itself is stored in a separate
+  row (see :py:meth:`waflib.Node.Node.get_tree_state`)
+* the database file is compacted (VACUUM) when too many pages are unused
+* an existing pickle file is imported on the first run, and removed afterwards
+
+Usage::
+
+	def options(opt):
+		opt.load('sqlite_db')
+
+The tool must be loaded before the build starts (from the options) because the
+method :py:meth:`waflib.Build.BuildContext.restore` is replaced.
+"""
+
+import os, sqlite3, threading
+from io import BytesIO
+from waflib import Build, Context, Logs, Node
+
+DBFILE = Context.DBFILE + '.sqlite'
+"""Name of the database file, created in the variant directory"""
+
+VACUUM_RATIO = 4
+"""Compact the database when more than 1/VACUUM_RATIO pages are unused"""
+
+VACUUM_MIN_PAGES = 256
+"""Do not bother compacting small databases"""
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (attr TEXT NOT NULL, key BLOB NOT NULL, val BLOB NOT NULL, PRIMARY KEY (attr, key));
+CREATE TABLE IF NOT EXISTS blobs (name TEXT NOT NULL PRIMARY KEY, val BLOB NOT NULL);
+'''
+
+class lazy_dict(dict):
+	"""
+	Dict which loads its values from the database on first access, and which records
+	the keys that were set or removed so that only those are written back.
+	Iterating over the dict or asking for its size loads all entries.
+	"""
+	def __init__(self, db, attr):
+		dict.__init__(self)
+		self.db = db
+		self.attr = attr
+		self.changed = set()
+		self.removed = set()
+		self.missing = set()
+		self.complete = False
+
+	def __missing__(self, key):
+		if self.complete or key in self.missing:
+			raise KeyError(key)
+		try:
+			val = self.db.fetch(self.attr, key)
+		except KeyError:
+			self.missing.add(key)
+			raise
+		dict.__setitem__(self, key, val)
+		return val
+
+	def __contains__(self, key):
+		try:
+			self[key]
+		except KeyError:
+			return False
+		return True
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def __setitem__(self, key, val):
+		dict.__setitem__(self, key, val)
+		self.changed.add(key)
+		self.removed.discard(key)
+		self.missing.discard(key)
+
+	def __delitem__(self, key):
+		self[key] # raises a KeyError if the entry is neither loaded nor stored
+		dict.__delitem__(self, key)
+		self.changed.discard(key)
+		self.removed.add(key)
+		self.missing.add(key)
+
+	def setdefault(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			self[key] = default
+			return default
+
+	def pop(self, key, *k):
+		try:
+			val = self[key]
+		except KeyError:
+			if k:
+				return k[0]
+			raise
+		del self[key]
+		return val
+
+	def update(self, *k, **kw):
+		for key, val in dict(*k, **kw).items():
+			self[key] = val
+
+	def clear(self):
+		self.load_all()
+		self.removed.update(dict.keys(self))
+		self.changed.clear()
+		dict.clear(self)
+
+	def load_all(self):
+		"""Loads the entries that were not accessed yet"""
+		if not self.complete:
+			for key, val in self.db.fetch_all(self.attr):
+				if not dict.__contains__(self, key) and not key in self.removed:
+					dict.__setitem__(self, key, val)
+			self.complete = True
+			self.missing.clear()
+
+	def __iter__(self):
+		self.load_all()
+		return dict.__iter__(self)
+
+	def __len__(self):
+		self.load_all()
+		return dict.__len__(self)
+
+	def keys(self):
+		self.load_all()
+		return dict.keys(self)
+
+	def values(self):
+		self.load_all()
+		return dict.values(self)
+
+	def items(self):
+		self.load_all()
+		return dict.items(self)
+
+	def __reduce__(self):
+		# copies and pickles are regular dicts
+		return (dict, (dict(self.items()),))
+
+class build_db(object):
+	"""
+	Access to the database file of a build context; Node objects are
+	converted to and from absolute paths using the Node tree of that context.
+	"""
+	def __init__(self, bld):
+		self.bld = bld
+		self.path = os.path.join(bld.variant_dir, DBFILE)
+		self.lock = threading.Lock()
+		self.con = self.connect()
+
+	def connect(self):
+		self.pid = os.getpid()
+		con = sqlite3.connect(self.path, check_same_thread=False)
+		con.text_factory = str
+		con.execute('PRAGMA synchronous=NORMAL')
+		con.executescript(SCHEMA)
+		return con
+
+	def reset(self):
+		"""Removes a database that cannot be read"""
+		self.con.close()
+		try:
+			os.remove(self.path)
+		except OSError:
+			pass
+		self.con = self.connect()
+
+	def check_fork(self):
+		"""
+		Opens another connection in a forked process (see :py:meth:`waflib.Runner.Parallel.prescan`):
+		the connection and the lock of the parent process must not be used in the child process
+		"""
+		if self.pid != os.getpid():
+			# closing the connection of the parent process would release its file locks
+			self.parent_con = self.con
+			self.lock = threading.Lock()
+			self.con = self.connect()
+
+	def persistent_id(self, obj):
+		if isinstance(obj, Node.Node):
+			return obj.abspath()
+		return None
+
+	def persistent_load(self, pid):
+		return self.bld.root.make_node(pid)
+
+	def dumps(self, obj):
+		buf = BytesIO()
+		pickler = Build.cPickle.Pickler(buf, Build.PROTOCOL)
+		pickler.persistent_id = self.persistent_id
+		pickler.dump(obj)
+		return buf.getvalue()
+
+	def loads(self, data):
+		unpickler = Build.cPickle.Unpickler(BytesIO(data))
+		unpickler.persistent_load = self.persistent_load
+		return unpickler.load()
+
+	def fetch(self, attr, key):
+		"""
+		:return: the value of the entry *key* of *attr*
+		:raises: :py:class:`KeyError` if there is no such entry
+		"""
+		self.check_fork()
+		with self.lock:
+			row = self.con.execute('SELECT val FROM entries WHERE attr=? AND key=?',
+				(attr, sqlite3.Binary(self.dumps(key)))).fetchone()
+		if row is None:
+			raise KeyError(key)
+		return self.loads(bytes(row[0]))
+
+	def fetch_all(self, attr):
+		"""
+		:return: all the entries of *attr*
+		:rtype: list of tuples
+		"""
+		self.check_fork()
+		with self.lock:
+			rows = self.con.execute('SELECT key, val FROM entries WHERE attr=?', (attr,)).fetchall()
+		return [(self.loads(bytes(k)), self.loads(bytes(v))) for (k, v) in rows]
+
+	def get_blob(self, name):
+		self.check_fork()
+		with self.lock:
+			row = self.con.execute('SELECT val FROM blobs WHERE name=?', (name,)).fetchone()
+		if row is None:
+			raise KeyError(name)
+		return bytes(row[0])
+
+	def write(self, attr, value, cur):
+		"""
+		Writes the entries of *attr* that changed since they were loaded; regular
+		dicts (cleaned or migrated data) replace all the entries.
+		"""
+		if isinstance(value, lazy_dict) and value.db is self:
+			if value.removed:
+				cur.executemany('DELETE FROM entries WHERE attr=? AND key=?',
+					[(attr, sqlite3.Binary(self.dumps(k))) for k in value.removed])
+			keys = value.changed
+		elif isinstance(value, dict):
+			cur.execute('DELETE FROM entries WHERE attr=?', (attr,))
+			keys = value.keys()
+		else:
+			cur.execute('INSERT OR REPLACE INTO blobs VALUES (?,?)', ('attr:' + attr, sqlite3.Binary(self.dumps(value))))
+			return 0
+
+		rows = [(attr, sqlite3.Binary(self.dumps(k)), sqlite3.Binary(self.dumps(dict.__getitem__(value, k)))) for k in keys]
+		cur.executemany('INSERT OR REPLACE INTO entries VALUES (?,?,?)', rows)
+		if isinstance(value, lazy_dict):
+			value.changed = set()
+			value.removed = set()
+		return len(rows)
+
+	def compact(self):
+		"""Runs VACUUM if the database contains too many free pages"""
+		pages = self.con.execute('PRAGMA page_count').fetchone()[0]
+		free = self.con.execute('PRAGMA freelist_count').fetchone()[0]
+		if pages > VACUUM_MIN_PAGES and free * VACUUM_RATIO > pages:
+			Logs.debug('sqlite_db: compacting %s (%d/%d free pages)', self.path, free, pages)
+			self.con.execute('VACUUM')
+
+def get_db(self):
+	try:
+		return self.sqlite_db
+	except AttributeError:
+		self.sqlite_db = build_db(self)
+		return self.sqlite_db
+Build.BuildContext.get_db = get_db
+
+def load_db(self):
+	"""
+	Restores the Node tree from the database and binds the other attributes
+	from :py:const:`waflib.Build.SAVED_ATTRS` to lazy dicts
+	"""
+	db = self.get_db()
+	try:
+		state = Build.cPickle.loads(db.get_blob('root'))
+	except KeyError:
+		Logs.debug('sqlite_db: no build data in %s', db.path)
+		return
+	except Exception as e:
+		Logs.debug('sqlite_db: could not load the build data from %s: %r', db.path, e)
+		db.reset()
+		return
+	self.root.set_tree_state(state)
+
+	for x in Build.SAVED_ATTRS:
+		if x == 'root':
+			continue
+		try:
+			data = db.get_blob('attr:' + x)
+		except KeyError:
+			setattr(self, x, lazy_dict(db, x))
+		else:
+			setattr(self, x, db.loads(data))
+
+old_restore = Build.BuildContext.restore
+def restore(self):
+	dbfn = os.path.join(self.variant_dir, Context.DBFILE)
+	old_restore(self)
+	if os.path.exists(dbfn):
+		# migrate the pickle file
+		Logs.debug('sqlite_db: importing %s', dbfn)
+		self.store()
+		os.remove(dbfn)
+	else:
+		self.load_db()
+restore.__doc__ = old_restore.__doc__
+Build.BuildContext.load_db = load_db
+Build.BuildContext.restore = restore
+
+def store(self):
+	"""
+	Writes the modified entries from :py:const:`waflib.Build.SAVED_ATTRS` to the database
+	"""
+	db = self.get_db()
+	if not os.path.exists(db.path):
+		# removed by 'waf clean', the entries which were kept must be written again
+		for x in Build.SAVED_ATTRS:
+			value = getattr(self, x, None)
+			if isinstance(value, lazy_dict) and value.db is db:
+				value.load_all()
+				value.changed = set(dict.keys(value))
+				value.removed = set()
+		db.reset()
+
+	root = Build.cPickle.dumps(self.root.get_tree_state(), Build.PROTOCOL)
+
+	with db.lock:
+		count = 0
+		with db.con:
+			cur = db.con.cursor()
+			cur.execute('INSERT OR REPLACE INTO blobs VALUES (?,?)', ('root', sqlite3.Binary(root)))
+			for x in Build.SAVED_ATTRS:
+				if x != 'root':
+					count += db.write(x, getattr(self, x), cur)
+		Logs.debug('sqlite_db: stored %d entries in %s', count, db.path)
+		db.compact()
+Build.BuildContext.store = store
+
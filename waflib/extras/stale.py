@@ -57,6 +57,8 @@ def stale_rec(node, nodes):
 	if node.abspath() in node.ctx.env[Build.CFG_FILES]:
 		return
 
+	if getattr(node, 'lazy_children', None) is not None:
+		node.load_children()
 	if getattr(node, 'children', []):
 		for x in list(node.children.values()):
 			if x.name != "c4che":
@@ -94,6 +96,11 @@ def refill_task_list(self):
 	nodes = []
 	for group in bld.groups:
 		for tg in group:
+			if tg in bld.unchanged_tgs and not getattr(tg, 'posted', False):
+				# not posted, the outputs are those of the previous build
+				lst = bld.tg_stamps[bld.get_tg_stamp_key(tg)][2]
+				nodes.extend(bld.root.make_node(x) for x in lst)
+				continue
 			try:
 				nodes.extend(tg.outputs)
 			except AttributeError:
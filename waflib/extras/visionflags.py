@@ -175,6 +175,8 @@ def options(opt):
 				action='store_false', help='Disable config cache mechanism')
 	opt.add_option('--enable-confcache', dest='confcache', default=True,
 				action='store_true', help='Enabling config cache mechanism (default)')
+	# share the results between build directories
+	opt.load('confcache')
 
 def configure(conf):
 	if conf.env.LOADED_VISIONFLAGS:
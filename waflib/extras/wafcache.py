@@ -36,17 +36,76 @@ The following environment variables may be set:
 File cache specific options:
   Files are copied using hard links by default; if the cache is located
   onto another partition, the system switches to file copies instead.
+  The files are stored once by contents (CACHE_DIR/blobs), identical
+  outputs of different tasks or signatures take the space of one file.
+  The size of the cache is the sum of the sizes of the blobs linked by
+  the cache folders, each blob being counted once whatever the amount
+  of folders linking it (reference counts in the index); the blobs that
+  are only linked by build folders are removed later and not counted.
 * WAFCACHE_TRIM_MAX_FOLDER: maximum amount of tasks to cache (1M)
 * WAFCACHE_EVICT_MAX_BYTES: maximum amount of cache size in bytes (10GB)
 * WAFCACHE_EVICT_INTERVAL_MINUTES: minimum time interval to try
                                    and trim the cache (3 minutes)
+* WAFCACHE_INDEX_INTERVAL_SECONDS: time interval covered by each file of
+                                   the cache index (10 minutes)
+* WAFCACHE_INDEX_COMPACT_RATIO: rewrite the files of the cache index when they
+                                contain more than this amount of lines per
+                                cache folder (2)
+
+  The cache entries written and read are recorded in an index
+  (CACHE_DIR/index), so that trimming the cache does not list all
+  the cache folders. The index may be displayed and the cache trimmed
+  by running this file:
+    python waflib/extras/wafcache.py stats
+    python waflib/extras/wafcache.py trim [--rebuild]
+  the option --rebuild lists the cache folders to create the index again
+  (folders added or removed by other means).
+
+Remote cache specific options:
+* WAFCACHE_COMPRESSION: one of 'zstd', 'zlib' or 'none'; if set, the outputs
+                        of a task are transferred to and from the server or
+                        bucket as a single archive (one request per task),
+                        compressed with zstd (requires the python module
+                        zstandard) or zlib. The archives are named
+                        `sig/archive.zst`, `sig/archive.z` or `sig/archive`
+                        and are not shared with the caches written without
+                        this setting (files named `sig/0`, `sig/1`...);
+                        the archives are uploaded to servers as they are
+                        compressed (chunked transfer encoding)
+
+Two-tier cache:
+* WAFCACHE_REMOTE: URL of a server or bucket (same values as for WAFCACHE),
+                   the file cache WAFCACHE then serves as a local cache in
+                   front of it. The files are obtained from the local cache
+                   first, and the files obtained from the remote cache are
+                   added to the local cache for the next builds. The files
+                   written to the local cache are uploaded to the remote cache,
+                   in the background if WAFCACHE_ASYNC_WORKERS is set.
+                   For example, for build machines sharing a cache server:
+                   export WAFCACHE=/var/cache/wafcache
+                   export WAFCACHE_REMOTE=http://localhost:8080/files/
+                   export WAFCACHE_ASYNC_WORKERS=4
 
-Upload specific options:
 * WAFCACHE_ASYNC_WORKERS: define a number of workers to upload results asynchronously
                           this may improve build performance with many/long file uploads
                           the default is unset (synchronous uploads)
 * WAFCACHE_ASYNC_NOWAIT: do not wait for uploads to complete (default: False)
                          this requires asynchonous uploads to have an effect
+* WAFCACHE_PREFETCH: define a number of threads to obtain the files from the cache
+                     ahead of the tasks, as soon as their signatures are known
+                     (all the tasks of a build group that do not wait for other
+                     tasks, then the other tasks once they are considered);
+                     this reduces the build time with caches that add latency
+                     to each request, the default is unset (no prefetch).
+                     The entries of the tasks of a build group are looked up
+                     with a single query, and only the files of the entries
+                     found are downloaded. Cache servers may answer such
+                     queries: POST requests to http://localhost:8080/files/query
+                     listing the paths of the first files of the entries
+                     (`sig/0` or `sig/archive.z`, one per line), answered by
+                     the paths found in JSON: {"found": ["sig/0", ...]}.
+                     The entries are assumed to exist for the servers that do
+                     not answer the queries and for the buckets.
 
 Usage::
 
@@ -59,11 +118,15 @@ To troubleshoot::
 	waf clean build --zone=wafcache
 """
 
-import atexit, base64, errno, fcntl, getpass, os, re, shutil, sys, time, threading, traceback, urllib3, shlex
+import atexit, base64, errno, fcntl, getpass, hashlib, json, os, re, shutil, struct, sys, tempfile, time, threading, traceback, urllib3, shlex, zlib
 try:
 	import subprocess32 as subprocess
 except ImportError:
 	import subprocess
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
 
 base_cache = os.path.expanduser('~/.cache/')
 if not os.path.isdir(base_cache):
@@ -72,14 +135,20 @@ default_wafcache_dir = os.path.join(base_cache, 'wafcache_' + getpass.getuser())
 
 CACHE_DIR = os.environ.get('WAFCACHE', default_wafcache_dir)
 WAFCACHE_CMD = os.environ.get('WAFCACHE_CMD')
+WAFCACHE_REMOTE = os.environ.get('WAFCACHE_REMOTE')
 TRIM_MAX_FOLDERS = int(os.environ.get('WAFCACHE_TRIM_MAX_FOLDER', 1000000))
 EVICT_INTERVAL_MINUTES = int(os.environ.get('WAFCACHE_EVICT_INTERVAL_MINUTES', 3))
 EVICT_MAX_BYTES = int(os.environ.get('WAFCACHE_EVICT_MAX_BYTES', 10**10))
+INDEX_INTERVAL_SECONDS = int(os.environ.get('WAFCACHE_INDEX_INTERVAL_SECONDS', 600))
+INDEX_COMPACT_RATIO = int(os.environ.get('WAFCACHE_INDEX_COMPACT_RATIO', 2))
 WAFCACHE_NO_PUSH = 1 if os.environ.get('WAFCACHE_NO_PUSH') else 0
 WAFCACHE_VERBOSITY = 1 if os.environ.get('WAFCACHE_VERBOSITY') else 0
 WAFCACHE_STATS = 1 if os.environ.get('WAFCACHE_STATS') else 0
 WAFCACHE_ASYNC_WORKERS = os.environ.get('WAFCACHE_ASYNC_WORKERS')
 WAFCACHE_ASYNC_NOWAIT = os.environ.get('WAFCACHE_ASYNC_NOWAIT')
+WAFCACHE_PREFETCH = os.environ.get('WAFCACHE_PREFETCH')
+WAFCACHE_COMPRESSION = os.environ.get('WAFCACHE_COMPRESSION', '')
+CHUNK_SIZE = 1024 * 1024
 OK = "ok"
 
 re_waf_cmd = re.compile('(?P<src>%{SRC})|(?P<tgt>%{TGT})')
@@ -90,7 +159,7 @@ except ImportError:
 	import pickle as cPickle
 
 if __name__ != '__main__':
-	from waflib import Task, Logs, Utils, Build
+	from waflib import Task, Logs, Utils, Build, Runner
 
 def can_retrieve_cache(self):
 	"""
@@ -108,9 +177,12 @@ def can_retrieve_cache(self):
 		self.generator.bld.cache_reqs += 1
 
 	files_to = [node.abspath() for node in self.outputs]
-	proc = get_process()
-	err = cache_command(proc, ssig, [], files_to)
-	process_pool.append(proc)
+	fut = getattr(self, 'wafcache_prefetch', None)
+	if fut and not fut.cancel():
+		# the files are being obtained or were obtained already
+		err = fut.result()
+	else:
+		err = fetch_files_cache(ssig, files_to)
 	if err.startswith(OK):
 		if WAFCACHE_VERBOSITY:
 			Logs.pprint('CYAN', '  Fetched %r from cache' % files_to)
@@ -128,6 +200,65 @@ def can_retrieve_cache(self):
 	self.cached = True
 	return True
 
+def prefetch_cache(self):
+	"""
+	New method for waf Task classes, obtains the files from the cache in
+	a background thread so that can_retrieve_cache does not wait for them
+	"""
+	bld = self.generator.bld
+	if not self.outputs or getattr(self, 'wafcache_prefetch', None) or not hasattr(bld, 'wafcache_prefetches'):
+		return
+	ssig = Utils.to_hex(self.uid() + self.signature())
+	files_to = [node.abspath() for node in self.outputs]
+	self.wafcache_prefetch = bld.wafcache_prefetch_executor.submit(fetch_files_cache, ssig, files_to)
+	bld.wafcache_prefetches.append(self.wafcache_prefetch)
+
+def prefetch_tasks(bld, tasks):
+	"""
+	Obtains the files of several tasks from the cache in background threads: the cache
+	entries are looked up at once, and the files of the entries found are then downloaded
+	"""
+	ssigs = [Utils.to_hex(tsk.uid() + tsk.signature()) for tsk in tasks]
+	executor = bld.wafcache_prefetch_executor
+	# submitted first, the downloads wait for it
+	query = executor.submit(query_files_cache, ssigs)
+	def fetch(ssig, files_to):
+		try:
+			found = query.result()
+		except Exception:
+			found = None
+		if found is not None and not ssig in found:
+			return 'No cache entry %s' % ssig
+		return fetch_files_cache(ssig, files_to)
+	for tsk, ssig in zip(tasks, ssigs):
+		tsk.wafcache_prefetch = executor.submit(fetch, ssig, [node.abspath() for node in tsk.outputs])
+		bld.wafcache_prefetches.append(tsk.wafcache_prefetch)
+
+def query_files_cache(ssigs):
+	"""
+	Looks up several cache entries with a single request of a worker process
+
+	:return: the signatures of the entries found, or None if the cache could not be queried
+	:rtype: set
+	"""
+	proc = get_process()
+	ret = cache_command(proc, ssigs, [], [])
+	process_pool.append(proc)
+	if isinstance(ret, list):
+		Logs.debug('wafcache: found %d cache entries of %d', len(ret), len(ssigs))
+		return set(ret)
+	Logs.debug('wafcache: could not query the cache: %s', ret)
+	return None
+
+def fetch_files_cache(ssig, files_to):
+	"""
+	Copies the files of a cache entry to the task outputs, returns the worker process status
+	"""
+	proc = get_process()
+	err = cache_command(proc, ssig, [], files_to)
+	process_pool.append(proc)
+	return err
+
 def put_files_cache(self):
 	"""
 	New method for waf Task classes
@@ -154,7 +285,7 @@ def put_files_cache(self):
 	delattr(self, 'cache_sig')
 	sig = self.signature()
 
-	def _async_put_files_cache(bld, ssig, files_from):
+	def _async_put_files_cache(bld, ssig, files_from, tier=None):
 		proc = get_process()
 		if WAFCACHE_ASYNC_WORKERS:
 			with bld.wafcache_lock:
@@ -163,14 +294,14 @@ def put_files_cache(self):
 					return
 				bld.wafcache_procs.add(proc)
 
-		err = cache_command(proc, ssig, files_from, [])
+		err = cache_command(proc, ssig, files_from, [], tier)
 		process_pool.append(proc)
 		if err.startswith(OK):
 			if WAFCACHE_VERBOSITY:
-				Logs.pprint('CYAN', '  Successfully uploaded %s to cache' % files_from)
+				Logs.pprint('CYAN', '  Successfully uploaded %s to %scache' % (files_from, tier and tier + ' ' or ''))
 			else:
-				Logs.debug('wafcache: Successfully uploaded %r to cache', files_from)
-			if WAFCACHE_STATS:
+				Logs.debug('wafcache: Successfully uploaded %r to %scache', files_from, tier and tier + ' ' or '')
+			if WAFCACHE_STATS and tier != 'remote':
 				bld.cache_puts += 1
 		else:
 			if WAFCACHE_VERBOSITY:
@@ -180,7 +311,12 @@ def put_files_cache(self):
 
 	if old_sig == sig:
 		ssig = Utils.to_hex(self.uid() + sig)
-		if WAFCACHE_ASYNC_WORKERS:
+		if WAFCACHE_ASYNC_WORKERS and WAFCACHE_REMOTE:
+			# write to the local cache now, upload the local copies in the background
+			_async_put_files_cache(bld, ssig, files_from, 'local')
+			fut = bld.wafcache_executor.submit(_async_put_files_cache, bld, ssig, files_from, 'remote')
+			bld.wafcache_uploads.append(fut)
+		elif WAFCACHE_ASYNC_WORKERS:
 			fut = bld.wafcache_executor.submit(_async_put_files_cache, bld, ssig, files_from)
 			bld.wafcache_uploads.append(fut)
 		else:
@@ -267,8 +403,54 @@ def make_cached(cls):
 		self.put_files_cache()
 		return ret
 	cls.post_run = post_run
+
+	if WAFCACHE_PREFETCH:
+		m3 = getattr(cls, 'runnable_status', None)
+		def runnable_status(self):
+			ret = m3(self)
+			if ret == Task.RUN_ME and not getattr(self, 'nocache', False):
+				self.prefetch_cache()
+			return ret
+		cls.runnable_status = runnable_status
+		# the tasks of other classes may run for other reasons than their signatures
+		cls.prefetch_early = m3 == Task.Task.runnable_status
 	cls.has_cache = True
 
+def make_prefetched(cls):
+	"""
+	Considers the tasks of a build group that do not wait for other tasks
+	as soon as the build group is processed, so that their files are
+	obtained from the cache ahead of the scheduler; the tasks are left
+	to the scheduler, only their signatures are computed in advance
+	"""
+	if getattr(cls, 'has_prefetch', False):
+		return
+	m1 = cls.prio_and_split
+	def prio_and_split(self, tasks):
+		ready, waiting = m1(self, tasks)
+		bld = self.bld
+		if hasattr(bld, 'wafcache_prefetches') and bld.is_install >= 0:
+			lst = []
+			# in the order of execution
+			for tsk in sorted(ready):
+				if not getattr(tsk, 'prefetch_early', False) or tsk.hasrun or not tsk.outputs:
+					continue
+				if getattr(tsk, 'nocache', False) or getattr(tsk, 'wafcache_prefetch', None):
+					continue
+				try:
+					sig = tsk.signature()
+				except Exception:
+					# the error is reported when the task is considered
+					continue
+				# the tasks having the same signature are most likely up-to-date
+				if bld.task_sigs.get(tsk.uid()) != sig:
+					lst.append(tsk)
+			if lst:
+				prefetch_tasks(bld, lst)
+		return ready, waiting
+	cls.prio_and_split = prio_and_split
+	cls.has_prefetch = True
+
 process_pool = []
 def get_process():
 	"""
@@ -291,6 +473,12 @@ def build(bld):
 	"""
 	Called during the build process to enable file caching
 	"""
+	if WAFCACHE_REMOTE and (is_remote(CACHE_DIR) or not is_remote(WAFCACHE_REMOTE)):
+		bld.fatal('WAFCACHE_REMOTE requires a remote cache %r and a file cache WAFCACHE %r' % (WAFCACHE_REMOTE, CACHE_DIR))
+	if not WAFCACHE_COMPRESSION in ('zstd', 'zlib', 'none', ''):
+		bld.fatal('Invalid WAFCACHE_COMPRESSION %r, use one of zstd, zlib or none' % WAFCACHE_COMPRESSION)
+	if WAFCACHE_COMPRESSION == 'zstd' and not zstandard:
+		bld.fatal('WAFCACHE_COMPRESSION=zstd requires the python module zstandard (or use WAFCACHE_COMPRESSION=zlib)')
 
 	if WAFCACHE_ASYNC_WORKERS:
 		try:
@@ -322,6 +510,23 @@ def build(bld):
 			bld.wafcache_executor.shutdown(wait=True)
 		bld.add_post_fun(finalize_upload_async)
 
+	if WAFCACHE_PREFETCH:
+		try:
+			num_threads = int(WAFCACHE_PREFETCH)
+		except ValueError:
+			Logs.warn('Invalid WAFCACHE_PREFETCH specified: %r' % WAFCACHE_PREFETCH)
+		else:
+			from concurrent.futures import ThreadPoolExecutor
+			bld.wafcache_prefetch_executor = ThreadPoolExecutor(max_workers=num_threads)
+			bld.wafcache_prefetches = []
+
+			def finalize_prefetch(bld):
+				# files of tasks that did not run
+				for fut in bld.wafcache_prefetches:
+					fut.cancel()
+				bld.wafcache_prefetch_executor.shutdown(wait=True)
+			bld.add_post_fun(finalize_prefetch)
+
 	if WAFCACHE_STATS:
 		# Init counter for statistics and hook to print results at the end
 		bld.cache_reqs = bld.cache_hits = bld.cache_puts = 0
@@ -344,19 +549,27 @@ def build(bld):
 
 	Task.Task.can_retrieve_cache = can_retrieve_cache
 	Task.Task.put_files_cache = put_files_cache
+	Task.Task.prefetch_cache = prefetch_cache
 	Task.Task.uid = uid
 	Build.BuildContext.hash_env_vars = hash_env_vars
 	for x in reversed(list(Task.classes.values())):
 		make_cached(x)
+	if WAFCACHE_PREFETCH:
+		make_prefetched(Runner.Parallel)
 
-def cache_command(proc, sig, files_from, files_to):
+def cache_command(proc, sig, files_from, files_to, tier=None):
 	"""
 	Create a command for cache worker processes, returns a pickled
 	base64-encoded tuple containing the task signature, a list of files to
 	cache and a list of files files to get from cache (one of the lists
-	is assumed to be empty)
+	is assumed to be empty), and for two-tier caches, the cache to copy
+	the files to ('local' or 'remote', both if unset); a list of signatures
+	and two empty lists look up the cache entries (see :py:func:`query_files_cache`)
 	"""
-	obj = base64.b64encode(cPickle.dumps([sig, files_from, files_to]))
+	lst = [sig, files_from, files_to]
+	if tier:
+		lst.append(tier)
+	obj = base64.b64encode(cPickle.dumps(lst))
 	proc.stdin.write(obj)
 	proc.stdin.write('\n'.encode())
 	proc.stdin.flush()
@@ -391,54 +604,523 @@ def atomic_copy(orig, dest):
 		else:
 			raise
 	os.rename(tmp, dest)
+	# rename does nothing if both names link the same file
+	if os.path.lexists(tmp):
+		os.remove(tmp)
 
-def lru_trim():
+def hash_file(path):
 	"""
-	the cache folders take the form:
-	`CACHE_DIR/0b/0b180f82246d726ece37c8ccd0fb1cde2650d7bfcf122ec1f169079a3bfc0ab9`
-	they are listed in order of last access, and then removed
-	until the amount of folders is within TRIM_MAX_FOLDERS and the total space
-	taken by files is less than EVICT_MAX_BYTES
+	:return: the hash of the contents of a file, naming the file in the blob store
+	:rtype: string
 	"""
-	lst = []
-	for up in os.listdir(CACHE_DIR):
-		if len(up) == 2:
-			sub = os.path.join(CACHE_DIR, up)
-			for hval in os.listdir(sub):
-				path = os.path.join(sub, hval)
+	m = hashlib.sha256()
+	with open(path, 'rb') as f:
+		while 1:
+			buf = f.read(200000)
+			if not buf:
+				break
+			m.update(buf)
+	return m.hexdigest()
+
+def blob_path(h):
+	"""
+	:return: the path of a file in the blob store: `CACHE_DIR/blobs/0b/<hash>`
+	"""
+	return os.path.join(CACHE_DIR, 'blobs', h[:2], h)
 
-				size = 0
-				for fname in os.listdir(path):
-					try:
-						size += os.lstat(os.path.join(path, fname)).st_size
-					except OSError:
-						pass
-				lst.append((os.stat(path).st_mtime, size, path))
+def link_file(orig, dest):
+	"""
+	Links a blob into a cache folder, or copies it if the filesystem does not support hard links
 
-	lst.sort(key=lambda x: x[0])
-	lst.reverse()
+	:return: True if the file was linked
+	"""
+	tmp = dest + '.tmp'
+	up = os.path.dirname(dest)
+	try:
+		os.makedirs(up)
+	except OSError:
+		pass
+	try:
+		os.link(orig, tmp)
+	except OSError:
+		shutil.copy2(orig, tmp)
+		ret = False
+	else:
+		ret = True
+	os.rename(tmp, dest)
+	if os.path.lexists(tmp):
+		os.remove(tmp)
+	return ret
+
+def read_manifest(path):
+	"""
+	:return: the hashes of the blobs linked by a cache folder (empty for folders created without the blob store)
+	:rtype: list of string
+	"""
+	try:
+		with open(os.path.join(path, 'manifest'), 'r') as f:
+			return f.read().split()
+	except EnvironmentError:
+		return []
+
+def write_manifest(path, hashes):
+	"""
+	Writes the hashes of the blobs linked by a cache folder
+	"""
+	dest = os.path.join(path, 'manifest')
+	with open(dest + '.tmp', 'w') as f:
+		f.write('\n'.join(hashes) + '\n')
+	os.rename(dest + '.tmp', dest)
 
-	tot = sum(x[1] for x in lst)
-	while tot > EVICT_MAX_BYTES or len(lst) > TRIM_MAX_FOLDERS:
-		_, tmp_size, path = lst.pop()
-		tot -= tmp_size
+def entry_size(path):
+	"""
+	:return: the sum of the sizes of the files of a cache folder created without the blob store,
+	  0 for the other folders as their blobs are counted once in the index (see :py:func:`ref_blobs`)
+	:rtype: int
+	"""
+	if os.path.isfile(os.path.join(path, 'manifest')):
+		return 0
+	size = 0
+	try:
+		for fname in os.listdir(path):
+			if fname != 'manifest' and not fname.endswith('.tmp'):
+				size += os.lstat(os.path.join(path, fname)).st_size
+	except OSError:
+		pass
+	return size
+
+def release_blobs(hashes):
+	"""
+	Removes the blobs that are no longer linked from the cache folders nor from the build
+	folders (hard links count). The blobs still linked are recorded in `CACHE_DIR/index/blobs`
+	so that :py:func:`lru_trim` checks them again later. The size of the cache does not
+	depend on the blobs removed, see :py:func:`unref_blobs`.
 
-		tmp = path + '.remove'
+	:return: the amount of bytes freed on the disk
+	:rtype: int
+	"""
+	freed = 0
+	pending = []
+	for h in hashes:
+		blob = blob_path(h)
 		try:
-			shutil.rmtree(tmp)
+			st = os.stat(blob)
 		except OSError:
-			pass
+			continue
+		if st.st_nlink == 1:
+			try:
+				os.remove(blob)
+			except OSError:
+				continue
+			freed += st.st_size
+		else:
+			pending.append(h)
+	if pending:
+		fd = os.open(os.path.join(CACHE_DIR, 'index', 'blobs'), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		try:
+			fcntl.lockf(fd, fcntl.LOCK_EX)
+			os.write(fd, ''.join('%s\n' % h for h in pending).encode())
+		finally:
+			os.close(fd)
+	return freed
+
+def release_pending_blobs():
+	"""
+	Checks the blobs recorded by :py:func:`release_blobs` again
+
+	:return: the amount of bytes freed
+	:rtype: int
+	"""
+	path = os.path.join(CACHE_DIR, 'index', 'blobs')
+	tmp = path + '.%d' % os.getpid()
+	try:
+		os.rename(path, tmp)
+	except OSError:
+		return 0
+	try:
+		with open(tmp, 'r') as f:
+			hashes = set(f.read().split())
+		return release_blobs(hashes)
+	finally:
+		os.remove(tmp)
+
+def ref_blobs(idx, blobs):
+	"""
+	Counts a reference to each blob in the index summary *idx*
+
+	:param blobs: hashes and sizes of the blobs linked by a cache folder
+	:type blobs: list of tuple
+	:return: the size of the blobs that were not referenced
+	:rtype: int
+	"""
+	size = 0
+	refs = idx['refs']
+	for h, n in blobs:
+		if h in refs:
+			refs[h][0] += 1
+		else:
+			refs[h] = [1, n]
+			size += n
+	return size
+
+def unref_blobs(idx, hashes):
+	"""
+	Removes a reference to each blob from the index summary *idx*
+
+	:param hashes: hashes of the blobs no longer linked by a cache folder
+	:type hashes: list of string
+	:return: the size of the blobs no longer referenced
+	:rtype: int
+	"""
+	size = 0
+	refs = idx['refs']
+	for h in hashes:
+		if h in refs:
+			refs[h][0] -= 1
+			if not refs[h][0]:
+				size += refs.pop(h)[1]
+	return size
+
+def remove_entry(path, idx):
+	"""
+	Removes a cache folder, renaming it first so that other processes do not read partial results,
+	and then the blobs it was the last to reference; the size of the folder and its blob references
+	are then subtracted from the index summary *idx*
+
+	:return: True if the folder was removed
+	:rtype: bool
+	"""
+	hashes = read_manifest(path)
+	size = entry_size(path)
+
+	tmp = path + '.remove'
+	try:
+		shutil.rmtree(tmp)
+	except OSError:
+		pass
+	try:
+		os.rename(path, tmp)
+	except OSError:
+		sys.stderr.write('Could not rename %r to %r\n' % (path, tmp))
+	else:
 		try:
-			os.rename(path, tmp)
+			shutil.rmtree(tmp)
 		except OSError:
-			sys.stderr.write('Could not rename %r to %r\n' % (path, tmp))
+			sys.stderr.write('Could not remove %r\n' % tmp)
 		else:
+			release_blobs(hashes)
+		idx['bytes'] -= size + unref_blobs(idx, hashes)
+		idx['count'] -= 1
+		return True
+	return False
+
+def index_append(kind, sig, size, refs=(), unrefs=()):
+	"""
+	Records an operation on a cache entry in the index journal of the current time interval
+	(one file per INDEX_INTERVAL_SECONDS, named after the start time). The lines take the form
+	`P sig size` for new entries, `R sig difference` for entries written again and `A sig size`
+	for entries read; the sizes are those of :py:func:`entry_size` (the sizes of the files
+	read for `A`). They are followed by the blob references added and removed by the entry,
+	`L hash size` and `U hash`.
+
+	:param refs: hashes and sizes of the blobs linked
+	:type refs: list of tuple
+	:param unrefs: hashes of the blobs no longer linked
+	:type unrefs: list of string
+	"""
+	lines = ['%s %s %d\n' % (kind, sig, size)]
+	lines.extend('L %s %d\n' % x for x in refs)
+	lines.extend('U %s\n' % x for x in unrefs)
+	start = int(time.time()) // INDEX_INTERVAL_SECONDS * INDEX_INTERVAL_SECONDS
+	path = os.path.join(CACHE_DIR, 'index', str(start))
+	fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+	try:
+		# appends are not atomic on network filesystems
+		fcntl.lockf(fd, fcntl.LOCK_EX)
+		os.write(fd, ''.join(lines).encode())
+	finally:
+		os.close(fd)
+
+def is_entry_line(line):
+	"""
+	:return: True for the journal lines of operations on cache entries, False for the blob references
+	:rtype: bool
+	"""
+	return not line.startswith(('L ', 'U '))
+
+def read_index():
+	"""
+	Reads the index summary: total size, amount of entries, of journal lines (entry operations)
+	and of blobs, the position up to which each journal was accounted for, and the reference
+	counts and sizes of the blobs
+
+	:return: a dict, or None if the index must be rebuilt
+	"""
+	try:
+		with open(os.path.join(CACHE_DIR, 'index', 'summary'), 'r') as f:
+			lines = f.read().splitlines()
+		# summaries written before the blobs were counted once have 3 values
+		size, count, nlines, nblobs = lines[0].split()
+		offsets = {}
+		refs = {}
+		for x in lines[1:]:
+			vals = x.split()
+			if len(vals) == 2:
+				offsets[int(vals[0])] = int(vals[1])
+			else:
+				h, n, sz = vals
+				refs[h] = [int(n), int(sz)]
+	except (EnvironmentError, ValueError, IndexError):
+		return None
+	if len(refs) != int(nblobs):
+		return None
+	return {'bytes': int(size), 'count': int(count), 'lines': int(nlines), 'offsets': offsets, 'refs': refs}
+
+def write_index(idx):
+	"""
+	Writes the index summary atomically, see :py:func:`read_index`
+	"""
+	path = os.path.join(CACHE_DIR, 'index', 'summary')
+	lines = ['%d %d %d %d' % (idx['bytes'], idx['count'], idx['lines'], len(idx['refs']))]
+	lines.extend('%d %d' % x for x in sorted(idx['offsets'].items()))
+	lines.extend('%s %d %d' % (h, n, sz) for h, (n, sz) in sorted(idx['refs'].items()))
+	with open(path + '.tmp', 'w') as f:
+		f.write('\n'.join(lines) + '\n')
+	os.rename(path + '.tmp', path)
+
+def list_journals():
+	"""
+	:return: the start times of the index journals, oldest first
+	:rtype: list of int
+	"""
+	return sorted(int(x) for x in os.listdir(os.path.join(CACHE_DIR, 'index')) if x.isdigit())
+
+def update_index(idx):
+	"""
+	Accounts for the entries added since the index summary was written,
+	reading only the lines appended to the journals
+	"""
+	offsets = idx['offsets']
+	for k in list_journals():
+		with open(os.path.join(CACHE_DIR, 'index', str(k)), 'rb') as f:
+			f.seek(offsets.get(k, 0))
+			data = f.read()
+		# ignore a line being written
+		data = data[:data.rfind(b'\n') + 1]
+		offsets[k] = offsets.get(k, 0) + len(data)
+		for line in data.decode().splitlines():
+			vals = line.split()
+			kind = vals[0]
+			if kind == 'L':
+				idx['bytes'] += ref_blobs(idx, [(vals[1], int(vals[2]))])
+				continue
+			elif kind == 'U':
+				idx['bytes'] -= unref_blobs(idx, [vals[1]])
+				continue
+			idx['lines'] += 1
+			if kind == 'P':
+				idx['bytes'] += int(vals[2])
+				idx['count'] += 1
+			elif kind == 'R':
+				idx['bytes'] += int(vals[2])
+
+def rebuild_index():
+	"""
+	Lists all the cache folders to write the index journals again, for caches created without an index
+	or modified by other means; the entries are placed in the journals by last access time.
+
+	:return: the new index summary
+	"""
+	journals = {}
+	tot = count = 0
+	seen = set()
+	idx = {'refs': {}}
+	for up in os.listdir(CACHE_DIR):
+		if len(up) == 2:
+			sub = os.path.join(CACHE_DIR, up)
+			for hval in os.listdir(sub):
+				path = os.path.join(sub, hval)
+				if hval.endswith('.remove'):
+					continue
+				blobs = []
+				try:
+					mtime = os.stat(path).st_mtime
+					for fname in os.listdir(path):
+						st = os.lstat(os.path.join(path, fname))
+						seen.add((st.st_dev, st.st_ino))
+					for i, h in enumerate(read_manifest(path)):
+						blobs.append((h, os.lstat(os.path.join(path, str(i))).st_size))
+				except OSError:
+					continue
+				size = entry_size(path)
+				journals.setdefault(int(mtime) // INDEX_INTERVAL_SECONDS * INDEX_INTERVAL_SECONDS, []).append('P %s %d\n' % (hval, size))
+				tot += size + ref_blobs(idx, blobs)
+				count += 1
+
+	# blobs not linked by the cache folders
+	pending = []
+	blobs = os.path.join(CACHE_DIR, 'blobs')
+	for up in (os.listdir(blobs) if os.path.isdir(blobs) else []):
+		for h in os.listdir(os.path.join(blobs, up)):
+			try:
+				st = os.stat(os.path.join(blobs, up, h))
+			except OSError:
+				continue
+			if not (st.st_dev, st.st_ino) in seen:
+				pending.append(h)
+	try:
+		os.remove(os.path.join(CACHE_DIR, 'index', 'blobs'))
+	except OSError:
+		pass
+	release_blobs(pending)
+
+	for k in list_journals():
+		os.remove(os.path.join(CACHE_DIR, 'index', str(k)))
+	offsets = {}
+	for k, lines in journals.items():
+		path = os.path.join(CACHE_DIR, 'index', str(k))
+		data = ''.join(lines).encode()
+		with open(path, 'ab') as f:
+			f.write(data)
+		offsets[k] = len(data)
+	idx.update({'bytes': tot, 'count': count, 'lines': count, 'offsets': offsets})
+	# entries added in the meantime
+	update_index(idx)
+	return idx
+
+def lru_trim(rebuild=False):
+	"""
+	the cache folders take the form:
+	`CACHE_DIR/0b/0b180f82246d726ece37c8ccd0fb1cde2650d7bfcf122ec1f169079a3bfc0ab9`
+	and contain hard links to the files of the blob store (`CACHE_DIR/blobs/xx/<hash>`)
+	the operations on the folders are recorded in journals by time interval
+	(`CACHE_DIR/index/<interval>`, see :py:func:`index_append`), and the folders listed
+	in the oldest journals are removed until the amount of folders is within TRIM_MAX_FOLDERS
+	and the total space taken by files is less than EVICT_MAX_BYTES. A folder is kept
+	if it was accessed after the start of the next journal (modification time),
+	as it is listed in a more recent journal. The journals of the current and of the
+	previous time intervals are kept as other processes may still append to them.
+
+	The cache is listed only when the index is missing or when *rebuild* is set.
+	"""
+	idx = None if rebuild else read_index()
+	if idx is None:
+		idx = rebuild_index()
+	else:
+		update_index(idx)
+		release_pending_blobs()
+
+	current = int(time.time()) // INDEX_INTERVAL_SECONDS * INDEX_INTERVAL_SECONDS
+	journals = list_journals()
+	for i, k in enumerate(journals):
+		if idx['bytes'] <= EVICT_MAX_BYTES and idx['count'] <= TRIM_MAX_FOLDERS:
+			break
+		path = os.path.join(CACHE_DIR, 'index', str(k))
+		end = journals[i + 1] if i + 1 < len(journals) else float('inf')
+		with open(path, 'r') as f:
+			lines = f.read().splitlines()
+		for line in lines:
+			if idx['bytes'] <= EVICT_MAX_BYTES and idx['count'] <= TRIM_MAX_FOLDERS:
+				break
+			if not is_entry_line(line):
+				# blob references, accounted for in the summary
+				continue
+			try:
+				_, sig, size = line.split()
+			except ValueError:
+				continue
+			entry = os.path.join(CACHE_DIR, sig[:2], sig)
 			try:
-				shutil.rmtree(tmp)
+				if os.stat(entry).st_mtime >= end:
+					continue
 			except OSError:
-				sys.stderr.write('Could not remove %r\n' % tmp)
-	sys.stderr.write("Cache trimmed: %r bytes in %r folders left\n" % (tot, len(lst)))
+				# removed already
+				continue
+			remove_entry(entry, idx)
+		else:
+			if k < current - INDEX_INTERVAL_SECONDS:
+				os.remove(path)
+				idx['offsets'].pop(k, None)
+				idx['lines'] -= len([x for x in lines if is_entry_line(x)])
 
+	if idx['lines'] > INDEX_COMPACT_RATIO * idx['count']:
+		compact_index(idx)
+	write_index(idx)
+	sys.stderr.write("Cache trimmed: %r bytes in %r folders left\n" % (idx['bytes'], idx['count']))
+
+def compact_index(idx):
+	"""
+	Rewrites the journals so that each cache folder is listed once, in the journal of its last
+	operation, and drops the folders removed and the blob references (counted in the summary);
+	the journals would otherwise grow with the amount of operations while the cache size is within
+	the limits. The journals of the current and of the previous time intervals are left alone as
+	other processes may still append to them.
+	"""
+	current = int(time.time()) // INDEX_INTERVAL_SECONDS * INDEX_INTERVAL_SECONDS
+	journals = [k for k in list_journals() if k < current - INDEX_INTERVAL_SECONDS]
+	contents = {}
+	latest = {}
+	for k in journals:
+		with open(os.path.join(CACHE_DIR, 'index', str(k)), 'r') as f:
+			contents[k] = f.read().splitlines()
+		for line in contents[k]:
+			if not is_entry_line(line):
+				continue
+			try:
+				_, sig, _ = line.split()
+			except ValueError:
+				continue
+			latest[sig] = k
+
+	for k in journals:
+		kept = []
+		for line in contents[k]:
+			if not is_entry_line(line):
+				continue
+			try:
+				_, sig, _ = line.split()
+			except ValueError:
+				continue
+			if latest.get(sig) == k:
+				# listed once
+				latest[sig] = None
+				if os.path.isdir(os.path.join(CACHE_DIR, sig[:2], sig)):
+					kept.append(line)
+		idx['lines'] -= len([x for x in contents[k] if is_entry_line(x)]) - len(kept)
+		path = os.path.join(CACHE_DIR, 'index', str(k))
+		if kept:
+			data = ''.join('%s\n' % x for x in kept).encode()
+			with open(path + '.tmp', 'wb') as f:
+				f.write(data)
+			os.rename(path + '.tmp', path)
+			idx['offsets'][k] = len(data)
+		else:
+			os.remove(path)
+			idx['offsets'].pop(k, None)
+
+	# journals removed by other means
+	existing = set(list_journals())
+	for k in list(idx['offsets']):
+		if not k in existing:
+			idx['offsets'].pop(k)
+
+def cache_stats():
+	"""
+	Displays the size of the cache from the index, without listing the cache folders
+	"""
+	idx = read_index()
+	if idx is None:
+		sys.stdout.write('No cache index in %r, run "trim" first\n' % CACHE_DIR)
+		return
+	update_index(idx)
+	journals = list_journals()
+	sys.stdout.write('cache: %s\n' % CACHE_DIR)
+	sys.stdout.write('entries: %d (max %d)\n' % (idx['count'], TRIM_MAX_FOLDERS))
+	sys.stdout.write('size: %d bytes (max %d)\n' % (idx['bytes'], EVICT_MAX_BYTES))
+	sys.stdout.write('blobs: %d\n' % len(idx['refs']))
+	if journals:
+		age = time.time() - journals[0]
+		sys.stdout.write('journals: %d (%d lines), oldest %.1f hours ago\n' % (len(journals), idx['lines'], age / 3600.))
 
 def lru_evict():
 	"""
@@ -472,12 +1154,164 @@ def lru_evict():
 		finally:
 			os.close(fd)
 
+def archive_name():
+	"""
+	:return: the name of the task archives for the current compression, see WAFCACHE_COMPRESSION
+	:rtype: string
+	"""
+	return 'archive' + {'zstd': '.zst', 'zlib': '.z'}.get(WAFCACHE_COMPRESSION, '')
+
+class null_compressor(object):
+	def compress(self, data):
+		return data
+	decompress = compress
+	def flush(self):
+		return b''
+
+def get_compressor():
+	if WAFCACHE_COMPRESSION == 'zstd':
+		return zstandard.ZstdCompressor(level=3).compressobj()
+	elif WAFCACHE_COMPRESSION == 'zlib':
+		return zlib.compressobj(3)
+	return null_compressor()
+
+def get_decompressor():
+	if WAFCACHE_COMPRESSION == 'zstd':
+		return zstandard.ZstdDecompressor().decompressobj()
+	elif WAFCACHE_COMPRESSION == 'zlib':
+		return zlib.decompressobj()
+	return null_compressor()
+
+def iter_archive(files_from):
+	"""
+	Compresses files to a single stream: the amount of files, their sizes and
+	permissions, followed by the file contents, read by chunks
+
+	:return: a generator of the compressed chunks, none of them empty
+	"""
+	comp = get_compressor()
+	header = [struct.pack('!I', len(files_from))]
+	sizes = []
+	for x in files_from:
+		st = os.stat(x)
+		header.append(struct.pack('!QI', st.st_size, st.st_mode & 0o7777))
+		sizes.append(st.st_size)
+	buf = comp.compress(b''.join(header))
+	if buf:
+		yield buf
+	for x, size in zip(files_from, sizes):
+		with open(x, 'rb') as f:
+			while size:
+				buf = f.read(min(size, CHUNK_SIZE))
+				if not buf:
+					raise OSError('File %r changed during the upload' % x)
+				size -= len(buf)
+				buf = comp.compress(buf)
+				if buf:
+					yield buf
+	buf = comp.flush()
+	if buf:
+		yield buf
+
+def write_archive(files_from, out):
+	"""
+	Writes files to a single compressed stream, see :py:func:`iter_archive`
+
+	:param out: file object to write the archive to
+	"""
+	for buf in iter_archive(files_from):
+		out.write(buf)
+
+class archive_reader(object):
+	"""
+	Decompresses an archive written by :py:func:`write_archive` from a file object, by chunks
+	"""
+	def __init__(self, inf):
+		self.inf = inf
+		self.dec = get_decompressor()
+		self.buf = b''
+
+	def read(self, n):
+		"""
+		:return: at most *n* bytes, or an empty string at the end of the stream
+		"""
+		while not self.buf and self.dec:
+			data = self.inf.read(CHUNK_SIZE)
+			if data:
+				try:
+					self.buf = self.dec.decompress(data)
+				except Exception as e:
+					# zlib.error, zstandard.ZstdError
+					raise OSError('Invalid archive: %s' % e)
+			else:
+				if not getattr(self.dec, 'eof', True):
+					# zlib streams end with a checksum
+					raise OSError('Incomplete archive')
+				flush = getattr(self.dec, 'flush', None)
+				self.buf = flush() if flush else b''
+				self.dec = None
+		ret = self.buf[:n]
+		self.buf = self.buf[n:]
+		return ret
+
+	def read_exactly(self, n):
+		lst = []
+		while n:
+			buf = self.read(n)
+			if not buf:
+				raise OSError('Incomplete archive')
+			n -= len(buf)
+			lst.append(buf)
+		return b''.join(lst)
+
+	def extract(self, files_to):
+		"""
+		Writes the files of the archive, the operation is atomic for a given file
+		"""
+		count = struct.unpack('!I', self.read_exactly(4))[0]
+		if count != len(files_to):
+			raise OSError('Invalid archive: %d files for %d outputs' % (count, len(files_to)))
+		header = [struct.unpack('!QI', self.read_exactly(12)) for x in files_to]
+		for x, (size, mode) in zip(files_to, header):
+			tmp = x + '.tmp'
+			try:
+				with open(tmp, 'wb') as out:
+					os.chmod(tmp, mode)
+					while size:
+						buf = self.read(min(size, CHUNK_SIZE))
+						if not buf:
+							raise OSError('Incomplete archive')
+						size -= len(buf)
+						out.write(buf)
+			except EnvironmentError:
+				os.remove(tmp)
+				raise
+			os.rename(tmp, x)
+		if self.read(1):
+			raise OSError('Invalid archive: data after the files')
+
+def is_remote(url):
+	"""
+	Returns True if the cache location is a server or a bucket
+	"""
+	return url.startswith(('s3://', 'gs://', 'minio://', 'http'))
+
+def remote_service(url):
+	"""
+	Returns the cache object for a server or a bucket
+	"""
+	if url.startswith('http'):
+		return netcache(url)
+	return bucket_cache(url)
+
 class netcache(object):
-	def __init__(self):
-		self.http = urllib3.PoolManager()
+	def __init__(self, url=None):
+		self.url = url or CACHE_DIR
+		# the worker processes are persistent, keep the connections to the server open
+		self.http = urllib3.PoolManager(maxsize=2, retries=urllib3.Retry(3, backoff_factor=0.2))
 
 	def url_of(self, sig, i):
-		return "%s/%s/%s" % (CACHE_DIR, sig, i)
+		return "%s/%s/%s" % (self.url, sig, i)
 
 	def upload(self, file_path, sig, i):
 		url = self.url_of(sig, i)
@@ -496,19 +1330,71 @@ class netcache(object):
 			with open(file_path, 'wb') as out:
 				shutil.copyfileobj(inf, out)
 
+	def upload_archive(self, files_from, sig):
+		url = self.url_of(sig, archive_name())
+		# the form of upload(), sent by chunks as the archive is compressed
+		boundary = urllib3.filepost.choose_boundary()
+		field = urllib3.fields.RequestField.from_tuples('file', ('%s/%s' % (sig, archive_name()), b''))
+		def body():
+			yield ('--%s\r\n%s' % (boundary, field.render_headers())).encode('latin-1')
+			for buf in iter_archive(files_from):
+				yield buf
+			yield ('\r\n--%s--\r\n' % boundary).encode('latin-1')
+		r = self.http.request('POST', url, body=body(), chunked=True, timeout=60,
+			headers={'Content-Type': 'multipart/form-data; boundary=%s' % boundary})
+		if r.status >= 400:
+			raise OSError("Invalid status %r %r" % (url, r.status))
+
+	def download_archive(self, files_to, sig):
+		url = self.url_of(sig, archive_name())
+		with self.http.request('GET', url, preload_content=False, timeout=60) as inf:
+			if inf.status >= 400:
+				raise OSError("Invalid status %r %r" % (url, inf.status))
+			archive_reader(inf).extract(files_to)
+
+	def query(self, sigs):
+		"""
+		Looks up cache entries with a single request, see WAFCACHE_PREFETCH
+
+		:return: the signatures of the entries found (all of them if the server does not
+		  answer such requests), or the error
+		"""
+		name = archive_name() if WAFCACHE_COMPRESSION else '0'
+		paths = ['%s/%s' % (x, name) for x in sigs]
+		try:
+			r = self.http.request('POST', '%s/query' % self.url, body='\n'.join(paths).encode(), timeout=60,
+				headers={'Content-Type': 'text/plain'})
+		except Exception:
+			return traceback.format_exc()
+		if r.status >= 400:
+			return sigs
+		try:
+			found = set(json.loads(r.data.decode('utf-8'))['found'])
+		except (ValueError, KeyError, TypeError):
+			# the server does not answer the queries
+			return sigs
+		return [x for x, path in zip(sigs, paths) if path in found]
+
 	def copy_to_cache(self, sig, files_from, files_to):
 		try:
-			for i, x in enumerate(files_from):
-				if not os.path.islink(x):
-					self.upload(x, sig, i)
+			if WAFCACHE_COMPRESSION:
+				if not any(os.path.islink(x) for x in files_from):
+					self.upload_archive(files_from, sig)
+			else:
+				for i, x in enumerate(files_from):
+					if not os.path.islink(x):
+						self.upload(x, sig, i)
 		except Exception:
 			return traceback.format_exc()
 		return OK
 
 	def copy_from_cache(self, sig, files_from, files_to):
 		try:
-			for i, x in enumerate(files_to):
-				self.download(x, sig, i)
+			if WAFCACHE_COMPRESSION:
+				self.download_archive(files_to, sig)
+			else:
+				for i, x in enumerate(files_to):
+					self.download(x, sig, i)
 		except Exception:
 			return traceback.format_exc()
 		return OK
@@ -522,17 +1408,44 @@ class fcache(object):
 				pass
 		if not os.path.exists(CACHE_DIR):
 			raise ValueError('Could not initialize the cache directory')
+		try:
+			os.makedirs(os.path.join(CACHE_DIR, 'index'))
+		except OSError:
+			pass
+		if read_index() is None and not list_journals() and not any(len(x) == 2 for x in os.listdir(CACHE_DIR)):
+			# new cache: the journals will list all the cache folders, so that the index
+			# may be read (stats) before the cache is trimmed for the first time
+			write_index({'bytes': 0, 'count': 0, 'lines': 0, 'offsets': {}, 'refs': {}})
 
 	def copy_to_cache(self, sig, files_from, files_to):
 		"""
 		Copy files to the cache, existing files are overwritten,
 		and the copy is atomic only for a given file, not for all files
-		that belong to a given task object
+		that belong to a given task object. The files are stored once
+		by contents in the blob store, the cache folder of the task
+		holds hard links to the blobs and the list of blobs (manifest)
 		"""
 		try:
+			entry = os.path.join(CACHE_DIR, sig[:2], sig)
+			exists = os.path.isdir(entry)
+			old_size = entry_size(entry) if exists else 0
+			old_hashes = read_manifest(entry)
+			hashes = []
+			blobs = []
 			for i, x in enumerate(files_from):
-				dest = os.path.join(CACHE_DIR, sig[:2], sig, str(i))
-				atomic_copy(x, dest)
+				h = hash_file(x)
+				blob = blob_path(h)
+				if not os.path.isfile(blob):
+					atomic_copy(x, blob)
+				link_file(blob, os.path.join(entry, str(i)))
+				hashes.append(h)
+				blobs.append((h, os.path.getsize(blob)))
+			write_manifest(entry, hashes)
+			release_blobs(set(old_hashes).difference(hashes))
+			if exists:
+				index_append('R', sig, entry_size(entry) - old_size, blobs, old_hashes)
+			else:
+				index_append('P', sig, entry_size(entry), blobs)
 		except Exception:
 			return traceback.format_exc()
 		else:
@@ -544,22 +1457,36 @@ class fcache(object):
 				return traceback.format_exc()
 		return OK
 
+	def query(self, sigs):
+		"""
+		:return: the signatures of the cache entries found
+		"""
+		return [x for x in sigs if os.path.isdir(os.path.join(CACHE_DIR, x[:2], x))]
+
 	def copy_from_cache(self, sig, files_from, files_to):
 		"""
 		Copy files from the cache
 		"""
 		try:
+			size = 0
 			for i, x in enumerate(files_to):
 				orig = os.path.join(CACHE_DIR, sig[:2], sig, str(i))
 				atomic_copy(orig, x)
+				size += os.path.getsize(x)
 
 			# success! update the cache time
 			os.utime(os.path.join(CACHE_DIR, sig[:2], sig), None)
+			index_append('A', sig, size)
 		except Exception:
 			return traceback.format_exc()
 		return OK
 
 class bucket_cache(object):
+	def __init__(self, url=None):
+		self.url = url or CACHE_DIR
+		if self.url.startswith('minio://'):
+			self.url = self.url[8:]   # minio doesn't need the protocol part, uses config aliases
+
 	def bucket_copy(self, source, target):
 		if WAFCACHE_CMD:
 			def replacer(match):
@@ -568,9 +1495,9 @@ class bucket_cache(object):
 				elif match.group('tgt'):
 					return target
 			cmd = [re_waf_cmd.sub(replacer, x) for x in shlex.split(WAFCACHE_CMD)]
-		elif CACHE_DIR.startswith('s3://'):
+		elif self.url.startswith('s3://'):
 			cmd = ['aws', 's3', 'cp', source, target]
-		elif CACHE_DIR.startswith('gs://'):
+		elif self.url.startswith('gs://'):
 			cmd = ['gsutil', 'cp', source, target]
 		else:
 			cmd = ['mc', 'cp', source, target]
@@ -581,24 +1508,94 @@ class bucket_cache(object):
 			raise OSError('Error copy %r to %r using: %r (exit %r):\n  out:%s\n  err:%s' % (
 				source, target, cmd, proc.returncode, out.decode(errors='replace'), err.decode(errors='replace')))
 
+	def query(self, sigs):
+		# no lookups, the downloads tell which entries exist
+		return sigs
+
 	def copy_to_cache(self, sig, files_from, files_to):
 		try:
-			for i, x in enumerate(files_from):
-				dest = os.path.join(CACHE_DIR, sig[:2], sig, str(i))
-				self.bucket_copy(x, dest)
+			if WAFCACHE_COMPRESSION:
+				# a single command per task
+				fd, tmp = tempfile.mkstemp(prefix='wafcache')
+				try:
+					with os.fdopen(fd, 'wb') as out:
+						write_archive(files_from, out)
+					self.bucket_copy(tmp, os.path.join(self.url, sig[:2], sig, archive_name()))
+				finally:
+					os.remove(tmp)
+			else:
+				for i, x in enumerate(files_from):
+					dest = os.path.join(self.url, sig[:2], sig, str(i))
+					self.bucket_copy(x, dest)
 		except Exception:
 			return traceback.format_exc()
 		return OK
 
 	def copy_from_cache(self, sig, files_from, files_to):
 		try:
-			for i, x in enumerate(files_to):
-				orig = os.path.join(CACHE_DIR, sig[:2], sig, str(i))
-				self.bucket_copy(orig, x)
+			if WAFCACHE_COMPRESSION:
+				fd, tmp = tempfile.mkstemp(prefix='wafcache')
+				os.close(fd)
+				try:
+					self.bucket_copy(os.path.join(self.url, sig[:2], sig, archive_name()), tmp)
+					with open(tmp, 'rb') as inf:
+						archive_reader(inf).extract(files_to)
+				finally:
+					os.remove(tmp)
+			else:
+				for i, x in enumerate(files_to):
+					orig = os.path.join(self.url, sig[:2], sig, str(i))
+					self.bucket_copy(orig, x)
 		except EnvironmentError:
 			return traceback.format_exc()
 		return OK
 
+class tiered_cache(object):
+	"""
+	File cache in front of a remote cache (WAFCACHE_REMOTE)
+	"""
+	def __init__(self, local, remote):
+		self.local = local
+		self.remote = remote
+
+	def local_files(self, sig, files_from):
+		# upload the files of the local cache entry as the build outputs
+		# may be modified before asynchronous uploads are performed
+		if any(os.path.islink(x) for x in files_from):
+			return files_from
+		entry = os.path.join(CACHE_DIR, sig[:2], sig)
+		lst = [os.path.join(entry, str(i)) for i in range(len(files_from))]
+		if all(os.path.isfile(x) for x in lst):
+			return lst
+		return files_from
+
+	def query(self, sigs):
+		found = self.local.query(sigs)
+		lst = [x for x in sigs if not x in found]
+		if not lst:
+			return found
+		ret = self.remote.query(lst)
+		if not isinstance(ret, list):
+			return ret
+		return found + ret
+
+	def copy_to_cache(self, sig, files_from, files_to, tier=None):
+		if tier != 'remote':
+			ret = self.local.copy_to_cache(sig, files_from, files_to)
+			if tier == 'local' or not ret.startswith(OK):
+				return ret
+		return self.remote.copy_to_cache(sig, self.local_files(sig, files_from), files_to)
+
+	def copy_from_cache(self, sig, files_from, files_to):
+		ret = self.local.copy_from_cache(sig, files_from, files_to)
+		if ret.startswith(OK):
+			return ret
+		ret = self.remote.copy_from_cache(sig, files_from, files_to)
+		if ret.startswith(OK):
+			# keep a copy for the next builds, errors are not fatal
+			self.local.copy_to_cache(sig, files_to, [])
+		return ret
+
 def loop(service):
 	"""
 	This function is run when this file is run as a standalone python script,
@@ -606,7 +1603,7 @@ def loop(service):
 	as pickled-encoded tuples (one line per command)
 
 	The commands are to copy files to the cache or copy files from the
-	cache to a target destination
+	cache to a target destination, or to look up cache entries
 	"""
 	# one operation is performed at a single time by a single process
 	# therefore stdin never has more than one line
@@ -616,10 +1613,18 @@ def loop(service):
 		sys.exit(1)
 	ret = OK
 
-	[sig, files_from, files_to] = cPickle.loads(base64.b64decode(txt))
-	if files_from:
+	obj = cPickle.loads(base64.b64decode(txt))
+	sig, files_from, files_to = obj[:3]
+	if isinstance(sig, list):
+		# the signatures of several tasks to look up, see query_files_cache
+		ret = service.query(sig)
+	elif files_from:
 		# TODO return early when pushing files upstream
-		ret = service.copy_to_cache(sig, files_from, files_to)
+		if len(obj) > 3:
+			# the cache of a two-tier cache (tiered_cache)
+			ret = service.copy_to_cache(sig, files_from, files_to, obj[3])
+		else:
+			ret = service.copy_to_cache(sig, files_from, files_to)
 	elif files_to:
 		# the build process waits for workers to (possibly) obtain files from the cache
 		ret = service.copy_from_cache(sig, files_from, files_to)
@@ -631,15 +1636,41 @@ def loop(service):
 	sys.stdout.write('\n')
 	sys.stdout.flush()
 
-if __name__ == '__main__':
-	if CACHE_DIR.startswith('s3://') or CACHE_DIR.startswith('gs://') or CACHE_DIR.startswith('minio://'):
-		if CACHE_DIR.startswith('minio://'):
-			CACHE_DIR = CACHE_DIR[8:]   # minio doesn't need the protocol part, uses config aliases
-		service = bucket_cache()
-	elif CACHE_DIR.startswith('http'):
-		service = netcache()
+def main(argv):
+	"""
+	Displays the cache index or trims the cache, see the module documentation
+	"""
+	if argv[0] == 'stats':
+		cache_stats()
+	elif argv[0] == 'trim':
+		lockfile = os.path.join(CACHE_DIR, 'all.lock')
+		fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0o755)
+		try:
+			fcntl.flock(fd, fcntl.LOCK_EX)
+			lru_trim(rebuild='--rebuild' in argv)
+			os.utime(lockfile, None)
+		finally:
+			os.close(fd)
+	else:
+		sys.stderr.write('Usage: %s stats|trim [--rebuild]\n' % sys.argv[0])
+		sys.exit(1)
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+	if not os.path.isdir(CACHE_DIR):
+		sys.stderr.write('%r is not a file cache\n' % CACHE_DIR)
+		sys.exit(1)
+	try:
+		os.makedirs(os.path.join(CACHE_DIR, 'index'))
+	except OSError:
+		pass
+	main(sys.argv[1:])
+elif __name__ == '__main__':
+	if is_remote(CACHE_DIR):
+		service = remote_service(CACHE_DIR)
 	else:
 		service = fcache()
+		if WAFCACHE_REMOTE:
+			service = tiered_cache(service, remote_service(WAFCACHE_REMOTE))
 	while 1:
 		try:
 			loop(service)
@@ -0,0 +1,418 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+"""
+Rebuild incrementally as soon as source files change, without restarting waf::
+
+	def options(opt):
+		opt.load('watch')
+
+	$ waf watch
+
+The build context, the node tree and the task generators remain in memory between
+builds. When files change:
+
+* the signatures of the files that changed are discarded
+* the tasks using them, and the tasks depending on these tasks, are executed again
+  (tasks which are still up-to-date are skipped as usual)
+* the scripts are read again, in a new build context, when a wscript file or the
+  configuration changes, or when source files are created or removed
+
+Changes are detected through inotify on Linux, or by looking at the file timestamps
+every :py:const:`POLL_INTERVAL` seconds on other platforms (or with ``--watch-poll``).
+"""
+
+import os, re, select, struct, sys, time
+from waflib import Build, Context, Errors, Logs, Task, Utils
+
+POLL_INTERVAL = 1.0
+"""Interval in seconds between two file system scans when inotify is not available"""
+
+DELAY = 0.1
+"""Wait for more changes during this amount of seconds before starting a build"""
+
+re_ignore = re.compile(r'^(\..*|.*~|#.*#|.*\.sw[px]|.*\.tmp)$')
+"""Files that are created or removed without changing the build (editor files)"""
+
+def options(opt):
+	opt.add_option('--watch-poll', dest='watch_poll', default=False, action='store_true',
+		help='look for file changes periodically instead of using inotify')
+
+class inotify_watcher(object):
+	"""
+	Detects the changes in a set of folders through the Linux inotify interface (ctypes)
+	"""
+	IN_ATTRIB      = 0x00000004
+	IN_CLOSE_WRITE = 0x00000008
+	IN_MOVED_FROM  = 0x00000040
+	IN_MOVED_TO    = 0x00000080
+	IN_CREATE      = 0x00000100
+	IN_DELETE      = 0x00000200
+	IN_DELETE_SELF = 0x00000400
+	IN_MOVE_SELF   = 0x00000800
+	IN_Q_OVERFLOW  = 0x00004000
+	IN_CLOEXEC     = 0o2000000
+
+	MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+	def __init__(self, folders):
+		import ctypes, ctypes.util
+		libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+		self.fd = libc.inotify_init1(self.IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+		self.folders = {}
+		try:
+			for x in folders:
+				wd = libc.inotify_add_watch(self.fd, x.encode(), self.MASK)
+				if wd < 0:
+					raise OSError(ctypes.get_errno(), 'Cannot watch %r' % x)
+				self.folders[wd] = x
+		except OSError:
+			self.close()
+			raise
+
+	def close(self):
+		os.close(self.fd)
+
+	def read(self, changes):
+		"""
+		Reads pending events into *changes*, a tuple of sets (modified, created, deleted)
+
+		:return: False if events were lost
+		"""
+		data = os.read(self.fd, 65536)
+		pos = 0
+		while pos < len(data):
+			(wd, mask, cookie, size) = struct.unpack_from('iIII', data, pos)
+			name = data[pos + 16:pos + 16 + size].rstrip(b'\0').decode(sys.getfilesystemencoding() or 'utf-8')
+			pos += 16 + size
+			if mask & self.IN_Q_OVERFLOW:
+				return False
+			try:
+				folder = self.folders[wd]
+			except KeyError:
+				continue
+			path = os.path.join(folder, name) if name else folder
+			if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+				changes[1].add(path)
+			elif mask & (self.IN_DELETE | self.IN_MOVED_FROM | self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+				changes[2].add(path)
+			else:
+				changes[0].add(path)
+		return True
+
+	def wait(self):
+		"""
+		Waits for changes
+
+		:return: a tuple of sets of paths (modified, created, deleted), or None if the changes are unknown
+		"""
+		changes = (set(), set(), set())
+		select.select([self.fd], [], [])
+		while 1:
+			if not self.read(changes):
+				return None
+			if not select.select([self.fd], [], [], DELAY)[0]:
+				return changes
+
+class poll_watcher(object):
+	"""
+	Detects the changes in a set of folders by comparing file timestamps periodically
+	"""
+	def __init__(self, folders):
+		self.folders = folders
+		self.state = self.scan()
+
+	def close(self):
+		pass
+
+	def scan(self):
+		state = {}
+		for x in self.folders:
+			try:
+				lst = os.listdir(x)
+			except OSError:
+				continue
+			for y in lst:
+				path = os.path.join(x, y)
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				state[path] = (st.st_ino, st.st_size, getattr(st, 'st_mtime_ns', st.st_mtime), getattr(st, 'st_ctime_ns', st.st_ctime))
+		return state
+
+	def wait(self):
+		"""
+		See :py:meth:`inotify_watcher.wait`
+		"""
+		while 1:
+			time.sleep(POLL_INTERVAL)
+			state = self.scan()
+			old = self.state
+			self.state = state
+			modified = set(x for x in state if x in old and old[x] != state[x])
+			created = set(x for x in state if not x in old)
+			deleted = set(x for x in old if not x in state)
+			if modified or created or deleted:
+				return (modified, created, deleted)
+
+class WatchContext(Build.BuildContext):
+	'''executes the build, then rebuilds as soon as files change'''
+	cmd = 'watch'
+	fun = 'build'
+
+	def execute(self):
+		"""
+		Runs builds until interrupted; a new context is created when the scripts must be read again
+		"""
+		bld = self
+		while bld:
+			nxt = bld.watch()
+			if bld is not self:
+				bld.finalize()
+			bld = nxt
+
+	def watch(self):
+		"""
+		Executes a full build, then incremental builds until the scripts must be read again
+
+		:return: a new build context, or None to stop
+		"""
+		try:
+			Build.BuildContext.execute(self)
+		except Errors.WafError as e:
+			Logs.error(str(e))
+		except KeyboardInterrupt:
+			return None
+
+		watcher = self.get_watcher()
+		built = True
+		try:
+			while 1:
+				if built:
+					Logs.info('Waf: Watching %d folders for changes (press Ctrl+C to stop)', len(watcher.folders))
+				try:
+					changes = watcher.wait()
+				except KeyboardInterrupt:
+					return None
+
+				if changes is None or self.is_structural(*changes):
+					Logs.info('Waf: Reading the scripts again')
+					for x in self.get_scripts():
+						Context.cache_modules.pop(x, None)
+					bld = self.__class__()
+					bld.options = self.options
+					bld.cmd = self.cmd
+					return bld
+
+				built = True
+				try:
+					built = self.rebuild(changes[0] | changes[1])
+				except Errors.WafError as e:
+					Logs.error(str(e))
+				except KeyboardInterrupt:
+					return None
+		finally:
+			watcher.close()
+
+	def get_watcher(self):
+		"""
+		:return: an object detecting the changes in the folders of the source files and scripts
+		"""
+		folders = set()
+		for x in self.get_sources():
+			folders.add(os.path.dirname(x.abspath()))
+		for x in self.get_scripts():
+			folders.add(os.path.dirname(x))
+		folders.add(self.cache_dir)
+		folders = sorted(x for x in folders if os.path.isdir(x))
+
+		if not getattr(self.options, 'watch_poll', False) and Utils.unversioned_sys_platform() == 'linux':
+			try:
+				return inotify_watcher(folders)
+			except (OSError, AttributeError) as e:
+				Logs.warn('inotify is not available, looking for changes every %ss instead (%s)', POLL_INTERVAL, e)
+		return poll_watcher(folders)
+
+	def get_all_tasks(self):
+		"""
+		:return: the tasks of the build, by build group
+		:rtype: list of lists of :py:class:`waflib.Task.Task`
+		"""
+		ret = []
+		for g in self.groups:
+			lst = []
+			for tg in g:
+				if isinstance(tg, Task.Task):
+					lst.append(tg)
+				else:
+					lst.extend(getattr(tg, 'tasks', []))
+			ret.append(lst)
+		return ret
+
+	def get_deps(self, tsk):
+		"""
+		:return: the nodes used by a task
+		:rtype: list of :py:class:`waflib.Node.Node`
+		"""
+		return tsk.inputs + tsk.dep_nodes + self.node_deps.get(tsk.uid(), [])
+
+	def get_sources(self):
+		"""
+		:return: the source files used by the tasks
+		:rtype: set of :py:class:`waflib.Node.Node`
+		"""
+		ret = set()
+		for lst in self.get_all_tasks():
+			for tsk in lst:
+				for x in self.get_deps(tsk):
+					if not x.is_bld():
+						ret.add(x)
+		return ret
+
+	def get_scripts(self):
+		"""
+		:return: the paths of the wscript files that were read
+		:rtype: list of string
+		"""
+		ret = []
+		for x in getattr(self, 'recurse_cache', {}):
+			if isinstance(x, tuple):
+				x = x[0]
+			ret.append(x.abspath())
+		return ret
+
+	def is_structural(self, modified, created, deleted):
+		"""
+		:return: True if the changes require reading the scripts again
+		:rtype: bool
+		"""
+		cache_dir = self.cache_dir + os.sep
+		scripts = set(self.get_scripts())
+		for x in modified | created | deleted:
+			if x in scripts or x.startswith(cache_dir):
+				return True
+
+		known = set(x.abspath() for x in self.get_sources())
+		for x in created | deleted:
+			if x in known and x in created:
+				# replaced by an editor
+				continue
+			if not re_ignore.match(os.path.basename(x)):
+				return True
+		return False
+
+	def rebuild(self, paths):
+		"""
+		Executes the tasks depending on the files given, and the tasks depending on them
+
+		:param paths: absolute paths of the files that changed
+		:type paths: set of string
+		:return: False if no task had to be executed
+		:rtype: bool
+		"""
+		# the preprocessor and folder caches refer to the previous file contents
+		for x in ('preproc_cache_lines', 'preproc_cache_node', 'preproc_cache_guards', 'cache_listdir', 'file_stamps'):
+			try:
+				delattr(self, x)
+			except AttributeError:
+				pass
+
+		cache = getattr(self, 'cache_sig', {})
+		changed = set()
+		for x in paths:
+			# the status of the file may be unchanged within the timestamp resolution
+			self.file_sigs.pop(x, None)
+			node = self.root.find_node(x)
+			if node:
+				changed.add(node)
+				cache.pop(node, None)
+
+		groups = self.get_all_tasks()
+		users = Utils.defaultdict(list)
+		after = Utils.defaultdict(list)
+		dirty = set()
+		for lst in groups:
+			for tsk in lst:
+				for x in self.get_deps(tsk):
+					users[x].append(tsk)
+				for x in tsk.run_after:
+					if isinstance(x, Task.Task):
+						after[x].append(tsk)
+				if tsk.hasrun not in (Task.SUCCESS, Task.SKIPPED):
+					dirty.add(tsk)
+
+		todo = list(dirty)
+		for x in changed:
+			todo.extend(users.get(x, []))
+		while todo:
+			tsk = todo.pop()
+			dirty.add(tsk)
+			for x in tsk.outputs:
+				for k in users.get(x, []):
+					if not k in dirty:
+						todo.append(k)
+			for k in after.get(tsk, []):
+				if not k in dirty:
+					todo.append(k)
+
+		if not dirty:
+			# lock files, etc
+			return False
+
+		self.dirty_groups = []
+		for lst in groups:
+			tasks = [x for x in lst if x in dirty]
+			for tsk in tasks:
+				tsk.hasrun = Task.NOT_RUN
+				try:
+					del tsk.cache_sig
+				except AttributeError:
+					pass
+				for x in tsk.outputs:
+					cache.pop(x, None)
+				# the ordering constraints between task groups were consumed by the previous build
+				tsk.run_after = set(x for x in tsk.run_after if not isinstance(x, Task.TaskGroup))
+			if tasks:
+				Task.set_file_constraints(tasks)
+				Task.set_precedence_constraints(tasks)
+				self.dirty_groups.append(tasks)
+
+		Logs.info('Waf: %d files changed, %d tasks to check', len(changed), len(dirty))
+		Logs.info("Waf: Entering directory `%s'", self.variant_dir)
+		self.pre_build()
+		self.timer = Utils.Timer()
+		try:
+			self.compile()
+		finally:
+			self.dirty_groups = None
+			Logs.info("Waf: Leaving directory `%s'", self.variant_dir)
+		try:
+			self.producer.bld = None
+			del self.producer
+		except AttributeError:
+			pass
+		self.post_build()
+		Logs.info('Waf: Build finished (%s)', self.timer)
+		return True
+
+	dirty_groups = None
+	"""Tasks to execute by build group during incremental builds, see :py:meth:`WatchContext.rebuild`"""
+
+	def get_build_iterator(self):
+		"""
+		Returns the tasks given by :py:meth:`WatchContext.rebuild` for incremental builds,
+		see :py:meth:`waflib.Build.BuildContext.get_build_iterator`
+		"""
+		if self.dirty_groups is None:
+			for x in Build.BuildContext.get_build_iterator(self):
+				yield x
+			return
+		for tasks in self.dirty_groups:
+			self.cur_tasks = tasks
+			yield tasks
+		while 1:
+			yield []
+
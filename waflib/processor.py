@@ -2,7 +2,7 @@
 # encoding: utf-8
 # Thomas Nagy, 2016-2018 (ita)
 
-import os, sys, traceback, base64, signal
+import os, sys, traceback, base64, signal, errno, time
 try:
 	import cPickle
 except ImportError:
@@ -19,7 +19,45 @@ except AttributeError:
 	class TimeoutExpired(Exception):
 		pass
 
+maxrss = None
+if hasattr(os, 'wait4'):
+	class Popen(subprocess.Popen):
+		# see waflib.Utils.Popen and waflib.Utils.wait4
+		def wait(self, timeout=None):
+			global maxrss
+			if self.returncode is None:
+				if timeout is not None:
+					end = time.time() + timeout
+				delay = 0.0005
+				while 1:
+					try:
+						(pid, sts, usage) = os.wait4(self.pid, 0 if timeout is None else os.WNOHANG)
+					except OSError as e:
+						if e.errno == errno.EINTR:
+							continue
+						if e.errno != errno.ECHILD:
+							raise
+						return subprocess.Popen.wait(self)
+					if pid == self.pid:
+						break
+					remaining = end - time.time()
+					if remaining <= 0:
+						raise TimeoutExpired(self.args, timeout)
+					delay = min(delay * 2, remaining, .05)
+					time.sleep(delay)
+				if os.WIFSIGNALED(sts):
+					self.returncode = -os.WTERMSIG(sts)
+				else:
+					self.returncode = os.WEXITSTATUS(sts)
+				maxrss = usage.ru_maxrss
+				if sys.platform == 'darwin':
+					maxrss //= 1024
+			return self.returncode
+else:
+	Popen = subprocess.Popen
+
 def run():
+	global maxrss
 	txt = sys.stdin.readline().strip()
 	if not txt:
 		# parent process probably ended
@@ -32,9 +70,9 @@ def run():
 		kwargs['close_fds'] = False
 
 	ret = 1
-	out, err, ex, trace = (None, None, None, None)
+	out, err, ex, trace, maxrss = (None, None, None, None, None)
 	try:
-		proc = subprocess.Popen(cmd, **kwargs)
+		proc = Popen(cmd, **kwargs)
 		try:
 			out, err = proc.communicate(**cargs)
 		except TimeoutExpired:
@@ -54,7 +92,7 @@ def run():
 		ex = e.__class__.__name__
 
 	# it is just text so maybe we do not need to pickle()
-	tmp = [ret, out, err, ex, trace]
+	tmp = [ret, out, err, ex, trace, maxrss]
 	obj = base64.b64encode(cPickle.dumps(tmp))
 	sys.stdout.write(obj.decode())
 	sys.stdout.write('\n')